@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+#   Micro-benchmark for index key generation, compares the original exec'd str.format
+#   lambda with the compiled key extractor now used by Index.
+#
+from timeit import timeit
+from pynndb.index import _compile_spec
+
+record = {
+    'origin': 'linux.co.uk',
+    'sid': 12345,
+    'when': 1508236800.123,
+    'day': 3,
+    'hour': 17,
+    'name': 'Gareth Bult',
+    'age': 21,
+    'admin': True,
+    'cat': 'A',
+}
+for i in range(20):
+    record['field{}'.format(i)] = 'value {}'.format(i)
+
+
+def str_format(spec):
+    return lambda r: spec.format(**r).encode()
+
+
+specs = ['{sid}', '{name}', '{age:03}{name}', '!{origin}|{day:02}|{hour:02}|{sid:05}']
+count = 200000
+
+print('** Index key generation, {} calls per spec, {} field record'.format(count, len(record)))
+print('')
+for spec in specs:
+    old = str_format(spec)
+    new = _compile_spec(spec)
+    assert [old(record)] == new(record)
+    t_old = timeit(lambda: old(record), number=count)
+    t_new = timeit(lambda: new(record), number=count)
+    print("  - {:40} str.format = {:8.0f}/sec  compiled = {:8.0f}/sec  ({:.2f}x)".format(
+        spec, count / t_old, count / t_new, t_old / t_new))
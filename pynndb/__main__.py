@@ -0,0 +1,107 @@
+"""
+Command line tools for moving data in and out of a database;
+
+    python -m pynndb export <database> <table> [-o file] [-f ndjson|msgpack]
+    python -m pynndb import <database> <file> [-t table] [-f ndjson|msgpack] [-b batch]
+
+and for serving a database to other processes (see pynndb.client);
+
+    python -m pynndb serve <database> (-s socket | -p port [-H host])
+"""
+import sys
+from argparse import ArgumentParser
+from time import time
+from .database import Database
+from .dump import FORMATS, export_table, import_table
+from .server import Server
+
+
+def _format(path, format):
+    """
+    Choose a file format, from the command line or else the file extension
+    """
+    if format:
+        return format
+    return 'msgpack' if path and path.endswith(('.msgpack', '.mp')) else 'ndjson'
+
+
+def _progress(verb):
+    """
+    Generate a progress callback that reports the record count and throughput on stderr
+    """
+    begin = time()
+
+    def progress(count):
+        elapsed = max(time() - begin, 1e-6)
+        sys.stderr.write('\r{} {} records, {:.0f}/sec'.format(verb, count, count / elapsed))
+        sys.stderr.flush()
+    return progress
+
+
+def main(args=None):
+    parser = ArgumentParser(prog='python -m pynndb', description='pynndb data movement tools')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    export = commands.add_parser('export', help='write a table and its index definitions to a file')
+    export.add_argument('database', help='path to the database')
+    export.add_argument('table', help='the table to export')
+    export.add_argument('-o', '--output', help='output file (default: stdout)')
+    export.add_argument('-f', '--format', choices=FORMATS, help='file format (default: from the file name)')
+
+    load = commands.add_parser('import', help='bulk load a file written by export')
+    load.add_argument('database', help='path to the database')
+    load.add_argument('input', help='input file, "-" for stdin')
+    load.add_argument('-t', '--table', help='the table to load into (default: the exported table)')
+    load.add_argument('-f', '--format', choices=FORMATS, help='file format (default: from the file name)')
+    load.add_argument('-b', '--batch', type=int, default=10000, help='records sorted and written at a time')
+    load.add_argument('-q', '--quiet', action='store_true', help='do not report progress')
+
+    serve = commands.add_parser('serve', help='serve the database to other processes')
+    serve.add_argument('database', help='path to the database')
+    where = serve.add_mutually_exclusive_group(required=True)
+    where.add_argument('-s', '--socket', help='listen on a Unix socket')
+    where.add_argument('-p', '--port', type=int, help='listen on a TCP port')
+    serve.add_argument('-H', '--host', default='127.0.0.1', help='the address to listen on with --port')
+
+    args = parser.parse_args(args)
+    if args.command == 'serve':
+        db = Database(args.database)
+        server = Server(db, args.socket or (args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            db.close()
+        return 0
+    db = Database(args.database, binlog=False)
+    try:
+        if args.command == 'export':
+            format = _format(args.output, args.format)
+            progress = _progress('exported') if args.output else None
+            if args.output:
+                with open(args.output, 'wb') as fp:
+                    count = export_table(db, args.table, fp, format, progress)
+            else:
+                count = export_table(db, args.table, sys.stdout.buffer, format)
+            if progress:
+                sys.stderr.write('\n')
+            return count
+        format = _format(args.input, args.format)
+        progress = None if args.quiet else _progress('imported')
+        if args.input == '-':
+            name, count = import_table(db, sys.stdin.buffer, format, args.table, args.batch, progress)
+        else:
+            with open(args.input, 'rb') as fp:
+                name, count = import_table(db, fp, format, args.table, args.batch, progress)
+        if progress:
+            sys.stderr.write('\n')
+        return count
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
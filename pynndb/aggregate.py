@@ -0,0 +1,614 @@
+from bisect import bisect_right
+from ujson import loads, dumps
+from .index import _getter
+from .utils import xBadOperator
+
+
+class Count(object):
+    """
+    Count records, or if a field is given, records with a (non-null) value for that field.
+
+    Each aggregate can be applied a record at a time (add), to a list of values (batch), or
+    with NumPy to a whole column of values for many groups at once (reduce) with the partial
+    result for each group then merged into it's state (combine).
+    """
+    needs_field = False
+
+    def init(self):
+        return 0
+
+    def add(self, state, value):
+        return state + 1
+
+    def remove(self, state, value):
+        return state - 1
+
+    def batch(self, state, values):
+        return state + len(values)
+
+    def reduce(self, np, groups, values, size):
+        return np.bincount(groups, minlength=size).tolist()
+
+    def combine(self, state, partial):
+        return state + partial
+
+    def result(self, state):
+        return state
+
+
+def _sums(np, groups, values, size):
+    """
+    Sum a column by group, integer columns stay integers
+    """
+    if values.dtype.kind == 'f':
+        return np.bincount(groups, weights=values, minlength=size)
+    sums = np.zeros(size, dtype='int64')
+    np.add.at(sums, groups, values)
+    return sums
+
+
+class Sum(Count):
+    """
+    Sum the values of a field
+    """
+    needs_field = True
+
+    def add(self, state, value):
+        return state + value
+
+    def remove(self, state, value):
+        return state - value
+
+    def batch(self, state, values):
+        return state + sum(values)
+
+    def reduce(self, np, groups, values, size):
+        return _sums(np, groups, values, size).tolist()
+
+
+class Min(Count):
+    """
+    The lowest value of a field (this can not be maintained incrementally)
+    """
+    needs_field = True
+    remove = None
+    _ufunc = 'minimum'
+    _start = 'max'
+
+    def init(self):
+        return None
+
+    def add(self, state, value):
+        return value if state is None or value < state else state
+
+    def batch(self, state, values):
+        return self.add(state, min(values)) if values else state
+
+    def reduce(self, np, groups, values, size):
+        if not len(values):
+            return [None] * size
+        results = np.full(size, getattr(values, self._start)(), dtype=values.dtype)
+        getattr(np, self._ufunc).at(results, groups, values)
+        seen = np.bincount(groups, minlength=size) > 0
+        return [value if present else None for value, present in zip(results.tolist(), seen.tolist())]
+
+    def combine(self, state, partial):
+        return state if partial is None else self.add(state, partial)
+
+
+class Max(Min):
+    """
+    The highest value of a field
+    """
+    _ufunc = 'maximum'
+    _start = 'min'
+
+    def add(self, state, value):
+        return value if state is None or value > state else state
+
+    def batch(self, state, values):
+        return self.add(state, max(values)) if values else state
+
+
+class Avg(Count):
+    """
+    The mean value of a field
+    """
+    needs_field = True
+
+    def init(self):
+        return [0, 0]
+
+    def add(self, state, value):
+        state[0] += value
+        state[1] += 1
+        return state
+
+    def remove(self, state, value):
+        state[0] -= value
+        state[1] -= 1
+        return state
+
+    def batch(self, state, values):
+        state[0] += sum(values)
+        state[1] += len(values)
+        return state
+
+    def reduce(self, np, groups, values, size):
+        sums = _sums(np, groups, values, size).tolist()
+        counts = np.bincount(groups, minlength=size).tolist()
+        return list(zip(sums, counts))
+
+    def combine(self, state, partial):
+        state[0] += partial[0]
+        state[1] += partial[1]
+        return state
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+class Histogram(Count):
+    """
+    Count the values of a field falling into each bucket, for edges [a, b] the buckets
+    are < a, >= a and < b, and >= b
+    """
+    needs_field = True
+
+    def __init__(self, edges):
+        self._edges = sorted(edges)
+
+    def init(self):
+        return [0] * (len(self._edges) + 1)
+
+    def add(self, state, value):
+        state[bisect_right(self._edges, value)] += 1
+        return state
+
+    def remove(self, state, value):
+        state[bisect_right(self._edges, value)] -= 1
+        return state
+
+    def batch(self, state, values):
+        edges = self._edges
+        for value in values:
+            state[bisect_right(edges, value)] += 1
+        return state
+
+    def reduce(self, np, groups, values, size):
+        width = len(self._edges) + 1
+        buckets = np.searchsorted(np.asarray(self._edges), values, side='right')
+        return np.bincount(groups * width + buckets, minlength=size * width).reshape(size, width).tolist()
+
+    def combine(self, state, partial):
+        for bucket, count in enumerate(partial):
+            state[bucket] += count
+        return state
+
+    def result(self, state):
+        return list(state)
+
+
+AGGREGATES = {
+    'count': Count,
+    'sum': Sum,
+    'min': Min,
+    'max': Max,
+    'avg': Avg,
+    'histogram': Histogram
+}
+
+
+class Aggregation(object):
+    """
+    A compiled aggregation pipeline, this holds the per-group state while records are streamed
+    through it. The pipeline is a dict of the form;
+
+        {
+            'group': ['cat'],
+            'fields': {
+                'people': ('count',),
+                'total': ('sum', 'age'),
+                'oldest': ('max', 'address.age'),
+                'ages': ('histogram', 'age', [18, 65])
+            }
+        }
+
+    Records with a missing or null value for a field are ignored by that field's aggregate.
+
+    :param pipeline: The aggregation specification
+    :type pipeline: dict
+    """
+    def __init__(self, pipeline):
+        group = pipeline.get('group') or []
+        self._group = [group] if isinstance(group, str) else list(group)
+        self._group_getters = [_getter(field.split('.')) for field in self._group]
+        self._paths = set(field.split('.')[0] for field in self._group)
+        self._fields = []
+        for name, spec in pipeline.get('fields', {}).items():
+            spec = (spec,) if isinstance(spec, str) else tuple(spec)
+            if spec[0] not in AGGREGATES:
+                raise xBadOperator(spec[0])
+            op = AGGREGATES[spec[0]](*spec[2:])
+            if op.needs_field and (len(spec) < 2 or not spec[1]):
+                raise xBadOperator('{} ({}) needs a field'.format(spec[0], name))
+            getter = None
+            if len(spec) > 1 and spec[1]:
+                getter = _getter(spec[1].split('.'))
+                self._paths.add(spec[1].split('.')[0])
+            self._fields.append((name, op, getter))
+        self._groups = {}
+
+    @property
+    def group(self):
+        """
+        PROPERTY - The fields we are grouping by
+
+        :getter: A list of field names
+        :type: list
+        """
+        return self._group
+
+    @property
+    def fields(self):
+        """
+        PROPERTY - The (top level) record fields this aggregation reads
+
+        :getter: Field names
+        :type: set
+        """
+        return self._paths
+
+    def _key(self, record):
+        """
+        Generate the group key for a record
+        """
+        key = []
+        for get in self._group_getters:
+            try:
+                key.append(get(record))
+            except KeyError:
+                key.append(None)
+        return tuple(key)
+
+    def _state(self, key):
+        """
+        Return the state for a group, creating it if this is a new group
+        """
+        state = self._groups.get(key)
+        if state is None:
+            state = self._groups[key] = [op.init() for name, op, get in self._fields]
+        return state
+
+    def add(self, record):
+        """
+        Add a single record to the aggregation
+
+        :param record: The record to add
+        :type record: dict
+        :return: The group key for the record
+        :rtype: tuple
+        """
+        key = self._key(record)
+        state = self._state(key)
+        for position, (name, op, get) in enumerate(self._fields):
+            if get:
+                try:
+                    value = get(record)
+                except KeyError:
+                    continue
+            else:
+                value = None
+            state[position] = op.add(state[position], value)
+        return key
+
+    def add_batch(self, records):
+        """
+        Add a batch of records to the aggregation. Each field is decoded into one column for the
+        whole batch, and with NumPy each aggregate is computed for every group in the batch with
+        a single vectorised reduction over that column. Without NumPy (or for a column that isn't
+        numeric) the records are split into groups and each aggregate runs over a list per group.
+
+        :param records: The records to add
+        :type records: list
+        :return: The group keys in the order they were first seen in this batch
+        :rtype: list
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return self._add_lists(records)
+        positions = {}
+        inverse = []
+        for record in records:
+            inverse.append(positions.setdefault(self._key(record), len(positions)))
+        keys = list(positions)
+        inverse = np.asarray(inverse, dtype='intp')
+        states = [self._state(key) for key in keys]
+        for position, (name, op, get) in enumerate(self._fields):
+            if get:
+                rows, values = _column(records, get, True)
+                groups = inverse[np.asarray(rows, dtype='intp')]
+                values = np.asarray(values)
+                if op.needs_field and (values.dtype.kind not in 'biuf' or values.ndim != 1):
+                    lists = [[] for key in keys]
+                    for group, value in zip(groups.tolist(), values.tolist()):
+                        lists[group].append(value)
+                    for state, values in zip(states, lists):
+                        state[position] = op.batch(state[position], values)
+                    continue
+            else:
+                groups, values = inverse, None
+            for state, partial in zip(states, op.reduce(np, groups, values, len(keys))):
+                state[position] = op.combine(state[position], partial)
+        return keys
+
+    def _add_lists(self, records):
+        """
+        Add a batch of records without NumPy, the records are split into groups and then decoded
+        into one list per field and group
+        """
+        if self._group:
+            groups = {}
+            for record in records:
+                key = self._key(record)
+                rows = groups.get(key)
+                if rows is None:
+                    groups[key] = [record]
+                else:
+                    rows.append(record)
+        else:
+            groups = {(): records}
+        for key, rows in groups.items():
+            state = self._state(key)
+            for position, (name, op, get) in enumerate(self._fields):
+                state[position] = op.batch(state[position], _column(rows, get) if get else rows)
+        return list(groups)
+
+    def pop(self, key):
+        """
+        Remove a group and return it's results
+
+        :param key: A group key
+        :type key: tuple
+        :return: The results for the group
+        :rtype: dict
+        """
+        return self._result(key, self._groups.pop(key))
+
+    def _result(self, key, state):
+        """
+        Generate the results for a group from it's state
+        """
+        result = dict(zip(self._group, key))
+        for position, (name, op, get) in enumerate(self._fields):
+            result[name] = op.result(state[position])
+        return result
+
+    def flush(self, keep=None):
+        """
+        Remove and return the results for all groups other than the one we're keeping
+
+        :param keep: The key of a group which may still be receiving records
+        :type keep: tuple
+        :return: The results for each group (generator)
+        :rtype: dict
+        """
+        for key in list(self._groups):
+            if key != keep:
+                yield self.pop(key)
+
+
+class MaterializedAggregate(object):
+    """
+    An aggregation whose per-group state is stored in the database and updated in the same
+    transaction as each write to the table, so reading a group is a single lookup. Only
+    aggregates that can be reversed when a record is removed (count, sum, avg, histogram)
+    can be materialized.
+
+    :param ctx: A reference to the controlling Database object
+    :type ctx: Database
+    :param name: The name of the materialized aggregate
+    :type name: str
+    :param pipeline: The aggregation specification (see Aggregation)
+    :type pipeline: dict
+    :param conf: Configuration options for the storage database
+    :type conf: dict
+    :param txn: An open transaction
+    :type txn: Transaction
+    """
+    def __init__(self, ctx, name, pipeline, conf, txn):
+        self._ctx = ctx
+        self._name = name
+        self._pipeline = pipeline
+        self._aggregation = Aggregation(pipeline)
+        for field, op, get in self._aggregation._fields:
+            if not op.remove:
+                raise xBadOperator('{} can not be materialized'.format(field))
+        options = dict(conf)
+        if type(options['key']) is not bytes:
+            options['key'] = options['key'].encode()
+        self._db = self._ctx.env.open_db(**options, txn=txn)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def pipeline(self):
+        return self._pipeline
+
+    @property
+    def fields(self):
+        """
+        PROPERTY - The (top level) record fields this aggregate reads
+
+        :getter: Field names
+        :type: set
+        """
+        return self._aggregation.fields
+
+    def _apply(self, txn, key, changes):
+        """
+        Apply a list of (record, add) changes to the stored state for one group
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :param key: The group key
+        :type key: tuple
+        :param changes: Records to add (True) or remove (False)
+        :type changes: list
+        """
+        dbkey = dumps(list(key)).encode()
+        state = txn.get(dbkey, db=self._db)
+        if state:
+            state = loads(state.decode())
+        else:
+            state = [0] + [op.init() for name, op, get in self._aggregation._fields]
+        for record, add in changes:
+            state[0] += 1 if add else -1
+            for position, (name, op, get) in enumerate(self._aggregation._fields, 1):
+                if get:
+                    try:
+                        value = get(record)
+                    except KeyError:
+                        continue
+                else:
+                    value = None
+                state[position] = op.add(state[position], value) if add else op.remove(state[position], value)
+        if state[0] > 0:
+            txn.put(dbkey, dumps(state).encode(), db=self._db)
+        else:
+            txn.delete(dbkey, db=self._db)
+
+    def put(self, txn, key, record):
+        """
+        Add a new record to the aggregate
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :param key: The key of the record
+        :type key: bytes
+        :param record: The record being added
+        :type record: dict
+        :return: True
+        :rtype: bool
+        """
+        self._apply(txn, self._aggregation._key(record), [(record, True)])
+        return True
+
+    def delete(self, txn, key, record):
+        """
+        Remove a record from the aggregate
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :param key: The key of the record
+        :type key: bytes
+        :param record: The record being removed
+        :type record: dict
+        """
+        self._apply(txn, self._aggregation._key(record), [(record, False)])
+
+    def save(self, txn, key, old, rec):
+        """
+        Update the aggregate to reflect a change to a record
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :param key: The key of the record
+        :type key: bytes
+        :param old: The record in it's previous state
+        :type old: dict
+        :param rec: The record in it's amended state
+        :type rec: dict
+        """
+        if all(old.get(field) == rec.get(field) for field in self.fields):
+            return
+        old_key = self._aggregation._key(old)
+        new_key = self._aggregation._key(rec)
+        if old_key == new_key:
+            self._apply(txn, new_key, [(old, False), (rec, True)])
+        else:
+            self._apply(txn, old_key, [(old, False)])
+            self._apply(txn, new_key, [(rec, True)])
+
+    def get(self, group=(), txn=None):
+        """
+        Read the results for a single group
+
+        :param group: The value(s) of the group fields, for a single group field this may be
+                      the value itself rather than a tuple
+        :type group: tuple
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The results for the group, or None if the group has no records
+        :rtype: dict
+        """
+        if not isinstance(group, (tuple, list)):
+            group = (group,)
+        with self._ctx.env.begin() as transaction:
+            txn = txn if txn else transaction
+            state = txn.get(dumps(list(group)).encode(), db=self._db)
+            if not state:
+                return None
+            return self._aggregation._result(tuple(group), loads(state.decode())[1:])
+
+    def results(self, txn=None):
+        """
+        Read the results for all groups
+
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The results for each group (generator)
+        :rtype: dict
+        """
+        with self._ctx.env.begin() as transaction:
+            txn = txn if txn else transaction
+            with txn.cursor(self._db) as cursor:
+                for key, state in cursor.iternext(keys=True, values=True):
+                    yield self._aggregation._result(tuple(loads(key.decode())), loads(state.decode())[1:])
+
+    def empty(self, txn):
+        """
+        Clear all stored state
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        """
+        return txn.drop(self._db, delete=False)
+
+    def drop(self, txn):
+        """
+        Drop the storage for this aggregate
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        """
+        txn.drop(self._db, delete=True)
+
+
+def _column(records, get, rows=False):
+    """
+    Decode a single field from a list of records into a column, skipping missing and null values
+
+    :param records: The records to decode
+    :type records: list
+    :param get: A field getter (see index._getter)
+    :type get: function
+    :param rows: Also return the position in records of each value
+    :type rows: bool
+    :return: The field values, or a tuple of (positions, values)
+    :rtype: list
+    """
+    column = []
+    positions = []
+    for row, record in enumerate(records):
+        try:
+            value = get(record)
+        except KeyError:
+            continue
+        if value is not None:
+            column.append(value)
+            positions.append(row)
+    return (positions, column) if rows else column
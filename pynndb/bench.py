@@ -0,0 +1,346 @@
+"""
+A repeatable benchmark suite;
+
+    python -m pynndb.bench [-n records] [-s sizes] [-i indexes] [--binlog on|off|both]
+                           [-r repeat] [-o results.json] [-b baseline.json] [-t tolerance]
+
+Every combination of record size, index count and binlog setting is run against a fresh
+database in a temporary directory, each operation is timed on it's own (setup excluded) and
+the best of the repeats is reported. Records are generated from a fixed seed so runs are
+comparable. The results are written as JSON, and if a baseline (the output of an earlier run)
+is given each rate is compared against it, the exit status is 1 if anything is slower than the
+baseline by more than the tolerance.
+"""
+import json
+import lmdb
+import platform
+import sys
+from argparse import ArgumentParser
+from importlib.util import find_spec
+from io import BytesIO
+from itertools import product
+from random import Random
+from shutil import rmtree
+from statistics import median
+from string import ascii_letters
+from tempfile import mkdtemp
+from time import perf_counter, time
+from . import __version__
+from .database import Database
+from .dump import export_table, import_table
+
+BATCH = 1000
+GROUPS = 10
+INDEXES = (
+    ('by_serial', '{serial:08}', False),
+    ('by_group', '{group}', True),
+    ('by_name', '{name}', False),
+    ('by_group_serial', '{group:02}|{serial:08}', False),
+)
+
+
+def formats():
+    """
+    The export formats available here (msgpack is optional)
+    """
+    return [format for format in ('ndjson', 'msgpack') if format == 'ndjson' or find_spec(format)]
+
+
+def generate(records, size, seed=1):
+    """
+    Generate the test records
+
+    :param records: The number of records
+    :type records: int
+    :param size: The length of the payload in each record
+    :type size: int
+    :param seed: The random seed
+    :type seed: int
+    :return: The records
+    :rtype: list
+    """
+    rnd = Random(seed)
+    return [{
+        'serial': serial,
+        'group': serial % GROUPS,
+        'name': ''.join(rnd.choices(ascii_letters, k=12)),
+        'when': 1500000000 + serial,
+        'payload': ''.join(rnd.choices(ascii_letters, k=size))
+    } for serial in range(records)]
+
+
+class _Timer(object):
+    """
+    Collect the time taken by each operation in one run
+    """
+    def __init__(self):
+        self.results = {}
+
+    def __call__(self, op, count, function, *args):
+        start = perf_counter()
+        function(*args)
+        self.results[op] = (perf_counter() - start, count)
+
+
+def _batches(items, size=BATCH):
+    for position in range(0, len(items), size):
+        yield items[position:position + size]
+
+
+def run_case(path, data, indexes, binlog, seed=1):
+    """
+    Run every operation once against a new database
+
+    :param path: Where to create the database (must not exist)
+    :type path: str
+    :param data: The records to use, from generate
+    :type data: list
+    :param indexes: The number of indexes on each table
+    :type indexes: int
+    :param binlog: Whether the database keeps a binlog
+    :type binlog: bool
+    :param seed: The random seed for the access order
+    :type seed: int
+    :return: {op: (seconds, count)}
+    :rtype: dict
+    """
+    rnd = Random(seed)
+    timer = _Timer()
+    records = len(data)
+    db = Database(path, binlog=binlog)
+    try:
+        single = db.table('single')
+        table = db.table('bench')
+        for name, func, duplicates in INDEXES[:indexes]:
+            single.index(name, func, duplicates)
+            table.index(name, func, duplicates)
+
+        def append_single(rows):
+            for row in rows:
+                with db.begin() as txn:
+                    txn.append(single, dict(row))
+
+        def append_batch(rows):
+            for batch in _batches(rows):
+                with db.begin() as txn:
+                    for row in batch:
+                        txn.append(table, dict(row))
+
+        timer('append_single', max(records // 10, 1), append_single, data[:max(records // 10, 1)])
+        timer('append_batch', records, append_batch, data)
+
+        keys = [doc['_id'] for doc in table.find()]
+        rnd.shuffle(keys)
+
+        def get():
+            for key in keys:
+                table.get(key)
+
+        def seek(serials):
+            for serial in serials:
+                for doc in table.seek('by_serial', {'serial': serial}):
+                    pass
+
+        def range_scan():
+            step = -(-records // GROUPS)
+            for lower in range(0, records, step):
+                for doc in table.range('by_serial', {'serial': lower}, {'serial': lower + step - 1}):
+                    pass
+
+        def find_filter():
+            for doc in table.find(expression=lambda doc: doc['group'] == 0):
+                pass
+
+        def reindex():
+            with db.env.begin(write=True) as txn:
+                table.reindex(txn=txn)
+
+        timer('get', records, get)
+        if indexes:
+            serials = list(range(records))
+            rnd.shuffle(serials)
+            timer('seek', records, seek, serials)
+            timer('range', records, range_scan)
+        timer('find_filter', records, find_filter)
+        if indexes:
+            timer('reindex', records, reindex)
+
+        for format in formats():
+            buffer = BytesIO()
+            timer('export_' + format, records, export_table, db, 'bench', buffer, format)
+            buffer.seek(0)
+            timer('import_' + format, records, import_table, db, buffer, format, 'import_' + format)
+
+        docs = list(table.find())
+        for doc in docs:
+            doc['when'] += 1
+        rnd.shuffle(docs)
+
+        def save():
+            for batch in _batches(docs):
+                with db.begin() as txn:
+                    for doc in batch:
+                        txn.save(table, doc)
+
+        def delete():
+            for batch in _batches(keys):
+                with db.begin() as txn:
+                    txn.delete(table, batch)
+
+        timer('save', records, save)
+        timer('delete', records, delete)
+    finally:
+        db.close()
+    return timer.results
+
+
+def run(records=10000, sizes=(100, 1000), indexes=(0, 1, 3), binlog=(False, True), repeat=3, seed=1,
+        directory=None, progress=None):
+    """
+    Run the suite over every combination of record size, index count and binlog setting
+
+    :param records: The number of records in each table
+    :type records: int
+    :param sizes: The record payload sizes to try
+    :type sizes: list
+    :param indexes: The index counts to try (at most len(INDEXES))
+    :type indexes: list
+    :param binlog: The binlog settings to try
+    :type binlog: list
+    :param repeat: The number of times to run each case, the best time is reported
+    :type repeat: int
+    :param seed: The random seed
+    :type seed: int
+    :param directory: Where to create the databases, a temporary directory by default
+    :type directory: str
+    :param progress: An optional function called with a description of each case as it starts
+    :type progress: function
+    :return: {'meta': ..., 'results': [...]}
+    :rtype: dict
+    """
+    base = mkdtemp(prefix='pynndb-bench-', dir=directory)
+    results = []
+    try:
+        for size, count, logged in product(sizes, indexes, binlog):
+            if progress:
+                progress('size={} indexes={} binlog={}'.format(size, count, logged))
+            data = generate(records, size, seed)
+            times = {}
+            for run_number in range(repeat):
+                path = '{}/{}-{}-{}-{}'.format(base, size, count, int(logged), run_number)
+                for op, (seconds, ops) in run_case(path, data, count, logged, seed).items():
+                    times.setdefault(op, (ops, []))[1].append(seconds)
+                rmtree(path)
+            for op, (ops, seconds) in times.items():
+                results.append({
+                    'op': op,
+                    'size': size,
+                    'indexes': count,
+                    'binlog': logged,
+                    'count': ops,
+                    'seconds': min(seconds),
+                    'median': median(seconds),
+                    'rate': ops / max(min(seconds), 1e-9)
+                })
+    finally:
+        rmtree(base, ignore_errors=True)
+    return {
+        'meta': {
+            'version': __version__,
+            'python': platform.python_version(),
+            'lmdb': lmdb.__version__,
+            'platform': platform.platform(),
+            'records': records,
+            'repeat': repeat,
+            'seed': seed,
+            'when': time()
+        },
+        'results': results
+    }
+
+
+def _key(result):
+    return result['op'], result['size'], result['indexes'], result['binlog']
+
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    Compare the rates in two sets of results, cases missing from either are ignored
+
+    :param current: The output of run
+    :type current: dict
+    :param baseline: The output of an earlier run
+    :type baseline: dict
+    :param tolerance: The fractional slowdown allowed before a case counts as a regression
+    :type tolerance: float
+    :return: One entry per case, with the baseline and current rates and the change
+    :rtype: list
+    """
+    before = {_key(result): result for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        old = before.get(_key(result))
+        if not old:
+            continue
+        change = result['rate'] / old['rate'] - 1
+        comparison.append({
+            'op': result['op'],
+            'size': result['size'],
+            'indexes': result['indexes'],
+            'binlog': result['binlog'],
+            'baseline': old['rate'],
+            'rate': result['rate'],
+            'change': change,
+            'regression': change < -tolerance
+        })
+    return comparison
+
+
+def _numbers(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def main(args=None):
+    parser = ArgumentParser(prog='python -m pynndb.bench', description='pynndb benchmark suite')
+    parser.add_argument('-n', '--records', type=int, default=10000, help='records per table')
+    parser.add_argument('-s', '--sizes', type=_numbers, default=[100, 1000],
+                        help='payload sizes, e.g. 100,1000')
+    parser.add_argument('-i', '--indexes', type=_numbers, default=[0, 1, 3], help='index counts, e.g. 0,1,3')
+    parser.add_argument('--binlog', choices=('on', 'off', 'both'), default='both', help='binlog setting')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per case, the best is reported')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('-d', '--directory',
+                        help='where to create the databases (default: a temporary directory)')
+    parser.add_argument('-o', '--output', help='write the results here (default: stdout)')
+    parser.add_argument('-b', '--baseline', help='compare against the results of an earlier run')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1, help='allowed slowdown (fraction)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not report progress')
+    args = parser.parse_args(args)
+    if any(count > len(INDEXES) for count in args.indexes):
+        parser.error('at most {} indexes'.format(len(INDEXES)))
+
+    def progress(case):
+        sys.stderr.write('{}\n'.format(case))
+
+    binlog = {'on': [True], 'off': [False], 'both': [False, True]}[args.binlog]
+    results = run(args.records, args.sizes, args.indexes, binlog, args.repeat, args.seed, args.directory,
+                  None if args.quiet else progress)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as io:
+            results['comparison'] = compare(results, json.load(io), args.tolerance)
+        regressions = [entry for entry in results['comparison'] if entry['regression']]
+        for entry in regressions:
+            sys.stderr.write('regression: {op} size={size} indexes={indexes} binlog={binlog} '
+                             '{baseline:.0f}/sec -> {rate:.0f}/sec ({change:+.1%})\n'.format(**entry))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as io:
+            io.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
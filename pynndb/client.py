@@ -0,0 +1,707 @@
+"""
+The client side of the local database server (see server.py), a Client connects to a server and
+hands out RemoteTable objects, which mirror the read and write methods of Table.
+
+A Client can be shared by any number of threads, requests from each are pipelined over the one
+connection and their responses may arrive in any order. A Pool spreads requests over several
+connections, and AsyncClient is the equivalent for asyncio. All of them coalesce concurrent
+single record gets on a table into one multi-get request.
+"""
+import asyncio
+import builtins
+import socket
+from collections import deque
+from itertools import cycle
+from sys import maxsize
+from threading import Condition, Event, Lock
+from ujson import loads
+from .server import REQUEST, RESPONSE, STATUS_OK, STATUS_MORE, STATUS_ERROR, CHUNK, \
+    read_frame, encode_frame, to_wire, from_wire
+from . import utils
+from .utils import xServerError
+
+
+def _raise(name, args):
+    """
+    Re-raise an error reported by the server, as the same exception if it's one of ours or a builtin
+    """
+    error = getattr(utils, name, None) or getattr(builtins, name, None)
+    if isinstance(error, type) and issubclass(error, Exception):
+        raise error(*args)
+    raise xServerError(name, *args)
+
+
+def _key(key):
+    """
+    Keys travel as strings
+    """
+    return key.decode() if isinstance(key, bytes) else key
+
+
+class _Slot(object):
+    """
+    A get waiting to be included in a multi-get
+    """
+    __slots__ = ('key', 'ready', 'done', 'record', 'error')
+
+    def __init__(self, key):
+        self.key = key
+        self.ready = Event()
+        self.done = False
+        self.record = None
+        self.error = None
+
+
+class _GetBatcher(object):
+    """
+    Coalesce single record gets made concurrently by different threads into multi-gets. The first
+    get on a table is sent straight away, any gets made while it's in flight are queued and sent
+    together as soon as it completes, by one of the threads waiting on them.
+
+    :param request: The function used to send a request, i.e. Client.request
+    :type request: function
+    """
+    def __init__(self, request):
+        self._request = request
+        self._lock = Lock()
+        self._queues = {}
+        self._busy = set()
+
+    def get(self, table, key):
+        """
+        Get a single record by key
+
+        :param table: The name of the table
+        :type table: str
+        :param key: The _id of the record
+        :type key: str
+        :return: The record, or None if it doesn't exist
+        :rtype: dict
+        """
+        slot = _Slot(key)
+        with self._lock:
+            self._queues.setdefault(table, []).append(slot)
+            lead = table not in self._busy
+            self._busy.add(table)
+        while True:
+            if lead:
+                self._flush(table)
+            slot.ready.wait()
+            if slot.done:
+                break
+            slot.ready.clear()
+            lead = True
+        if slot.error:
+            raise slot.error
+        return slot.record
+
+    def _flush(self, table):
+        """
+        Send one multi-get for everything queued on a table, then hand over to the next waiter
+        """
+        with self._lock:
+            batch = self._queues.pop(table, [])
+        try:
+            records = self._request('get', table, keys=[slot.key for slot in batch])
+            for slot, record in zip(batch, records):
+                slot.record = from_wire(record)
+        except Exception as error:
+            for slot in batch:
+                slot.error = error
+        for slot in batch:
+            slot.done = True
+            slot.ready.set()
+        with self._lock:
+            queue = self._queues.get(table)
+            if queue:
+                queue[0].ready.set()
+            else:
+                self._busy.discard(table)
+
+
+class _Remote(object):
+    """
+    Methods common to Client and Pool
+    """
+    _batcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, table, key):
+        """
+        Get a single record by key, batched with any other concurrent gets on the table
+        """
+        if self._batcher:
+            return self._batcher.get(table, _key(key))
+        return from_wire(self.request('get', table, keys=[_key(key)])[0])
+
+    def ping(self):
+        return self.request('ping')
+
+    @property
+    def tables(self):
+        return self.request('tables')
+
+    def table(self, name):
+        """
+        Get a handle for a table on the server (the table is created if it doesn't exist)
+
+        :param name: The name of the table
+        :type name: str
+        :return: The table
+        :rtype: RemoteTable
+        """
+        return RemoteTable(self, name)
+
+
+class Client(_Remote):
+    """
+    A connection to a database server, safe to share between threads
+
+    :param address: The server's socket path, or a (host, port) tuple
+    :type address: str|tuple
+    :param timeout: An optional socket timeout in seconds
+    :type timeout: float
+    :param batch: Coalesce concurrent gets into multi-gets
+    :type batch: bool
+    """
+    def __init__(self, address, timeout=None, batch=True):
+        if isinstance(address, tuple):
+            self._sock = socket.create_connection(address, timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            self._sock.connect(address)
+        self._rfile = self._sock.makefile('rb')
+        self._rid = 0
+        self._sending = Lock()
+        self._ready = Condition()
+        self._reading = False
+        self._frames = {}
+        self._discard = set()
+        self._batcher = _GetBatcher(self.request) if batch else None
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self._sock:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+
+    def send(self, op, table=None, **args):
+        """
+        Send a request without waiting for the response, use receive to collect it
+
+        :param op: The operation
+        :type op: str
+        :param table: The table the operation applies to
+        :type table: str
+        :return: The request id
+        :rtype: int
+        """
+        with self._sending:
+            self._rid += 1
+            self._sock.sendall(encode_frame(REQUEST, self._rid, [op, table, args]))
+            return self._rid
+
+    def _frame(self, rid):
+        """
+        Wait for the next response frame for a request. Whichever thread is waiting reads the
+        connection, holding on to frames for other requests until their threads collect them.
+        """
+        while True:
+            with self._ready:
+                while True:
+                    pending = self._frames.get(rid)
+                    if pending:
+                        frame = pending.popleft()
+                        if not pending:
+                            del self._frames[rid]
+                        return frame
+                    if not self._reading:
+                        break
+                    self._ready.wait()
+                self._reading = True
+            frame = None
+            try:
+                frame = read_frame(self._rfile, RESPONSE)
+            finally:
+                with self._ready:
+                    self._reading = False
+                    if frame is None:
+                        pass
+                    elif frame[0] in self._discard:
+                        if frame[1] != STATUS_MORE:
+                            self._discard.remove(frame[0])
+                    else:
+                        self._frames.setdefault(frame[0], deque()).append(frame[1:])
+                    self._ready.notify_all()
+            if frame is None:
+                raise ConnectionError('connection closed by server')
+
+    def receive(self, rid):
+        """
+        Wait for the response to a request
+
+        :param rid: The request id returned by send
+        :type rid: int
+        :return: The result of the request, for queries a list of all the records
+        """
+        results = []
+        while True:
+            status, body = self._frame(rid)
+            if status == STATUS_ERROR:
+                _raise(*body)
+            if status == STATUS_OK:
+                return results + body if results else body
+            results.extend(body)
+
+    def stream(self, rid):
+        """
+        Yield the records streamed in response to a query as they arrive
+
+        :param rid: The request id returned by send
+        :type rid: int
+        :return: The records (generator)
+        :rtype: dict
+        """
+        status = STATUS_MORE
+        try:
+            while status == STATUS_MORE:
+                status, body = self._frame(rid)
+                if status == STATUS_ERROR:
+                    _raise(*body)
+                for record in body:
+                    yield from_wire(record)
+        finally:
+            if status == STATUS_MORE:
+                self._abandon(rid)
+
+    def _abandon(self, rid):
+        """
+        Drop the rest of the response to a request that's no longer wanted (an unfinished query)
+        """
+        with self._ready:
+            pending = self._frames.pop(rid, [])
+            if not any(status != STATUS_MORE for status, body in pending):
+                self._discard.add(rid)
+
+    def request(self, op, table=None, **args):
+        """
+        Send a request and wait for the response
+        """
+        return self.receive(self.send(op, table, **args))
+
+    def query(self, op, table=None, **args):
+        """
+        Send a query and stream the results
+        """
+        return self.stream(self.send(op, table, **args))
+
+    def pipeline(self, requests):
+        """
+        Send a number of requests in one write, then collect the responses
+
+        :param requests: A list of (op, table, args) tuples
+        :type requests: list
+        :return: The results in request order
+        :rtype: list
+        """
+        with self._sending:
+            rids = list(range(self._rid + 1, self._rid + 1 + len(requests)))
+            self._rid += len(requests)
+            frames = [encode_frame(REQUEST, rid, list(request)) for rid, request in zip(rids, requests)]
+            self._sock.sendall(b''.join(frames))
+        return [self.receive(rid) for rid in rids]
+
+
+class Pool(_Remote):
+    """
+    A fixed set of persistent connections to a database server, requests are spread over the
+    connections in turn, each of which pipelines whatever it's given.
+
+    :param address: The server's socket path, or a (host, port) tuple
+    :type address: str|tuple
+    :param size: The number of connections
+    :type size: int
+    :param timeout: An optional socket timeout in seconds
+    :type timeout: float
+    :param batch: Coalesce concurrent gets into multi-gets
+    :type batch: bool
+    """
+    def __init__(self, address, size=4, timeout=None, batch=True):
+        self._clients = [Client(address, timeout, batch=False) for n in range(size)]
+        self._turn = cycle(self._clients)
+        self._lock = Lock()
+        self._batcher = _GetBatcher(self.request) if batch else None
+
+    @property
+    def size(self):
+        return len(self._clients)
+
+    def client(self):
+        """
+        The connection to use for the next request
+        """
+        with self._lock:
+            return next(self._turn)
+
+    def close(self):
+        """
+        Close all the connections
+        """
+        for client in self._clients:
+            client.close()
+
+    def request(self, op, table=None, **args):
+        return self.client().request(op, table, **args)
+
+    def query(self, op, table=None, **args):
+        return self.client().query(op, table, **args)
+
+    def pipeline(self, requests):
+        return self.client().pipeline(requests)
+
+
+class AsyncClient(object):
+    """
+    An asyncio connection to a database server, create with "await AsyncClient.connect(address)".
+    Requests from any number of tasks are pipelined over the connection and complete in whatever
+    order the server answers them.
+
+    :param reader: The connection's stream reader
+    :type reader: StreamReader
+    :param writer: The connection's stream writer
+    :type writer: StreamWriter
+    :param batch: Coalesce gets made in the same pass of the event loop into multi-gets
+    :type batch: bool
+    """
+    def __init__(self, reader, writer, batch=True):
+        self._reader = reader
+        self._writer = writer
+        self._batch = batch
+        self._rid = 0
+        self._queues = {}
+        self._gets = {}
+        self._task = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, address, batch=True):
+        """
+        Connect to a server
+
+        :param address: The server's socket path, or a (host, port) tuple
+        :type address: str|tuple
+        :return: The connection
+        :rtype: AsyncClient
+        """
+        if isinstance(address, tuple):
+            reader, writer = await asyncio.open_connection(*address)
+        else:
+            reader, writer = await asyncio.open_unix_connection(address)
+        return cls(reader, writer, batch)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the connection
+        """
+        self._task.cancel()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def _read(self):
+        """
+        Read response frames and hand them to the requests waiting on them
+        """
+        try:
+            while True:
+                length, rid, status = RESPONSE.unpack(await self._reader.readexactly(RESPONSE.size))
+                body = loads((await self._reader.readexactly(length)).decode())
+                queue = self._queues.get(rid)
+                if queue is not None:
+                    queue.put_nowait((status, body))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for queue in self._queues.values():
+                queue.put_nowait(None)
+
+    async def _send(self, op, table, args):
+        self._rid += 1
+        self._queues[self._rid] = asyncio.Queue()
+        self._writer.write(encode_frame(REQUEST, self._rid, [op, table, args]))
+        await self._writer.drain()
+        return self._rid
+
+    async def _frame(self, rid):
+        frame = await self._queues[rid].get()
+        if frame is None:
+            raise ConnectionError('connection closed by server')
+        if frame[0] == STATUS_ERROR:
+            _raise(*frame[1])
+        return frame
+
+    async def request(self, op, table=None, **args):
+        """
+        Send a request and wait for the response
+        """
+        rid = await self._send(op, table, args)
+        try:
+            results = []
+            while True:
+                status, body = await self._frame(rid)
+                if status == STATUS_OK:
+                    return results + body if results else body
+                results.extend(body)
+        finally:
+            del self._queues[rid]
+
+    async def query(self, op, table=None, **args):
+        """
+        Send a query and stream the results (an async generator)
+        """
+        rid = await self._send(op, table, args)
+        try:
+            status = STATUS_MORE
+            while status == STATUS_MORE:
+                status, body = await self._frame(rid)
+                for record in body:
+                    yield from_wire(record)
+        finally:
+            del self._queues[rid]
+
+    async def get(self, table, key):
+        """
+        Get a single record by key, gets on the same table made before the event loop next gets
+        a chance to run are sent as one multi-get
+        """
+        if not self._batch:
+            return from_wire((await self.request('get', table, keys=[_key(key)]))[0])
+        future = asyncio.get_running_loop().create_future()
+        pending = self._gets.setdefault(table, [])
+        pending.append((_key(key), future))
+        if len(pending) == 1:
+            asyncio.ensure_future(self._flush(table))
+        return await future
+
+    async def _flush(self, table):
+        batch = self._gets.pop(table, [])
+        try:
+            records = await self.request('get', table, keys=[key for key, future in batch])
+            for (key, future), record in zip(batch, records):
+                future.set_result(from_wire(record))
+        except Exception as error:
+            for key, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def ping(self):
+        return await self.request('ping')
+
+    @property
+    def tables(self):
+        return self.request('tables')
+
+    def table(self, name):
+        """
+        Get a handle for a table on the server, the methods of which are coroutines
+
+        :param name: The name of the table
+        :type name: str
+        :return: The table
+        :rtype: AsyncRemoteTable
+        """
+        return AsyncRemoteTable(self, name)
+
+
+class RemoteTable(object):
+    """
+    A table on a database server, with the same methods as Table. Filter expressions can't be
+    sent to the server, instead queries accept "match", a dict of values the records must have.
+
+    :param client: The connection (or pool) to use
+    :type client: Client|Pool
+    :param name: The name of the table
+    :type name: str
+    """
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def records(self):
+        return self._client.request('records', self._name)
+
+    def _request(self, op, **args):
+        return self._client.request(op, self._name, **args)
+
+    def _query(self, op, **args):
+        return self._client.query(op, self._name, **args)
+
+    @staticmethod
+    def _records(records, skip):
+        records = [from_wire(record) for record in records]
+        return [record for record in records if record is not None] if skip else records
+
+    @staticmethod
+    def _batches(records, batch):
+        for start in range(0, len(records), batch):
+            yield records[start:start + batch]
+
+    @staticmethod
+    def _loaded(chunk, keys):
+        for record, key in zip(chunk, keys):
+            record['_id'] = key.encode()
+        return len(chunk)
+
+    def indexes(self):
+        return self._request('indexes')
+
+    def ensure(self, index, func, duplicates=False, unique=False):
+        """
+        Create an index if it doesn't already exist
+        """
+        return self._request('ensure', index=index, func=func, duplicates=duplicates, unique=unique)
+
+    def get(self, key):
+        """
+        Get a single record by key, concurrent gets are batched into multi-gets
+
+        :param key: The _id of the record
+        :type key: bytes|str
+        :return: The record, or None if it doesn't exist
+        :rtype: dict
+        """
+        return self._client.get(self._name, key)
+
+    def get_many(self, keys, skip=True):
+        """
+        Get a number of records in a single request
+
+        :param keys: The _id's of the records
+        :type keys: list
+        :param skip: Leave out keys that don't exist, otherwise they come back as None
+        :type skip: bool
+        :return: The records in the order the keys were supplied
+        :rtype: list
+        """
+        return self._records(self._request('get', keys=[_key(key) for key in keys]), skip)
+
+    def append(self, record):
+        """
+        Append a new record, the record's _id is set as it would be by Table.append
+
+        :param record: The record to append
+        :type record: dict
+        """
+        self.load([record])
+
+    def load(self, records, batch=CHUNK):
+        """
+        Append a number of records, sending them to the server in batches (one transaction per batch)
+
+        :param records: The records to append
+        :type records: list
+        :param batch: The number of records to send per request
+        :type batch: int
+        :return: The number of records appended
+        :rtype: int
+        """
+        count = 0
+        for chunk in self._batches(records, batch):
+            keys = self._request('append', records=[to_wire(record) for record in chunk])
+            count += self._loaded(chunk, keys)
+        return count
+
+    def save(self, record):
+        """
+        Save changes to a pre-existing record
+        """
+        return self._request('save', records=[to_wire(record)])
+
+    def update(self, key, spec):
+        """
+        Apply update operators to a record (see Table.update)
+        """
+        return self._request('update', key=_key(key), spec=spec)
+
+    def delete(self, keys):
+        """
+        Delete records by key
+
+        :param keys: A list of database keys to delete or a record
+        :type keys: list|dict
+        """
+        if not isinstance(keys, list):
+            keys = [keys['_id']] if isinstance(keys, dict) else [keys]
+        return self._request('delete', keys=[_key(key) for key in keys])
+
+    def find(self, index=None, match=None, limit=maxsize, reverse=False, skip=0, chunk=CHUNK):
+        """
+        Find records in natural or index order, streamed from the server in chunks
+        """
+        return self._query('find', index=index, match=match, limit=limit, reverse=reverse, skip=skip,
+                           chunk=chunk)
+
+    def range(self, index, lower=None, upper=None, match=None, limit=maxsize, reverse=False, skip=0,
+              chunk=CHUNK):
+        """
+        Find the records with index keys between lower and upper (inclusive)
+        """
+        return self._query('range', index=index, lower=lower, upper=upper, match=match, limit=limit,
+                           reverse=reverse, skip=skip, chunk=chunk)
+
+    def seek(self, index, record, limit=maxsize, reverse=False, skip=0, chunk=CHUNK):
+        """
+        Find the records matching the key in an index
+        """
+        return self._query('seek', index=index, record=record, limit=limit, reverse=reverse, skip=skip,
+                           chunk=chunk)
+
+    def seek_one(self, index, record):
+        records = list(self.seek(index, record, limit=1))
+        return records[0] if records else None
+
+    def count(self, index, record):
+        return self._request('count', index=index, record=record)
+
+    def count_range(self, index, lower=None, upper=None):
+        return self._request('count_range', index=index, lower=lower, upper=upper)
+
+
+class AsyncRemoteTable(RemoteTable):
+    """
+    A table on a database server for use with AsyncClient, the methods are coroutines (and the
+    queries async generators)
+    """
+    async def get_many(self, keys, skip=True):
+        return self._records(await self._request('get', keys=[_key(key) for key in keys]), skip)
+
+    async def append(self, record):
+        await self.load([record])
+
+    async def load(self, records, batch=CHUNK):
+        count = 0
+        for chunk in self._batches(records, batch):
+            keys = await self._request('append', records=[to_wire(record) for record in chunk])
+            count += self._loaded(chunk, keys)
+        return count
+
+    async def seek_one(self, index, record):
+        records = [doc async for doc in self.seek(index, record, limit=1)]
+        return records[0] if records else None
@@ -0,0 +1,118 @@
+from .index import _getter
+
+
+class Column(object):
+    """
+    A growable, typed NumPy buffer for a single field. Values are gathered into a Python list
+    and converted a chunk at a time, the buffer doubles in size when full and is promoted to
+    a wider type if a chunk won't fit the current one (i.e. int -> float, or a longer string).
+    Missing and null values become NaN in a numeric column and None otherwise.
+
+    :param np: The numpy module
+    :type np: module
+    :param capacity: The initial size of the buffer
+    :type capacity: int
+    """
+    def __init__(self, np, capacity):
+        self._np = np
+        self._capacity = capacity
+        self._buffer = None
+        self._size = 0
+
+    def extend(self, values):
+        """
+        Append a chunk of values to the buffer
+
+        :param values: The values to append
+        :type values: list
+        """
+        np = self._np
+        types = set(map(type, values))
+        numeric = self._buffer is not None and self._buffer.dtype.kind in 'iuf'
+        if type(None) in types and types - {type(None)} <= {int, float} and (len(types) > 1 or numeric):
+            values = [np.nan if value is None else value for value in values]
+            types = {float}
+        if len(types) == 1 and types <= {int, float, bool, str, bytes} or types == {int, float}:
+            chunk = np.array(values)
+        else:
+            chunk = np.empty(len(values), dtype=object)
+            chunk[:] = values
+        if self._buffer is None:
+            self._buffer = np.empty(max(self._capacity, len(chunk)), dtype=chunk.dtype)
+        dtype = self._buffer.dtype
+        if chunk.dtype != dtype:
+            kinds = dtype.kind + chunk.dtype.kind
+            if set(kinds) <= set('iuf') or kinds in ('UU', 'SS'):
+                dtype = np.result_type(dtype, chunk.dtype)
+            else:
+                dtype = np.dtype(object)
+            self._buffer = self._buffer.astype(dtype)
+        if self._size + len(chunk) > len(self._buffer):
+            grown = np.empty(max(len(self._buffer) * 2, self._size + len(chunk)), dtype=dtype)
+            grown[:self._size] = self._buffer[:self._size]
+            self._buffer = grown
+        self._buffer[self._size:self._size + len(chunk)] = chunk
+        self._size += len(chunk)
+
+    def array(self):
+        """
+        Return the values collected so far
+
+        :return: The populated part of the buffer
+        :rtype: numpy.ndarray
+        """
+        if self._buffer is None:
+            return self._np.array([])
+        return self._buffer[:self._size]
+
+
+def to_columns(records, fields, chunk=4096, arrow=False):
+    """
+    Collect a stream of records into one typed array per field
+
+    :param records: The records to collect
+    :type records: generator
+    :param fields: The (dotted) names of the fields to collect, "_id" is the record key
+    :type fields: list
+    :param chunk: The number of records to gather before converting
+    :type chunk: int
+    :param arrow: Return a pyarrow RecordBatch rather than a dict of arrays
+    :type arrow: bool
+    :return: A dict of field name to numpy array, or a RecordBatch
+    :rtype: dict|pyarrow.RecordBatch
+    """
+    import numpy
+
+    def get(path):
+        getter = _getter(path)
+
+        def get_field(record):
+            try:
+                return getter(record)
+            except KeyError:
+                return None
+        return get_field
+
+    getters = [get(field.split('.')) for field in fields]
+    columns = [Column(numpy, chunk) for field in fields]
+    pending = [[] for field in fields]
+    count = 0
+    for record in records:
+        for values, getter in zip(pending, getters):
+            values.append(getter(record))
+        count += 1
+        if count == chunk:
+            for column, values in zip(columns, pending):
+                column.extend(values)
+                values.clear()
+            count = 0
+    if count:
+        for column, values in zip(columns, pending):
+            column.extend(values)
+
+    arrays = [column.array() for column in columns]
+    if arrow:
+        import pyarrow
+        return pyarrow.RecordBatch.from_arrays([pyarrow.array(array, from_pandas=True) for array in arrays],
+                                               names=list(fields))
+    return dict(zip(fields, arrays))
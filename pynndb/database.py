@@ -1,10 +1,16 @@
 import lmdb
 # from posix_ipc import Semaphore, ExistentialError, O_CREAT
-from struct import pack
-from ujson import dumps
+from os import makedirs
+from struct import pack, unpack
+from time import perf_counter
+from bson import ObjectId
+from ujson import loads, dumps
+from .metrics import Metrics, instrument, uninstrument, env_stats, prometheus
+from .partition import PartitionedTable
+from .slowlog import SlowLog
 from .table import Table
 from .transaction import Transaction
-from .utils import xTableMissing, xTableExists, semaphore_path
+from .utils import xTableMissing, xTableExists, xNotFound, xBinlogMissing, semaphore_path
 
 
 class Database(object):
@@ -32,6 +38,8 @@ class Database(object):
         conf = dict(self._conf, **conf.get('env', {})) if conf else self._conf
         if size: conf['map_size'] = size
         self._tables = {}
+        self._metrics = None
+        self._slowlog = None
         self._semaphore = False
         self._name = name
         self._env = lmdb.Environment(name, **conf)
@@ -54,8 +62,10 @@ class Database(object):
                 self._binidx = self._env.open_db(b'__binidx__', create=binlog)
                 with self._env.begin(write=True) as txn:
                     if not txn.stat(db=self._binlog)['entries']:
-                        dat = dumps({'txn': []}).encode()
+                        tid = str(ObjectId())
+                        dat = dumps({'txn': [], 'tid': tid}).encode()
                         txn.put(pack('>Q', 1), dat, db=self._binlog, append=False)
+                        txn.put(tid.encode(), pack('>Q', 1), db=self._binidx)
 
         except lmdb.NotFoundError:
             pass
@@ -106,6 +116,101 @@ class Database(object):
             self._binlog = None
             self._binidx = None
 
+    @property
+    def metrics(self):
+        """
+        PROPERTY - The metrics being collected for this database, None unless enabled with set_metrics
+
+        :getter: The metrics
+        :type: Metrics
+        """
+        return self._metrics
+
+    def set_metrics(self, enable=True):
+        """
+        Enable or disable the collection of metrics, operation latencies per table, records read,
+        index writes, commit and fsync times and binlog volume. When disabled the instrumentation
+        is removed entirely. Re-enabling starts from zero.
+
+        :param enable: Whether to enable or disable metrics
+        :type enable: bool
+        """
+        if enable and not self._metrics:
+            self._metrics = Metrics()
+        elif not enable and self._metrics:
+            self._metrics = None
+        else:
+            return
+        for table in self._tables.values():
+            self._instrument(table)
+
+    @property
+    def slowlog(self):
+        """
+        PROPERTY - The slow operation log for this database, None unless enabled with set_slowlog
+
+        :getter: The slow operation log
+        :type: SlowLog
+        """
+        return self._slowlog
+
+    def set_slowlog(self, enable=True, threshold=0.1, size=1000, persist=False):
+        """
+        Enable or disable the slow operation log, reads (get, find, range and seek) taking longer
+        than the threshold are recorded with their plan, the number of records examined and
+        returned and the bytes decoded. Enabling an already enabled log just changes the threshold.
+
+        :param enable: Whether to enable or disable the log
+        :type enable: bool
+        :param threshold: Operations taking longer than this (seconds) are recorded
+        :type threshold: float
+        :param size: The number of entries to keep in memory
+        :type size: int
+        :param persist: Also write entries to the __slowlog__ table
+        :type persist: bool
+        """
+        if enable and self._slowlog:
+            self._slowlog.threshold = threshold
+            return
+        if enable:
+            self._slowlog = SlowLog(self, threshold, size, persist)
+        elif self._slowlog:
+            self._slowlog.close()
+            self._slowlog = None
+        else:
+            return
+        for table in self._tables.values():
+            self._instrument(table)
+
+    def _instrument(self, table):
+        """
+        (Re)apply the metrics and slow log instrumentation to a table, slow log outermost
+        """
+        uninstrument(table)
+        if self._metrics:
+            instrument(self._metrics, table)
+        if self._slowlog:
+            self._slowlog.instrument(table)
+
+    def stats(self):
+        """
+        Pull the current metrics (if enabled) along with the environment's map usage, reader
+        slots and the entry and page counts of each open table
+
+        :return: {'env': ..., 'metrics': ...}
+        :rtype: dict
+        """
+        return {'env': env_stats(self), 'metrics': self._metrics.collect() if self._metrics else None}
+
+    def prometheus(self):
+        """
+        Format stats() for Prometheus
+
+        :return: Metrics in the Prometheus text exposition format
+        :rtype: str
+        """
+        return prometheus(self.stats())
+
     def begin(self, *args, **kwargs):
         """
         Begin a new transaction returning a transaction reference (use with "with")
@@ -119,11 +224,17 @@ class Database(object):
         Close the current database
         """
         if hasattr(self, '_env') and self._env:
+            if self._slowlog:
+                self._slowlog.close()
             self._env.close()
             self._env = None
 
     def sync(self, force=False):
+        if not self._metrics:
+            return self.env.sync(force)
+        start = perf_counter()
         self.env.sync(force)
+        self._metrics.observe('fsync_seconds', (), perf_counter() - start)
 
     def exists(self, name):
         """
@@ -210,6 +321,152 @@ class Database(object):
                 src.append(doc, txn=txn)
             self.drop(dst_name, txn=txn)
 
+    def binlog_position(self, txn=None):
+        """
+        Return the position of the most recent transaction in the binlog
+
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The binlog sequence number and transaction id, or None if there is no binlog
+        :rtype: dict
+        """
+        if not self._binlog:
+            return None
+        with self.env.begin() as transaction:
+            txn = txn if txn else transaction
+            with txn.cursor(self._binlog) as cursor:
+                if not cursor.last():
+                    return {'seq': 0, 'tid': None}
+                return {
+                    'seq': unpack('>Q', cursor.key())[0],
+                    'tid': loads(cursor.value().decode()).get('tid')
+                }
+
+    def backup(self, path, compact=True):
+        """
+        Take a hot backup of the database, the copy is made from a read transaction so writers are
+        not blocked, and the binlog position is read from the same transaction so the backup holds
+        exactly the transactions up to that position. Pass the backup to restore() to bring it
+        forward to a later point in time.
+
+        :param path: The directory to write the backup to (created if it doesn't exist)
+        :type path: str
+        :param compact: Omit free pages and renumber pages while copying
+        :type compact: bool
+        :return: The binlog position at the time of the copy (see binlog_position)
+        :rtype: dict
+        """
+        makedirs(path, exist_ok=True)
+        with self.env.begin() as txn:
+            position = self.binlog_position(txn)
+            self.env.copy(path, compact=compact, txn=txn)
+        return position
+
+    def restore(self, path, until=None, target=None):
+        """
+        Restore a backup to a point in time by replaying transactions from this database's
+        binlog, starting from the position the backup was taken at. The replayed binlog entries
+        are copied into the backup's own binlog so it can be rolled forward again later. Each
+        binlog starts with an entry holding an id unique to the database, so a backup of another
+        database is refused even if it was taken before anything else was logged.
+
+        :param path: The path to a backup taken with backup()
+        :type path: str
+        :param until: The last transaction to replay, a transaction id or binlog sequence number,
+                      or None to replay everything
+        :type until: str|int
+        :param target: Copy the backup here and restore the copy, leaving the backup untouched
+        :type target: str
+        :return: The restored database
+        :rtype: Database
+        :raises: xBinlogMissing if this binlog doesn't continue from the backup,
+                 xNotFound if the until transaction isn't in the binlog
+        """
+        if not self._binlog:
+            raise xBinlogMissing('binary logging is not enabled')
+        with self.env.begin() as txn:
+            if until is None:
+                last = self.binlog_position(txn)['seq']
+            elif isinstance(until, int):
+                last = until
+            else:
+                last = txn.get(until.encode() if isinstance(until, str) else until, db=self._binidx)
+                if not last: raise xNotFound(until)
+                last = unpack('>Q', last)[0]
+
+        if target:
+            backup = lmdb.open(path, max_dbs=self._conf['max_dbs'], readonly=True)
+            try:
+                makedirs(target, exist_ok=True)
+                backup.copy(target)
+            finally:
+                backup.close()
+            path = target
+
+        db = Database(path, binlog=False)
+        if '__binlog__' not in db.tables_all:
+            db.close()
+            raise xBinlogMissing('the backup has no binlog position')
+        db.set_binlog(True)
+        position = db.binlog_position()
+        with self.env.begin() as txn:
+            if position['seq'] >= 1:
+                entry = txn.get(pack('>Q', position['seq']), db=self._binlog)
+                if not entry or loads(entry.decode()).get('tid') != position['tid']:
+                    db.close()
+                    raise xBinlogMissing(position)
+            with txn.cursor(self._binlog) as cursor:
+                if cursor.set_range(pack('>Q', position['seq'] + 1)):
+                    for key, entry in cursor:
+                        if unpack('>Q', key)[0] > last:
+                            break
+                        db._replay(key, entry)
+        return db
+
+    def _replay(self, key, entry):
+        """
+        Apply a binlog entry (from another database) to this database in a single transaction, and
+        record it in this database's binlog at the same position
+
+        :param key: The binlog sequence key
+        :type key: bytes
+        :param entry: The binlog entry
+        :type entry: bytes
+        """
+        doc = loads(entry.decode())
+        with self.env.begin(write=True) as txn:
+            for op in doc['txn']:
+                cmd, name = op['cmd'], op['tab']
+                if cmd == 'cre':
+                    self.table(name, txn=txn)
+                    continue
+                if cmd == 'drp':
+                    self.drop(name, txn=txn)
+                    continue
+                table = self.table(name, txn=txn)
+                if cmd == 'add':
+                    record = dict(op['doc'])
+                    record['_id'] = record['_id'].encode()
+                    table.append(record, txn=txn)
+                elif cmd == 'sav':
+                    record = dict(op['doc'])
+                    record['_id'] = record['_id'].encode()
+                    table.save(record, txn=txn)
+                elif cmd == 'upd':
+                    table.update(op['key'].encode(), op['ops'], txn=txn)
+                elif cmd == 'del':
+                    table.delete([key.encode() for key in op['keys']], txn=txn)
+                elif cmd == 'emp':
+                    table.empty(txn=txn)
+                elif cmd == 'idx':
+                    table.index(op['idx'], op['fun'], op['dup'], txn=txn, unique=op.get('unq', False))
+                elif cmd == 'uix':
+                    table.drop_index(op['idx'], txn=txn)
+            if self._binlog:
+                txn.put(key, entry, db=self._binlog)
+                if doc.get('tid'):
+                    txn.put(doc['tid'].encode(), key, db=self._binidx)
+
     def table(self, name, txn=None):
         """
         Return a reference to a table with a given name, creating first if it doesn't exist
@@ -221,8 +478,26 @@ class Database(object):
         """
         if name not in self._tables:
             self._tables[name] = Table(self, name, txn)
+            if self._metrics or self._slowlog:
+                self._instrument(self._tables[name])
         return self._tables[name]
 
+    def partitioned(self, name, field='when', period='day'):
+        """
+        Return a reference to a time partitioned table, creating it first if it doesn't exist. The
+        field and period are fixed when the table is created.
+
+        :param name: Name of the (logical) table
+        :type name: str
+        :param field: The field holding each record's time
+        :type field: str
+        :param period: The partition size, "day" or "month"
+        :type period: str
+        :return: Reference to table
+        :rtype: PartitionedTable
+        """
+        return PartitionedTable(self, name, field, period)
+
     def size(self):
         """
         Return the current mapped size of the database
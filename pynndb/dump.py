@@ -0,0 +1,125 @@
+from ujson import loads, dumps
+from .utils import xTableMissing
+
+FORMATS = ('ndjson', 'msgpack')
+
+
+def _writer(fp, format):
+    """
+    Generate a function that writes one object to a (binary) output stream
+
+    :param fp: The output stream
+    :type fp: file
+    :param format: One of "ndjson" or "msgpack"
+    :type format: str
+    :return: A function taking an object to write
+    :rtype: function
+    """
+    if format == 'msgpack':
+        import msgpack
+        packer = msgpack.Packer()
+        return lambda obj: fp.write(packer.pack(obj))
+    return lambda obj: fp.write(dumps(obj).encode() + b'\n')
+
+
+def _reader(fp, format):
+    """
+    Generate the objects stored in a (binary) input stream
+
+    :param fp: The input stream
+    :type fp: file
+    :param format: One of "ndjson" or "msgpack"
+    :type format: str
+    :return: The objects in the stream (generator)
+    :rtype: dict
+    """
+    if format == 'msgpack':
+        import msgpack
+        yield from msgpack.Unpacker(fp, raw=False)
+        return
+    for line in fp:
+        if line.strip():
+            yield loads(line.decode())
+
+
+def export_table(db, name, fp, format='ndjson', progress=None):
+    """
+    Write a table to a stream, the first object written is a header holding the table name and
+    it's index and materialized aggregate definitions, followed by each record in key order.
+
+    :param db: An open database
+    :type db: Database
+    :param name: The name of the table to export
+    :type name: str
+    :param fp: The (binary) output stream
+    :type fp: file
+    :param format: One of "ndjson" or "msgpack"
+    :type format: str
+    :param progress: An optional function called periodically with the number of records written
+    :type progress: function
+    :return: The number of records written
+    :rtype: int
+    :raises xTableMissing: If the table doesn't exist
+    """
+    if name not in db.tables_all:
+        raise xTableMissing(name)
+    table = db.table(name)
+    write = _writer(fp, format)
+    indexes = table._indexes
+    views = table._views
+    write({
+        'table': name,
+        'indexes': [{
+            'name': index,
+            'func': indexes[index].func,
+            'duplicates': indexes[index].duplicates,
+            'unique': indexes[index].unique
+        } for index in sorted(indexes)],
+        'views': {view: views[view].pipeline for view in sorted(views)}
+    })
+    count = 0
+    with table.begin() as txn:
+        for record in table.find(txn=txn):
+            record['_id'] = record['_id'].decode()
+            write(record)
+            count += 1
+            if progress and not count % 10000:
+                progress(count)
+    if progress:
+        progress(count)
+    return count
+
+
+def import_table(db, fp, format='ndjson', name=None, batch=10000, progress=None):
+    """
+    Load a stream written by export_table into a table, creating the table along with it's
+    indexes and materialized aggregates if they don't already exist. Records are bulk loaded
+    (see Table.load) and the indexes are built once all the records have been written. Like
+    Table.load, an import is not recorded in the binlog.
+
+    :param db: An open database
+    :type db: Database
+    :param fp: The (binary) input stream
+    :type fp: file
+    :param format: One of "ndjson" or "msgpack"
+    :type format: str
+    :param name: The table to load into, defaults to the name of the exported table
+    :type name: str
+    :param batch: The number of records to sort and write at a time
+    :type batch: int
+    :param progress: An optional function called with the number of records loaded so far
+    :type progress: function
+    :return: The name of the table, and the number of records loaded
+    :rtype: tuple
+    """
+    objects = _reader(fp, format)
+    header = next(objects, None)
+    if not header or 'table' not in header:
+        raise ValueError('stream does not start with an export header')
+    name = name or header['table']
+    table = db.table(name)
+    for index in header.get('indexes', []):
+        table.ensure(index['name'], index['func'], index['duplicates'], unique=index['unique'])
+    for view, pipeline in header.get('views', {}).items():
+        table.materialize(view, pipeline)
+    return name, table.load(objects, batch, progress)
@@ -1,5 +1,144 @@
 import lmdb
-from .utils import _anonymous, xReindexNoKey1, xReindexNoKey2
+import re
+from itertools import product
+from operator import itemgetter
+from string import Formatter
+from .utils import xReindexNoKey1, xReindexNoKey2, xDuplicateKey
+
+
+def _parse_spec(func):
+    """
+    Parse an index specification into its component fields. Field names may be dotted paths
+    into nested records, i.e. "{address.postcode}" (or "{address[postcode]}"), and a field
+    with a "[]" suffix is a multikey field, i.e. "{tags[]}", which generates one index entry
+    for each element of the list it refers to.
+
+    :param func: The index specification
+    :type func: str
+    :return: A list of (text, path, multikey, conversion, format spec), and any trailing text
+    :rtype: tuple
+    """
+    fields = []
+    tail = ''
+    for text, field, spec, conv in Formatter().parse(func):
+        text, tail = tail + text, ''
+        if field is None:
+            tail = text
+            continue
+        multikey = field.endswith('[]')
+        if multikey:
+            field = field[:-2]
+        path = [int(part) if part.isdigit() else part for part in re.split(r'[.\[\]]+', field) if part]
+        fields.append((text, path, multikey, conv, spec))
+    return fields, tail
+
+
+def _getter(path):
+    """
+    Generate a function to read a single field from a record, missing fields and fields
+    with a value of None both raise KeyError so they can be treated as sparse.
+
+    :param path: The path to the field
+    :type path: list
+    :return: A function taking a record and returning the field value
+    :rtype: function
+    """
+    if len(path) == 1:
+        field = path[0]
+
+        def get(record):
+            value = record[field]
+            if value is None:
+                raise KeyError(field)
+            return value
+        return get
+
+    def get_path(record):
+        value = record
+        try:
+            for part in path:
+                value = value[part]
+        except (TypeError, IndexError):
+            raise KeyError(path[0])
+        if value is None:
+            raise KeyError(path[0])
+        return value
+    return get_path
+
+
+def _template(fields, tail):
+    """
+    Generate a positional format template for a list of parsed fields
+
+    :param fields: Parsed fields as returned by _parse_spec
+    :type fields: list
+    :param tail: Any trailing literal text
+    :type tail: str
+    :return: A format template, i.e. "{0:03}|{1}"
+    :rtype: str
+    """
+    template = ''
+    for position, (text, path, multikey, conv, spec) in enumerate(fields):
+        template += text.replace('{', '{{').replace('}', '}}')
+        template += '{' + str(position) + ('!' + conv if conv else '') + (':' + spec if spec else '') + '}'
+    return template + tail.replace('{', '{{').replace('}', '}}')
+
+
+def _compile_spec(func):
+    """
+    Compile an index specification into a key extractor, the specification is parsed once
+    and the extractor only reads the fields it refers to.
+
+    :param func: The index specification
+    :type func: str
+    :return: A function taking a record and returning a list of unique index keys (bytes)
+    :rtype: function
+    :raises ValueError: If the specification doesn't refer to any fields
+    """
+    fields, tail = _parse_spec(func)
+    if not fields:
+        raise ValueError('index specification "{}" has no {{field}} placeholders'.format(func))
+    render = _template(fields, tail).format
+    paths = [path for text, path, multikey, conv, spec in fields]
+
+    if any(multikey for text, path, multikey, conv, spec in fields):
+        getters = [_getter(path) for path in paths]
+        multikeys = [multikey for text, path, multikey, conv, spec in fields]
+
+        def extract_multikey(record):
+            values = []
+            for get, multikey in zip(getters, multikeys):
+                value = get(record)
+                if multikey and isinstance(value, (list, tuple)):
+                    value = [item for item in value if item is not None]
+                else:
+                    value = (value,)
+                values.append(value)
+            return sorted(set(render(*combination).encode() for combination in product(*values)))
+        return extract_multikey
+
+    if any(len(path) > 1 for path in paths):
+        getters = [_getter(path) for path in paths]
+        return lambda record: [render(*[get(record) for get in getters]).encode()]
+
+    if len(paths) == 1:
+        text, path, multikey, conv, spec = fields[0]
+        get = _getter(path)
+        if not text and not conv and not spec and not tail:
+            def extract_field(record):
+                value = get(record)
+                return [value.encode() if type(value) is str else format(value).encode()]
+            return extract_field
+        return lambda record: [render(get(record)).encode()]
+
+    get = itemgetter(*[path[0] for path in paths])
+
+    def extract(record):
+        values = get(record)
+        if None in values:
+            raise KeyError(None)
+        return [render(*values).encode()]
+    return extract
 
 
 class Index(object):
@@ -10,19 +149,27 @@ class Index(object):
     :type context: Database
     :param name: The name of the index we're working with
     :type name: str
-    :param func: Is a Python format string that specified the index layout
+    :param func: Is a Python format string that specified the index layout, fields may be dotted
+                 paths into nested records and a "[]" suffix marks a multikey (list) field. Index
+                 entries are sparse, a record with a missing or null field is not indexed
     :type func: str
     :param conf: Configuration options for this index
     :type conf: dict
+    :param unique: Whether writing a key already held by another record is an error
+    :type unique: bool
 
     """
     _debug = False
 
-    def __init__(self, ctx, name, func, conf, txn):
+    def __init__(self, ctx, name, func, conf, txn, unique=False):
         self._ctx = ctx
         self._name = name
+        self._func = func
         self._conf = conf
-        self._func = _anonymous('(r): return "{}".format(**r).encode()'.format(func))
+        self._unique = unique
+        self._keys = _compile_spec(func)
+        self._spec = _parse_spec(func)
+        self._fields = set(path[0] for text, path, multikey, conv, spec in self._spec[0])
         options = dict(self._conf)
         if type(options['key']) is not bytes:
             options['key'] = options['key'].encode()
@@ -31,6 +178,105 @@ class Index(object):
     def begin(self):
         return lmdb.Transaction(self._ctx.env)
 
+    @property
+    def func(self):
+        """
+        PROPERTY - The specification this index was created from
+
+        :getter: The index specification
+        :type: str
+        """
+        return self._func
+
+    @property
+    def fields(self):
+        """
+        PROPERTY - The (top level) record fields this index is computed from
+
+        :getter: Field names
+        :type: set
+        """
+        return self._fields
+
+    @property
+    def duplicates(self):
+        """
+        PROPERTY - Whether this index allows duplicate keys
+
+        :getter: True if the index is a dupsort index
+        :type: bool
+        """
+        return bool(self._conf.get('dupsort'))
+
+    @property
+    def multikey(self):
+        """
+        PROPERTY - Whether this index has a multikey field, so a record may have many entries
+
+        :getter: True if any field of the index is a multikey field
+        :type: bool
+        """
+        return any(multikey for text, path, multikey, conv, spec in self._spec[0])
+
+    @property
+    def unique(self):
+        """
+        PROPERTY - Whether this index enforces unique keys
+
+        :getter: True if the index is a unique index
+        :type: bool
+        """
+        return self._unique
+
+    def ordered_by(self, fields):
+        """
+        Test whether a scan of this index returns records grouped by the given fields, which is
+        the case when they are the leading fields of the index and each is followed by literal
+        text (a separator) or ends the key. Multikey indexes are never grouped.
+
+        :param fields: A list of (dotted) field names
+        :type fields: list
+        :return: True if records sharing values for these fields are contiguous in the index
+        :rtype: bool
+        """
+        parsed, tail = self._spec
+        if len(fields) > len(parsed) or any(multikey for text, path, multikey, conv, spec in parsed):
+            return False
+        for position, field in enumerate(fields):
+            text, path, multikey, conv, spec = parsed[position]
+            if multikey or '.'.join(str(part) for part in path) != field:
+                return False
+            if position and not text:
+                return False
+        return len(fields) == len(parsed) or bool(parsed[len(fields)][0])
+
+    def key(self, record):
+        """
+        Generate the index key for a template record
+
+        :param record: A template record specifying the key to use
+        :type record: dict
+        :return: The index key
+        :rtype: bytes
+        :raises: KeyError if the template is missing a field
+        """
+        return self._keys(record)[0]
+
+    def keys(self, record):
+        """
+        Generate all the index keys for a record, a record that is missing any of the fields
+        this index refers to (or has a null value for one) generates no keys.
+
+        :param record: The record to generate keys for
+        :type record: dict
+        :return: A list of (unique) index keys
+        :rtype: list
+        """
+        try:
+            return self._keys(record)
+        except KeyError:
+            return []
+
     def count(self, txn=None, abort=False):
         """
         Count the number of items currently present in this index
@@ -54,7 +300,7 @@ class Index(object):
         :return: An active Cursor object
         :rtype: Cursor
         """
-        return lmdb.Cursor(self._db, txn)
+        return txn.cursor(self._db)
 
     def match(self, value, record):
         """
@@ -67,7 +313,7 @@ class Index(object):
         :return: True if equal
         :rtype: bool
         """
-        test = self._func(record)
+        test = self.key(record)
         if test == value:
             return 0
         return -1 if test > value else 1
@@ -81,7 +327,7 @@ class Index(object):
         :param record: A template record specifying the key to use
         :type record: dict
         """
-        cursor.set_key(self._func(record))
+        return cursor.set_key(self.key(record))
 
     def set_range(self, cursor, record):
         """
@@ -92,7 +338,7 @@ class Index(object):
         :param record: A template record specifying the key to use
         :type record: dict
         """
-        return cursor.set_range(self._func(record))
+        return cursor.set_range(self.key(record))
 
     def set_next(self, cursor, record):
         """
@@ -103,7 +349,7 @@ class Index(object):
         :param record: A template record specifying the key to use
         :type record: dict
         """
-        return cursor.key() <= self._func(record) if cursor.next() else False
+        return cursor.key() <= self.key(record) if cursor.next() else False
 
     def delete(self, txn, key, record):
         """
@@ -118,7 +364,10 @@ class Index(object):
         :return: True if the record was deleted
         :rtype: boolean
         """
-        return txn.delete(self._func(record), key, self._db)
+        result = True
+        for ikey in self.keys(record):
+            result = txn.delete(ikey, key, self._db) and result
+        return result
 
     def drop(self, txn):
         """
@@ -148,7 +397,7 @@ class Index(object):
         :return: The record recovered from the index
         :rtype: str
         """
-        return txn.get(self._func(record), db=self._db)
+        return txn.get(self.key(record), db=self._db)
 
     def put(self, txn, key, record):
         """
@@ -160,17 +409,87 @@ class Index(object):
         :type key: str|int
         :param record: Is the record to write
         :type record: dict
-        :return: True if the record was written successfully
+        :return: True if the record was written successfully (or is not indexed)
         :rtype: boolean
+        :raises: xDuplicateKey if a key in a unique index belongs to another record
         """
-        try:
-            ikey = self._func(record)
-            if type(key) is not bytes:
-                key = key.encode()
+        if type(key) is not bytes:
+            key = key.encode()
+        return self._put(txn, self.keys(record), key)
 
-            return txn.put(ikey, key, db=self._db)
-        except KeyError:
-            return False
+    def _put(self, txn, ikeys, key):
+        """
+        Write a set of entries into the index, a unique index will not overwrite an entry that
+        belongs to another record and removes any entries it has already written on conflict
+
+        :param txn: Is an open Transaction
+        :type txn: Transaction
+        :param ikeys: The index keys to write
+        :type ikeys: list
+        :param key: Is the key of the record
+        :type key: bytes
+        :return: True if all entries were written successfully
+        :rtype: boolean
+        :raises: xDuplicateKey if a key in a unique index belongs to another record
+        """
+        if not self._unique:
+            result = True
+            for ikey in ikeys:
+                result = txn.put(ikey, key, db=self._db) and result
+            return result
+
+        written = []
+        for ikey in ikeys:
+            if txn.put(ikey, key, db=self._db, overwrite=False):
+                written.append(ikey)
+                continue
+            existing = txn.get(ikey, db=self._db)
+            if existing != key:
+                for ikey_written in written:
+                    txn.delete(ikey_written, key, self._db)
+                raise xDuplicateKey(self._name, ikey, existing)
+        return True
+
+    def load(self, txn, entries):
+        """
+        Bulk load an empty index from a sorted list of entries, entries are appended rather than
+        inserted. Where a (non-duplicate) index key appears more than once the entry for the
+        highest record key is kept, which matches the result of writing the records in order.
+
+        :param txn: Is an open (write) Transaction
+        :type txn: Transaction
+        :param entries: A sorted list of (index key, record key) pairs
+        :type entries: list
+        :return: The number of entries written
+        :rtype: int
+        :raises: xDuplicateKey if a key in a unique index belongs to more than one record
+        """
+        entries = self.resolve(entries)
+        with txn.cursor(self._db) as cursor:
+            return cursor.putmulti(entries, append=True)[1]
+
+    def resolve(self, entries):
+        """
+        Reduce a sorted list of entries to those load would write, so a unique index can be
+        checked before anything is changed
+
+        :param entries: A sorted list of (index key, record key) pairs
+        :type entries: list
+        :return: The entries to write
+        :rtype: list
+        :raises: xDuplicateKey if a key in a unique index belongs to more than one record
+        """
+        if self.duplicates:
+            return entries
+        kept = []
+        for ikey, key in entries:
+            if kept and kept[-1][0] == ikey:
+                if self._unique and kept[-1][1] != key:
+                    raise xDuplicateKey(self._name, ikey, kept[-1][1])
+                kept[-1] = (ikey, key)
+            else:
+                kept.append((ikey, key))
+        return kept
 
     def save(self, txn, key, old, rec):
         """
@@ -184,12 +503,13 @@ class Index(object):
         :type old: dict
         :param rec: The record in it's amended state
         :type rec: dict
+        :raises: xDuplicateKey if a new key in a unique index belongs to another record
         """
-        old_key = self._func(old)
-        new_key = self._func(rec)
-        if old_key != new_key:
-            if not txn.put(new_key, key, db=self._db):
-                raise xReindexNoKey2
+        old_keys = set(self.keys(old))
+        new_keys = set(self.keys(rec))
+        if not self._put(txn, list(new_keys - old_keys), key):
+            raise xReindexNoKey2
+        for old_key in old_keys - new_keys:
             if not txn.delete(old_key, key, db=self._db):
                 raise xReindexNoKey1
 
@@ -0,0 +1,328 @@
+"""
+Optional instrumentation, enabled per database with Database.set_metrics. Nothing here is on
+the normal code path, enabling metrics replaces the methods of each table (and index) with timed
+versions and disabling them puts the originals back, so there's no cost at all when they're off.
+
+The numbers are read with Database.stats(), and prometheus() formats them as Prometheus text.
+"""
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from .slowlog import _Counter, _counting
+
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+OPERATIONS = ('append', 'save', 'delete', 'get', 'find', 'range', 'seek')
+QUERIES = ('find', 'range', 'seek')
+INDEX_WRITES = ('put', 'delete', 'save')
+
+
+class Histogram(object):
+    """
+    A latency histogram with fixed buckets (seconds)
+    """
+    __slots__ = ('count', 'sum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+
+    def cumulative(self):
+        """
+        The bucket counts in Prometheus form, each count includes all the smaller buckets
+
+        :return: A list of [upper bound, count] pairs, the last bound is "+Inf"
+        :rtype: list
+        """
+        results = []
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.buckets):
+            total += count
+            results.append([bound, total])
+        return results
+
+
+class Metrics(object):
+    """
+    The counters and histograms for one database, keyed by name and a tuple of label values
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Add to a counter
+
+        :param name: The name of the counter
+        :type name: str
+        :param labels: (label, value) pairs
+        :type labels: tuple
+        :param value: The amount to add
+        :type value: int
+        """
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, seconds):
+        """
+        Record a duration in a histogram
+
+        :param name: The name of the histogram
+        :type name: str
+        :param labels: (label, value) pairs
+        :type labels: tuple
+        :param seconds: The duration
+        :type seconds: float
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def collect(self):
+        """
+        A copy of the current values
+
+        :return: {'counters': {name: [{labels, value}]},
+                  'histograms': {name: [{labels, count, sum, buckets}]}}
+        :rtype: dict
+        """
+        counters = {}
+        histograms = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': histogram.cumulative()
+                })
+        return {'counters': counters, 'histograms': histograms}
+
+
+def _timed(metrics, name, labels, method):
+    @wraps(method)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.observe(name, labels, perf_counter() - start)
+    return timed
+
+
+def _timed_get(metrics, table, labels, method):
+    """
+    Time a get, counting the record read (if there was one)
+    """
+    @wraps(method)
+    def timed(*args, **kwargs):
+        counter = _Counter()
+        with table.begin() as txn:
+            args, kwargs = _counting(table, 'get', args, kwargs, txn, counter)
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                metrics.observe('operation_seconds', labels, perf_counter() - start)
+                metrics.inc('records_read', labels[:1], counter.examined)
+    return timed
+
+
+def _timed_query(metrics, table, labels, method):
+    """
+    Time a query (generator), only the time spent producing records counts, not the time the
+    caller spends between them. Every record read (and decoded) from the table is counted,
+    including those a filter then discards.
+    """
+    op = labels[1][1]
+
+    @wraps(method)
+    def timed(*args, **kwargs):
+        counter = _Counter()
+        elapsed = 0.0
+        with table.begin() as txn:
+            args, kwargs = _counting(table, op, args, kwargs, txn, counter)
+            records = method(*args, **kwargs)
+            try:
+                while True:
+                    start = perf_counter()
+                    try:
+                        record = next(records)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += perf_counter() - start
+                    yield record
+            finally:
+                records.close()
+                metrics.observe('operation_seconds', labels, elapsed)
+                metrics.inc('records_read', labels[:1], counter.examined)
+    return timed
+
+
+def _counted(metrics, labels, method):
+    @wraps(method)
+    def counted(*args, **kwargs):
+        metrics.inc('index_writes', labels)
+        return method(*args, **kwargs)
+    return counted
+
+
+def instrument_index(metrics, table, index):
+    """
+    Count the writes made to an index
+    """
+    labels = (('table', table.name), ('index', index._name))
+    for name in INDEX_WRITES:
+        setattr(index, name, _counted(metrics, labels, getattr(type(index), name).__get__(index)))
+    index._metered = True
+
+
+def instrument(metrics, table):
+    """
+    Replace the read and write methods of a table (and it's indexes) with instrumented versions
+
+    :param metrics: Where to record the measurements
+    :type metrics: Metrics
+    :param table: The table to instrument
+    :type table: Table
+    """
+    if table.name.startswith('__'):
+        return
+    for op in OPERATIONS:
+        method = getattr(type(table), op).__get__(table)
+        labels = (('table', table.name), ('op', op))
+        if op in QUERIES:
+            timed = _timed_query(metrics, table, labels, method)
+        elif op == 'get':
+            timed = _timed_get(metrics, table, labels, method)
+        else:
+            timed = _timed(metrics, 'operation_seconds', labels, method)
+            timed = _indexed(metrics, table, timed)
+        setattr(table, op, timed)
+
+
+def _indexed(metrics, table, method):
+    """
+    Make sure indexes added since the table was instrumented are counted before any write
+    """
+    @wraps(method)
+    def indexed(*args, **kwargs):
+        for index in table._indexes.values():
+            if not index.__dict__.get('_metered'):
+                instrument_index(metrics, table, index)
+        return method(*args, **kwargs)
+    return indexed
+
+
+def uninstrument(table):
+    """
+    Put back the original methods of a table and it's indexes
+    """
+    for op in OPERATIONS:
+        table.__dict__.pop(op, None)
+    for index in table._indexes.values():
+        for name in INDEX_WRITES:
+            index.__dict__.pop(name, None)
+        index.__dict__.pop('_metered', None)
+
+
+def env_stats(db):
+    """
+    Read the environment and table statistics from LMDB
+
+    :param db: An open database
+    :type db: Database
+    :return: The map size and usage, reader slots and per table entry and page counts
+    :rtype: dict
+    """
+    info = db.env.info()
+    stat = db.env.stat()
+    tables = {}
+    with db.env.begin() as txn:
+        for name, table in sorted(db._tables.items()):
+            if name.startswith('__'):
+                continue
+            table_stat = txn.stat(table._db)
+            tables[name] = {
+                'entries': table_stat['entries'],
+                'depth': table_stat['depth'],
+                'branch_pages': table_stat['branch_pages'],
+                'leaf_pages': table_stat['leaf_pages'],
+                'overflow_pages': table_stat['overflow_pages']
+            }
+    return {
+        'map_size': info['map_size'],
+        'map_used': (info['last_pgno'] + 1) * stat['psize'],
+        'page_size': stat['psize'],
+        'last_txnid': info['last_txnid'],
+        'readers': info['num_readers'],
+        'max_readers': info['max_readers'],
+        'tables': tables
+    }
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+def prometheus(stats, prefix='pynndb'):
+    """
+    Format the output of Database.stats() in the Prometheus text exposition format
+
+    :param stats: The statistics to format
+    :type stats: dict
+    :param prefix: The prefix for every metric name
+    :type prefix: str
+    :return: The formatted metrics
+    :rtype: str
+    """
+    lines = []
+    env = stats.get('env') or {}
+    for name, kind in (('map_size', 'bytes'), ('map_used', 'bytes'), ('readers', ''), ('max_readers', '')):
+        if name in env:
+            metric = '{}_{}{}'.format(prefix, name, '_' + kind if kind else '')
+            lines.append('# TYPE {} gauge'.format(metric))
+            lines.append('{} {}'.format(metric, env[name]))
+    if env.get('tables'):
+        for field in ('entries', 'depth', 'branch_pages', 'leaf_pages', 'overflow_pages'):
+            metric = '{}_table_{}'.format(prefix, field)
+            lines.append('# TYPE {} gauge'.format(metric))
+            for table, values in env['tables'].items():
+                lines.append('{}{} {}'.format(metric, _labels({'table': table}), values[field]))
+    metrics = stats.get('metrics') or {}
+    for name, samples in metrics.get('counters', {}).items():
+        metric = '{}_{}_total'.format(prefix, name)
+        lines.append('# TYPE {} counter'.format(metric))
+        for sample in samples:
+            lines.append('{}{} {}'.format(metric, _labels(sample['labels']), sample['value']))
+    for name, samples in metrics.get('histograms', {}).items():
+        metric = '{}_{}'.format(prefix, name)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for sample in samples:
+            for bound, count in sample['buckets']:
+                labels = dict(sample['labels'], le=bound)
+                lines.append('{}_bucket{} {}'.format(metric, _labels(labels), count))
+            lines.append('{}_sum{} {}'.format(metric, _labels(sample['labels']), repr(sample['sum'])))
+            lines.append('{}_count{} {}'.format(metric, _labels(sample['labels']), sample['count']))
+    return '\n'.join(lines) + '\n'
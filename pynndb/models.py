@@ -1,8 +1,141 @@
-from json import loads
-from .types import BaseType
+import sys
+from ujson import loads
+from .types import BaseType, snapshot, current_time
 
 
-class BaseModel(object):
+def _snapshot(models):
+    """
+    Record the state a save changes on each model (and the models linked from it), so that it
+    can be put back if the transaction doesn't commit
+    :param models: the models about to be saved
+    :return: the saved state, for _restore
+    """
+    state = []
+    seen = set()
+    todo = list(models)
+    while todo:
+        model = todo.pop()
+        if id(model) in seen:
+            continue
+        seen.add(id(model))
+        dif = dict(model._dif) if model._dif is not None else None
+        state.append((model, model._dirty, dif, '_id' in model._doc))
+        for linked in (model._map or {}).values():
+            todo.extend(linked)
+    return state
+
+
+def _restore(state):
+    """
+    Put back the state recorded by _snapshot after a failed transaction
+    :param state: the saved state
+    """
+    for model, dirty, dif, has_id in state:
+        model.is_dirty(dirty)
+        model._dif = dif
+        if not has_id:
+            model._doc.pop('_id', None)
+
+
+class _Model(object):
+    """
+    Behaviour shared by BaseModel and the slot based classes generated by Table.model_class
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        """
+        Default display string
+        :return: string representation of the record
+        """
+        return str(self._doc)
+
+    def modify(self, keyval):
+        """
+        Simple single attribute modification routine
+        :param keyval: key=val string
+        """
+        setattr(self, *keyval.split('='))
+        self.save()
+
+    def save(self, txn=None):
+        """
+        Save this record, and any changes to linked records, in the database
+        :param txn: an open write transaction, if not supplied the save runs in a transaction of its own
+        """
+        if txn is None:
+            state = _snapshot([self])
+            try:
+                with self._instance.begin() as txn:
+                    return self.save(txn)
+            except Exception:
+                _restore(state)
+                raise
+        if self._dirty:
+            self.validate()
+            self._instance.save(self._doc, txn)
+            self._dirty = False
+        self._instance.update_links(self, txn)
+
+    def validate(self):
+        """
+        Validate the current record against any available validators
+        """
+        doc = self._doc
+        for field in list(doc):
+            if field in self._calculated:
+                self.__setattr__(field, doc[field])
+                del doc[field]
+        return self
+
+    def is_new(self):
+        """
+        Determine if this is a new record that has yet to be written to the DB
+        :return: bool
+        """
+        return '_id' not in self._doc
+
+    def is_dirty(self, dirty=None):
+        """
+        Determine if this record is dirty and needs to be written
+        :return: bool
+        """
+        if dirty is None:
+            return self._dirty
+        self._dirty = dirty
+
+    def doc(self):
+        return self._doc
+
+    def update_links(self, txn=None):
+        """
+        Update links in associated objects
+        :param txn: an open write transaction
+        """
+        self._instance.update_links(self, txn)
+
+    def _link(self, key, value):
+        """
+        Attach the resolved list of linked records for a link field
+        :param key: the link field name
+        :param value: the linked records (DirtyList)
+        """
+        if self._map is None:
+            self._map = {}
+            self._dif = {}
+        self._map[key] = value
+        self._dif[key] = value[:]
+
+    @property
+    def uuid(self):
+        """
+        Convenience function to return the record's _id as a native string
+        :return: str (uuid)
+        """
+        return self._doc['_id'].decode()
+
+
+class BaseModel(_Model):
 
     def __init__(self, *args, **kwargs):
         """
@@ -28,9 +161,7 @@ class BaseModel(object):
             cls = self.__dict__['_calculated'][key]
             if type(cls) in [ManyToManyLink]:
                 if key not in self.__dict__['_map']:
-                    val = cls.from_internal(self.__dict__['_doc'])
-                    self.__dict__['_map'][key] = val
-                    self.__dict__['_dif'][key] = val[:]
+                    self._link(key, cls.from_internal(self.__dict__['_doc']))
                 return self.__dict__['_map'][key]
             else:
                 return cls.from_internal(self.__dict__['_doc'])
@@ -50,78 +181,116 @@ class BaseModel(object):
             self._calculated[key].to_internal(self._doc, value)
             self.__dict__['_dirty'] = True
 
-    def __repr__(self):
-        """
-        Default display string
-        :return: string representation of the record
-        """
-        return str(self.__dict__['_doc'])
 
-    def modify(self, keyval):
-        """
-        Simple single attribute modification routine
-        :param keyval: key=val string
-        """
-        setattr(self, *keyval.split('='))
-        self.save()
+class SlotModel(_Model):
+    """
+    Base class for the per-table model classes generated by Table.model_class. Instances have
+    no __dict__, just the wrapped record and a dirty flag (the link maps are only created
+    when a link is read), and every known field is a descriptor on the class, so the per-field
+    lookups BaseModel makes in __getattr__ are done once when the class is built.
+    """
+    __slots__ = ('_doc', '_dirty', '_map', '_dif')
 
-    def save(self):
-        """
-        Save this record in the database
-        """
-        if self._dirty:
-            self.validate()
-            self._instance.save(self._doc)
-        self._instance.update_links(self)
+    _instance = None
+    _calculated = {}
+    _attributes = frozenset(__slots__)
 
-    def validate(self):
+    def __init__(self, doc=None):
         """
-        Validate the current record against any available validators
+        Wrap a record
+        :param doc: a dict item that constitutes a record
         """
-        for field in list(self.__dict__['_doc']):
-            if field in self._calculated:
-                self.__setattr__(field, self.__dict__['_doc'][field])
-                del self.__dict__['_doc'][field]
-        return self
+        self._doc = doc if doc is not None else {}
+        self._dirty = False
+        self._map = None
+        self._dif = None
 
-    def is_new(self):
+    def __getattr__(self, key):
         """
-        Determine if this is a new record that has yet to be written to the DB
-        :return: bool
+        Fallback for fields the class has no descriptor for
+        :param key: field name
+        :return: the field value, or '' if the record doesn't have it
         """
-        return '_id' not in self.__dict__['_doc']
+        if key in SlotModel.__slots__ or key.startswith('__'):
+            raise AttributeError(key)
+        return self._doc.get(key, '')
 
-    def is_dirty(self, dirty=None):
+    def __setattr__(self, key, value):
         """
-        Determine if this record is dirty and needs to be written
-        :return: bool
+        Slots and descriptors are set as normal, anything else is a new field in the record
+        :param key: the attribute name
+        :param value: the new value for the attribute
         """
-        if dirty is None:
-            return self.__dict__['_dirty']
-        self.__dict__['_dirty'] = dirty
+        if key in self._attributes:
+            object.__setattr__(self, key, value)
+        else:
+            self._doc[key] = value
+            object.__setattr__(self, '_dirty', True)
 
-    def doc(self):
-        return self._doc
 
-    def update_links(self):
-        """
-        Update links in associated objects
-        """
-        self._instance.update_links(self)
+class _Field(object):
+    """
+    Descriptor for a plain field of a generated model class
+    """
+    __slots__ = ('_name',)
 
-    @property
-    def uuid(self):
-        """
-        Convenience function to return the record's _id as a native string
-        :return: str (uuid)
-        """
-        return self.__dict__['_doc']['_id'].decode()
+    def __init__(self, name):
+        self._name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return obj._doc.get(self._name, '')
+
+    def __set__(self, obj, value):
+        obj._doc[self._name] = value
+        obj._dirty = True
+
+
+class _Calculated(object):
+    """
+    Descriptor for a calculated field (a BaseType) of a generated model class
+    """
+    __slots__ = ('_type',)
+
+    def __init__(self, kind):
+        self._type = kind
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return self._type.from_internal(obj._doc)
+
+    def __set__(self, obj, value):
+        self._type.to_internal(obj._doc, value)
+        obj._dirty = True
+
+
+class _Linked(_Calculated):
+    """
+    Descriptor for a link field (a ManyToManyLink) of a generated model class, the linked records
+    are resolved the first time the field is read
+    """
+    __slots__ = ('_name',)
+
+    def __init__(self, name, kind):
+        super().__init__(kind)
+        self._name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        if obj._map is None or self._name not in obj._map:
+            obj._link(self._name, self._type.from_internal(obj._doc))
+        return obj._map[self._name]
 
 
 class Table(object):
 
     _calculated = {}
     _display = []
+    _fields = []
+    _slots = False
 
     def __init__(self, **kwargs):
         """
@@ -130,6 +299,46 @@ class Table(object):
         """
         self._table = kwargs.get('table')
         self._links = []
+        self._model_class = None
+
+    @property
+    def model_class(self):
+        """
+        The slot based model class for this table, generated on first use and rebuilt if links are added.
+        Records are only wrapped in this class if the model sets _slots = True, otherwise they are BaseModels.
+        Descriptors are created for each calculated field and link, and for the plain fields named in
+        _fields and _display, other fields are still available but are looked up more slowly.
+        :return: a subclass of SlotModel
+        """
+        if self._model_class is None:
+            attrs = {'__slots__': (), '_instance': self, '_calculated': self._calculated}
+            names = list(self._fields) + [field['name'] for field in self._display if 'name' in field]
+            for name in names:
+                if name not in self._calculated and not hasattr(SlotModel, name):
+                    attrs[name] = _Field(name)
+            for name, kind in self._calculated.items():
+                attrs[name] = _Linked(name, kind) if isinstance(kind, ManyToManyLink) else _Calculated(kind)
+            attrs['_attributes'] = SlotModel._attributes.union(
+                name for name, value in attrs.items() if isinstance(value, (_Field, _Calculated)))
+            self._model_class = type(type(self).__name__ + 'Record', (SlotModel,), attrs)
+        return self._model_class
+
+    def model(self, doc=None):
+        """
+        Wrap a record in this table's model class
+        :param doc: the record (dict)
+        :return: the record (as a Model)
+        """
+        if not self._slots:
+            return BaseModel(doc if doc is not None else {}, instance=self)
+        return self.model_class(doc)
+
+    def begin(self):
+        """
+        Begin a write transaction on the underlying database
+        :return: an lmdb write transaction (use with "with")
+        """
+        return self._table._ctx.env.begin(write=True)
 
     def get(self, key):
         """
@@ -138,104 +347,195 @@ class Table(object):
         :return: record (as a Model)
         """
         doc = self._table.get(key)
-        return BaseModel(doc, instance=self) if doc else None
+        return self.model(doc) if doc else None
 
-    def find(self, **kwargs):
+    def find(self, prefetch=None, prefetch_size=256, **kwargs):
         """
         Facilitate a sequential search of the database
+        :param prefetch: resolve links for the results in batches, True for all links or a list of link names
+        :param prefetch_size: the number of results to resolve links for at a time
         :return: the next record (as a Model)
         """
+        model = self.model
+        if not prefetch:
+            for doc in self._table.find(**kwargs):
+                yield model(doc)
+            return
+        batch = []
         for doc in self._table.find(**kwargs):
-            yield BaseModel(doc, instance=self)
+            batch.append(model(doc))
+            if len(batch) == prefetch_size:
+                yield from self.prefetch(batch, None if prefetch is True else prefetch)
+                batch = []
+        yield from self.prefetch(batch, None if prefetch is True else prefetch)
 
-    def list(self, *uuids):
+    def prefetch(self, models, names=None):
         """
-        Generic boxed listing routine
-        :param uuids: the options uuid(s) to display
-        :return:
-        """
-        fields = []
-        functions = []
-        format_line = '+'
-        format_head = '| '
-        format_data = '| '
-        format_spcs = []
-        for field in self._display:
-            name = field.get('name', None)
-            width = field.get('width', None)
-            precision = field.get('precision', None)
-            func = field.get('function', None)
-            functions.append(func) if func else None
-            fields.append(name)
-            format_line += '{}+'
-            format_head += '{{:{}.{}}} | '.format(width, width)
-            if precision:
-                format_data += '{{d.{}:{}.{}}} | '.format(name, width, precision)
+        Resolve the links for a list of models in one pass per link, rather than one lookup per model
+        :param models: the models to resolve links for
+        :param names: the names of the links to resolve, defaults to all links
+        :return: the models
+        """
+        for link in self._links:
+            if names is not None and link._dst_key not in names:
+                continue
+            pending = [model for model in models if not model._map or link._dst_key not in model._map]
+            resolved = link.resolve([model.doc() for model in pending])
+            for model in pending:
+                model._link(link._dst_key, resolved.get(model.doc().get('_id'), DirtyList(link._classB)))
+        return models
+
+    def _list_format(self):
+        """
+        Compile the box drawing and row format strings for 'list' from _display, once per model class
+        :return: (line, head, data, fields, functions)
+        """
+        cls = type(self)
+        compiled = cls.__dict__.get('_list_compiled')
+        if compiled is None:
+            fields = []
+            functions = []
+            format_line = '+'
+            format_head = '| '
+            format_data = '| '
+            format_spcs = []
+            for column, field in enumerate(self._display):
+                name = field.get('name', None)
+                width = field.get('width', None)
+                precision = field.get('precision', None)
+                func = field.get('function', None)
+                functions.append(func) if func else None
+                fields.append(name)
+                format_line += '{}+'
+                format_head += '{{:{}.{}}} | '.format(width, width)
+                if precision:
+                    format_data += '{{{}:{}.{}}} | '.format(column, width, precision)
+                else:
+                    format_data += '{{{}:{}}} | '.format(column, width)
+                format_spcs.append('-'*(width+2))
+            line = format_line.format(*format_spcs) + '\n'
+            head = format_head.format(*fields) + '\n'
+            compiled = (line, head, format_data + '\n', tuple(fields), tuple(functions))
+            cls._list_compiled = compiled
+        return compiled
+
+    def _list_rows(self, models, fields, functions, format_data):
+        """
+        Render a batch of rows for 'list', calculated fields are converted a column at a time
+        :param models: the records (as Models) to render
+        :param fields: the names of the fields to display
+        :param functions: the display functions to call for each record before it's rendered
+        :param format_data: the compiled row format
+        :return: the rendered rows (str)
+        """
+        for model in models:
+            for fn in functions:
+                fn(model)
+        columns = []
+        for name in fields:
+            kind = self._calculated.get(name)
+            if kind is not None and not isinstance(kind, ManyToManyLink):
+                columns.append(kind.from_internal_many([model.doc() for model in models]))
             else:
-                format_data += '{{d.{}:{}}} | '.format(name, width)
-            format_spcs.append('-'*(width+2))
-        line = format_line.format(*format_spcs)
-        head = format_head.format(*fields)
-
-        print(line)
-        print(head)
-        print(line)
-        if not uuids:
-            for doc in self.find():
-                for func in functions:
-                    fn = getattr(self, func, None)
-                    fn(doc) if fn else None
-                print(format_data.format(d=doc))
-        else:
-            for uuid in uuids:
-                doc = self.get(uuid.encode())
-                print(format_data.format(d=doc))
-        print(line)
+                columns.append([getattr(model, name) for model in models])
+        return ''.join(format_data.format(*row) for row in zip(*columns))
 
-    def add(self, doc):
+    def list(self, *uuids, output=None, batch=256):
+        """
+        Generic boxed listing routine, rows are read in a single transaction and written in batches
+        :param uuids: the options uuid(s) to display
+        :param output: a file-like object to write to, defaults to stdout
+        :param batch: the number of rows to render and write at a time
+        :return: the number of rows written
+        """
+        output = output or sys.stdout
+        line, head, format_data, fields, functions = self._list_format()
+        functions = [fn for fn in (getattr(self, func, None) for func in functions) if fn]
+        output.write(line + head + line)
+        count = 0
+        with snapshot(current_time()), self._table.begin() as txn:
+            if uuids:
+                keys = [uuid.encode() if isinstance(uuid, str) else uuid for uuid in uuids]
+                docs = self._table.get_many(keys, txn=txn)
+            else:
+                docs = self._table.find(txn=txn)
+            models = []
+            for doc in docs:
+                models.append(self.model(doc))
+                if len(models) == batch:
+                    output.write(self._list_rows(models, fields, functions, format_data))
+                    count += len(models)
+                    models = []
+            output.write(self._list_rows(models, fields, functions, format_data))
+            count += len(models)
+        output.write(line)
+        return count
+
+    def add(self, doc, txn=None):
         """
         Append the current record to the Database
         :param doc: is the document to add, it can be JSON, dict or BaseModel
+        :param txn: an open write transaction, if not supplied the add runs in a transaction of its own
         :return: BaseModel(the new record)
         """
+        if txn is None:
+            state = _snapshot([doc]) if isinstance(doc, _Model) else []
+            try:
+                with self.begin() as txn:
+                    return self.add(doc, txn)
+            except Exception:
+                _restore(state)
+                raise
         doc = loads(doc) if type(doc) is str else doc
-        doc = BaseModel(doc, instance=self) if type(doc) is dict else doc
+        doc = self.model(doc) if type(doc) is dict else doc
         doc.validate()
-        self._table.append(doc.doc())
-        self.update_links(doc)
+        self._table.append(doc.doc(), txn=txn)
+        self.update_links(doc, txn)
         return doc
 
-    def update_links(self, context):
+    def update_links(self, context, txn=None):
         """
         Update any linkages attached to this model
         :param context: the base we're updating against
+        :param txn: an open write transaction, if not supplied the update runs in a transaction of its own
         """
+        if txn is None:
+            with self.begin() as txn:
+                return self.update_links(context, txn)
+        links = context._map or {}
         for link in self._links:
-            results = context.__dict__['_map'].get(link._dst_key)
-            diff = context.__dict__['_dif'].get(link._dst_key)
+            results = links.get(link._dst_key)
+            diff = context._dif.get(link._dst_key) if results is not None else None
             if results is not None:
+                existing = None
                 for doc in results:
                     if doc.is_new():
-                        link.add_dependent(doc, context)
+                        link.add_dependent(doc, context, txn)
                     elif doc.is_dirty():
-                        link.upd_dependent(doc, context)
-                    doc.update_links()
-                link.del_dependent(context, set(diff) - set(results))
-                context.__dict__['_dif'][link._dst_key] = results[:]
+                        if existing is None:
+                            existing = link.existing(context, txn)
+                        link.upd_dependent(doc, context, txn, existing)
+                    doc.update_links(txn)
+                removed = set(diff) - set(results)
+                if removed:
+                    link.del_dependent(context, removed, txn, existing)
+                context._dif[link._dst_key] = results[:]
 
-    def save(self, doc):
+    def save(self, doc, txn=None):
         """
         Simple interface to the database 'save' method
         :param doc: the document (dict) to save
+        :param txn: an open write transaction
         """
-        self._table.save(doc)
+        self._table.save(doc, txn=txn)
 
-    def append(self, doc):
+    def append(self, doc, txn=None):
         """
         Simple interface to the database 'append' method
         :param doc: the document (dict) to append
+        :param txn: an open write transaction
         """
-        self._table.append(doc)
+        self._table.append(doc, txn=txn)
 
     def add_calculated(self, key, val):
         """
@@ -245,6 +545,7 @@ class Table(object):
         """
         self._calculated[key] = val
         self._links.append(val)
+        self._model_class = None
 
     @property
     def table_name(self):
@@ -305,7 +606,7 @@ class DirtyList(list):
         :param obj: the object to append (either a BaseModel or dict)
         """
         if type(obj) == dict:
-            obj = BaseModel(obj, instance=self._instance)
+            obj = self._instance.model(obj)
         super().append(obj)
         obj.is_dirty(True)
         return obj
@@ -333,66 +634,174 @@ class ManyToManyLink(BaseType):
         :param doc: our current document
         :return: a list containing linked records
         """
-        results = DirtyList(self._classB)
-        if '_id' in doc:
-            key = {self._src_key: doc['_id'].decode()}
-            for link in self._table.seek(self._src_key, key):
-                results.append(self._classB.get(link[self._dst_key].encode()))
+        return self.resolve([doc]).get(doc.get('_id'), DirtyList(self._classB))
+
+    def resolve(self, docs):
+        """
+        Find the linked records for a number of documents in a single read transaction, the link ids
+        are collected with one pass over the link index, then the link records and the linked records
+        are each read with a single get_many
+        :param docs: the (master) documents to resolve
+        :return: a dict mapping the _id of each document with links to a list of linked records
+        """
+        keys = sorted(set(doc['_id'] for doc in docs if '_id' in doc))
+        owners = []
+        index = self._table._indexes[self._src_key]
+        with self._table.begin() as txn:
+            with index.cursor(txn) as cursor:
+                for key in keys:
+                    if not cursor.set_key(key):
+                        continue
+                    owners.extend((link, key) for link in cursor.iternext_dup())
+            links = {}
+            owner = dict(owners)
+            for link in self._table.get_many([link for link, key in owners], txn=txn):
+                links.setdefault(owner[link['_id']], []).append(link[self._dst_key].encode())
+            targets = sorted(set(target for targets in links.values() for target in targets))
+            records = {record['_id']: self._classB.model(record)
+                       for record in self._classB._table.get_many(targets, txn=txn)}
+        results = {}
+        for key, targets in links.items():
+            results[key] = DirtyList(self._classB)
+            list.extend(results[key], [records[target] for target in targets if target in records])
         return results
 
-    def add_link(self, doc, context):
+    def add_link(self, doc, context, txn=None, existing=None):
         """
         Add a new entry to the link table
         :param doc: the document we're linking to
         :param context: the master document we're linking from
+        :param txn: an open write transaction
+        :param existing: the links for the master document (see existing), kept up to date
         """
         lhs = self._classB.table_name
         rhs = self._classA.table_name
         linkage = {lhs: doc.uuid, rhs: context.uuid}
-        self._table.append(linkage)
+        self._table.append(linkage, txn=txn)
+        if existing is not None:
+            existing[doc.uuid] = linkage['_id']
 
-    def add_dependent(self, doc, context):
+    def add_dependent(self, doc, context, txn=None):
         """
         Commit the current document and add an appropriate link to it
         :param doc: the document we're writing
         :param context: the master document we're linking from
+        :param txn: an open write transaction
         """
-        self._classB.append(doc.doc())
-        self.add_link(doc, context)
+        self._classB.append(doc.doc(), txn)
+        doc.is_dirty(False)
+        self.add_link(doc, context, txn)
 
-    def _lookup(self, context, doc):
+    def existing(self, context, txn):
         """
-        Lookup an entry in the table linkage index
+        Read all the links from a master document with one pass over the link index
         :param context: the master document
-        :param doc: the slave document
-        :return: the index item
-        """
-        a = self._classA.table_name
-        b = self._classB.table_name
-        return self._table.seek_one(a+b, {a: context.uuid, b: doc.uuid})
-
-    def upd_dependent(self, doc, context):
+        :param txn: an open transaction
+        :return: a dict mapping the uuid of each linked document to the _id of its link table entry
+        """
+        links = {}
+        if context.is_new():
+            return links
+        index = self._table._indexes[self._src_key]
+        with index.cursor(txn) as cursor:
+            if cursor.set_key(context.doc()['_id']):
+                for key in cursor.iternext_dup():
+                    link = txn.get(key, db=self._table._db)
+                    if link:
+                        links[loads(link.decode())[self._dst_key]] = key
+        return links
+
+    def upd_dependent(self, doc, context, txn=None, existing=None):
         """
         Update a dependent record that has been changed
         :param doc: the document that has changed
         :param context: the master document
+        :param txn: an open write transaction
+        :param existing: the links for the master document (see existing)
         """
+        if existing is None:
+            existing = self.existing(context, txn)
         if doc.is_dirty():
             doc.validate()
-            self._classB.save(doc.doc())
+            self._classB.save(doc.doc(), txn)
             doc.is_dirty(False)
-        item = self._lookup(context, doc)
-        self.add_link(doc, context) if not item else None
+        if doc.uuid not in existing:
+            self.add_link(doc, context, txn, existing)
 
-    def del_dependent(self, context, docs):
+    def del_dependent(self, context, docs, txn=None, existing=None):
         """
         Delete links to models that no longer exist
         :param context: the master document
+        :param docs: the documents that are no longer linked
+        :param txn: an open write transaction
+        :param existing: the links for the master document (see existing)
         """
+        if existing is None:
+            existing = self.existing(context, txn)
+        keys = []
         for doc in docs:
-            item = self._lookup(context, doc)
-            if not item: raise PyMambaForeignKeyViolation('link table item is missing')
-            self._table.delete(item['_id'], ),
+            if doc.uuid not in existing: raise PyMambaForeignKeyViolation('link table item is missing')
+            keys.append(existing.pop(doc.uuid))
+        if keys:
+            self._table.delete(keys, txn=txn)
+
+
+class Session(object):
+    """
+    A unit of work, models are registered with the session as they change and are all saved
+    (along with any changes to their links) in a single write transaction when the session is
+    flushed, or when the "with" block the session is used in ends without an exception.
+
+        with Session(database) as session:
+            user.surname = 'smith'
+            session.add(user)
+    """
+    def __init__(self, database):
+        """
+        Create a new session
+        :param database: the database the models belong to
+        """
+        self._database = database
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._pending = []
+            return
+        self.flush()
+
+    def add(self, *models):
+        """
+        Register models to be saved when the session is flushed
+        :param models: the models (BaseModel) to save
+        """
+        for model in models:
+            if not any(model is pending for pending in self._pending):
+                self._pending.append(model)
+
+    def flush(self):
+        """
+        Save all the registered models in one write transaction, if any save fails nothing is written
+        and the models are left as they were (still dirty, and still registered with the session)
+        :return: the number of models saved
+        """
+        pending = self._pending
+        state = _snapshot(pending)
+        try:
+            with self._database.env.begin(write=True) as txn:
+                for model in pending:
+                    if model.is_new():
+                        model._instance.add(model, txn)
+                    else:
+                        model.save(txn)
+        except Exception:
+            _restore(state)
+            raise
+        self._pending = []
+        return len(pending)
 
 
 class PyMambaForeignKeyViolation(BaseException):
@@ -0,0 +1,322 @@
+from datetime import datetime, timezone
+from sys import maxsize
+from ujson import loads, dumps
+from .utils import xNotFound, xIndexMissing
+
+PERIODS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m'
+}
+
+
+def _timestamp(value):
+    """
+    Convert a time value into a naive UTC datetime
+
+    :param value: A datetime, an epoch time in seconds, or an ISO format string
+    :type value: datetime|int|float|str
+    :return: The time
+    :rtype: datetime
+    """
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    return _timestamp(datetime.fromisoformat(value))
+
+
+class PartitionedTable(object):
+    """
+    A logical table stored as one table per day (or month), named "<name>@<period>", for
+    example "events@2026-10-17". Each partition has it's own copy of the table's indexes.
+    Queries over a time range only visit the partitions that overlap it, and expiring old
+    data drops whole partitions rather than deleting records one at a time.
+
+    :param ctx: An open database
+    :type ctx: Database
+    :param name: The name of the logical table
+    :type name: str
+    :param field: The field holding each record's time (datetime, epoch seconds or ISO string)
+    :type field: str
+    :param period: The partition size, "day" or "month"
+    :type period: str
+    """
+    def __init__(self, ctx, name, field='when', period='day'):
+        if period not in PERIODS:
+            raise ValueError('period must be one of {}'.format(', '.join(PERIODS)))
+        self._ctx = ctx
+        self._name = name
+        self._key = '__partition_{}__'.format(name).encode()
+        with ctx.env.begin(write=True) as txn:
+            doc = txn.get(self._key, db=ctx._meta._db)
+            if doc:
+                self._conf = loads(doc.decode())
+            else:
+                self._conf = {'field': field, 'period': period, 'indexes': {}}
+                txn.put(self._key, dumps(self._conf).encode(), db=ctx._meta._db)
+        self._format = PERIODS[self._conf['period']]
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def field(self):
+        return self._conf['field']
+
+    def partition(self, when):
+        """
+        Return the name of the partition holding a given time
+
+        :param when: A time (datetime, epoch seconds or ISO string)
+        :type when: datetime|int|float|str
+        :return: The partition (table) name
+        :rtype: str
+        """
+        return '{}@{}'.format(self._name, _timestamp(when).strftime(self._format))
+
+    def partitions(self, lower=None, upper=None):
+        """
+        List the partitions that overlap a time range, oldest first
+
+        :param lower: The start of the range, or None for no lower limit
+        :type lower: datetime|int|float|str
+        :param upper: The end of the range, or None for no upper limit
+        :type upper: datetime|int|float|str
+        :return: Partition (table) names
+        :rtype: list
+        """
+        prefix = self._name + '@'
+        names = sorted(name for name in self._ctx.tables if name.startswith(prefix))
+        if lower is not None:
+            first = self.partition(lower)
+            names = [name for name in names if name >= first]
+        if upper is not None:
+            last = self.partition(upper)
+            names = [name for name in names if name <= last]
+        return names
+
+    def _table(self, name, txn=None):
+        """
+        Open (or create) a partition, making sure it has all of the table's indexes
+        """
+        table = self._ctx.table(name, txn=txn)
+        for index, conf in self._conf['indexes'].items():
+            if index not in table._indexes:
+                table.index(index, conf['func'], conf['duplicates'], txn=txn, unique=conf['unique'])
+        return table
+
+    def _save_conf(self):
+        with self._ctx.env.begin(write=True) as txn:
+            txn.put(self._key, dumps(self._conf).encode(), db=self._ctx._meta._db)
+
+    def index(self, name, func, duplicates=False, unique=False):
+        """
+        Add an index to every partition, current and future (unique indexes are unique within
+        each partition)
+
+        :param name: The name of the index
+        :type name: str
+        :param func: A specification of the index
+        :type func: str
+        :param duplicates: Whether this index will allow duplicate keys
+        :type duplicates: bool
+        :param unique: Whether the index should enforce unique keys
+        :type unique: bool
+        """
+        self._conf['indexes'][name] = {'func': func, 'duplicates': duplicates, 'unique': unique}
+        self._save_conf()
+        for partition in self.partitions():
+            self._table(partition)
+
+    def drop_index(self, name):
+        """
+        Drop an index from every partition
+
+        :param name: The name of the index
+        :type name: str
+        """
+        if name not in self._conf['indexes']:
+            raise xIndexMissing(name)
+        del self._conf['indexes'][name]
+        self._save_conf()
+        for partition in self.partitions():
+            self._ctx.table(partition).drop_index(name)
+
+    def indexes(self):
+        return sorted(self._conf['indexes'])
+
+    def append(self, record, txn=None):
+        """
+        Append a record to the partition for it's time, creating the partition if need be
+
+        :param record: The record to append, it must have a value for the time field
+        :type record: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        """
+        return self._table(self.partition(record[self.field]), txn).append(record, txn=txn)
+
+    def _locate(self, key):
+        """
+        Find the partition holding a record, newest partitions are checked first
+        """
+        for partition in reversed(self.partitions()):
+            table = self._ctx.table(partition)
+            if table.get(key):
+                return table
+        return None
+
+    def get(self, key):
+        """
+        Get a single record by key
+
+        :param key: The _id of the record
+        :type key: bytes
+        :return: The record, or None if it doesn't exist
+        :rtype: dict
+        """
+        table = self._locate(key)
+        return table.get(key) if table else None
+
+    def save(self, record):
+        """
+        Save changes to a pre-existing record, moving it to another partition if it's time has
+        moved out of the current one
+
+        :param record: The record to save
+        :type record: dict
+        """
+        table = self._locate(record['_id'])
+        if not table:
+            raise xNotFound(record['_id'])
+        name = self.partition(record[self.field])
+        if table.name == name:
+            return table.save(record)
+        target = self._table(name)
+        with self._ctx.begin() as txn:
+            txn.delete(table, [record['_id']])
+            txn.append(target, dict(record))
+
+    def delete(self, keys):
+        """
+        Delete records by key
+
+        :param keys: A list of database keys to delete or a record
+        :type keys: list|dict
+        """
+        if not isinstance(keys, list):
+            keys = [keys['_id']] if isinstance(keys, dict) else [keys]
+        for key in keys:
+            table = self._locate(key)
+            if not table:
+                raise xNotFound(key)
+            table.delete([key])
+
+    def find(self, index=None, lower=None, upper=None, expression=None, limit=maxsize, reverse=False):
+        """
+        Find the records within a time range, only the partitions overlapping the range are read
+        and only the first and last of those are filtered by time. Partitions are visited in time
+        order, records within each partition come back in _id or index order.
+
+        :param index: The name of an index to read each partition in, or None for natural order
+        :type index: str
+        :param lower: The start of the range (inclusive), or None
+        :type lower: datetime|int|float|str
+        :param upper: The end of the range (inclusive), or None
+        :type upper: datetime|int|float|str
+        :param expression: An optional filter expression
+        :type expression: function
+        :param limit: The maximum number of records to return
+        :type limit: int
+        :param reverse: Visit partitions (and records) newest first
+        :type reverse: bool
+        :return: The matching records (generator)
+        :rtype: dict
+        """
+        partitions = self.partitions(lower, upper)
+        edges = set(partitions[:1] + partitions[-1:])
+        start = _timestamp(lower) if lower is not None else None
+        end = _timestamp(upper) if upper is not None else None
+        field = self.field
+        count = 0
+        for partition in reversed(partitions) if reverse else partitions:
+            bounded = partition in edges and (start or end)
+            for record in self._ctx.table(partition).find(index, reverse=reverse):
+                if bounded:
+                    when = _timestamp(record[field])
+                    if (start and when < start) or (end and when > end):
+                        continue
+                if callable(expression) and not expression(record):
+                    continue
+                if count >= limit:
+                    return
+                yield record
+                count += 1
+
+    def seek(self, index, record, lower=None, upper=None):
+        """
+        Find the records matching an index key within the partitions overlapping a time range
+
+        :param index: Name of the index to seek on
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :param lower: The first partition to search, or None
+        :type lower: datetime|int|float|str
+        :param upper: The last partition to search, or None
+        :type upper: datetime|int|float|str
+        :return: The records with matching keys (generator)
+        :rtype: dict
+        """
+        for partition in self.partitions(lower, upper):
+            yield from self._ctx.table(partition).seek(index, record)
+
+    def count(self, lower=None, upper=None):
+        """
+        Count the records in the partitions overlapping a time range
+
+        :return: The number of records
+        :rtype: int
+        """
+        return sum(self._ctx.table(partition).records for partition in self.partitions(lower, upper))
+
+    @property
+    def records(self):
+        return self.count()
+
+    def drop_partition(self, partition):
+        """
+        Drop a partition and all of it's records
+
+        :param partition: The partition (table) name, or a time within the partition
+        :type partition: str|datetime|int|float
+        """
+        if not (isinstance(partition, str) and partition.startswith(self._name + '@')):
+            partition = self.partition(partition)
+        self._ctx.drop(partition)
+
+    def expire(self, before):
+        """
+        Drop every partition that ends before a given time
+
+        :param before: Partitions entirely older than this are dropped
+        :type before: datetime|int|float|str
+        :return: The names of the partitions dropped
+        :rtype: list
+        """
+        current = self.partition(before)
+        dropped = [partition for partition in self.partitions() if partition < current]
+        with self._ctx.env.begin(write=True) as txn:
+            for partition in dropped:
+                self._ctx.drop(partition, txn=txn)
+        return dropped
+
+    def drop(self):
+        """
+        Drop every partition and the table definition
+        """
+        for partition in self.partitions():
+            self._ctx.drop(partition)
+        with self._ctx.env.begin(write=True) as txn:
+            txn.delete(self._key, db=self._ctx._meta._db)
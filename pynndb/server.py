@@ -0,0 +1,357 @@
+"""
+A local database server, one process holds a Database open and serves it to any number of
+client processes (see client.py) over a Unix socket or TCP, so short lived workers don't each
+pay to open the environment and all writes are funnelled through one process.
+
+Every message is a frame, a fixed size header followed by a JSON body;
+
+    request     >II  body length, request id            body: [op, table, args]
+    response    >IIB body length, request id, status    body: result
+
+Clients may send any number of requests without waiting for the responses (pipelining), each
+response carries the id of the request it answers. Reads on a connection run concurrently and
+may complete out of order, a write waits for the requests before it and holds back those after
+it, so a client always sees it's own writes. A request that can't be decoded is answered with
+an error rather than dropping the connection. Queries stream their results as a series of
+STATUS_MORE frames holding a chunk of records each, ended by a STATUS_OK frame. Record keys
+(_id) travel as strings.
+"""
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from os import unlink
+from os.path import exists
+from socket import IPPROTO_TCP, TCP_NODELAY
+from struct import Struct
+from sys import maxsize
+from threading import Thread, Lock
+from ujson import loads, dumps
+from .utils import xTableMissing
+
+REQUEST = Struct('>II')
+RESPONSE = Struct('>IIB')
+STATUS_OK = 0
+STATUS_MORE = 1
+STATUS_ERROR = 2
+CHUNK = 1000
+WRITES = frozenset(('ensure', 'append', 'save', 'update', 'delete'))
+QUERIES = frozenset(('find', 'range', 'seek'))
+
+
+def read_frame(fp, header, decode=True):
+    """
+    Read a single frame from a stream
+
+    :param fp: A buffered (binary) stream
+    :type fp: file
+    :param header: The header layout, REQUEST or RESPONSE
+    :type header: Struct
+    :param decode: Decode the body, otherwise it's returned as bytes
+    :type decode: bool
+    :return: The header fields followed by the body, or None at the end of the stream
+    :rtype: tuple
+    """
+    data = fp.read(header.size)
+    if len(data) < header.size:
+        return None
+    fields = header.unpack(data)
+    body = fp.read(fields[0])
+    if len(body) < fields[0]:
+        return None
+    return fields[1:] + ((loads(body.decode()) if decode else body),)
+
+
+def encode_frame(header, rid, body, *extra):
+    """
+    Encode a single frame
+
+    :param header: The header layout, REQUEST or RESPONSE
+    :type header: Struct
+    :param rid: The request id
+    :type rid: int
+    :param body: The (JSON serialisable) body
+    :type body: object
+    :param extra: Any further header fields (the response status)
+    :return: The encoded frame
+    :rtype: bytes
+    """
+    body = dumps(body).encode()
+    return header.pack(len(body), rid, *extra) + body
+
+
+def to_wire(record):
+    """
+    Make a record JSON serialisable, the _id becomes a string
+    """
+    if record is not None and isinstance(record.get('_id'), bytes):
+        record = dict(record, _id=record['_id'].decode())
+    return record
+
+
+def from_wire(record):
+    """
+    Reverse to_wire, the _id becomes bytes again
+    """
+    if record is not None and isinstance(record.get('_id'), str):
+        record['_id'] = record['_id'].encode()
+    return record
+
+
+def _match(match):
+    """
+    Generate a filter expression from a dict of field values a record must have
+    """
+    if not match:
+        return None
+    items = list(match.items())
+    return lambda doc: all(doc.get(field) == value for field, value in items)
+
+
+def _spawn(function, *args):
+    """
+    Run a function in a thread of it's own, returning a Future for the result
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except BaseException as error:
+            future.set_exception(error)
+    Thread(target=run, daemon=True).start()
+    return future
+
+
+def _error_frame(rid, error):
+    """
+    Encode the response for a request that failed
+    """
+    body = [type(error).__name__, [str(arg) for arg in error.args]]
+    return encode_frame(RESPONSE, rid, body, STATUS_ERROR)
+
+
+class Server(object):
+    """
+    Serve a database over a Unix socket (address is a path) or TCP (address is a (host, port)
+    tuple). Each connection is read by it's own thread, point reads are handed to a pool of
+    worker threads shared by all connections while writes are run in order by the connection.
+    Queries stream their results and can be held up for as long as a client takes to read them,
+    so each query runs in a thread of it's own rather than tying up a worker in the pool.
+
+    :param database: An open database
+    :type database: Database
+    :param address: A socket path, or a (host, port) tuple
+    :type address: str|tuple
+    :param workers: The number of worker threads, 0 answers every request in arrival order
+    :type workers: int
+    """
+    def __init__(self, database, address, workers=4):
+        self._db = database
+        self._thread = None
+        self._pool = ThreadPoolExecutor(workers) if workers else None
+        self._ops = {
+            'ping': lambda table, args: 'pong',
+            'tables': lambda table, args: self._db.tables,
+            'indexes': lambda table, args: table.indexes(),
+            'records': lambda table, args: table.records,
+            'ensure': self._ensure,
+            'get': self._get,
+            'append': self._append,
+            'save': self._save,
+            'update': self._update,
+            'delete': self._delete,
+            'count': lambda table, args: table.count(args['index'], args['record']),
+            'count_range': lambda table, args: table.count_range(
+                args['index'], args.get('lower'), args.get('upper')),
+            'find': self._find,
+            'range': self._range,
+            'seek': self._seek,
+        }
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                if isinstance(address, tuple):
+                    self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+            def handle(self):
+                server._handle(self.rfile, self.connection)
+
+        if isinstance(address, tuple):
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self._server = socketserver.ThreadingTCPServer(address, Handler)
+        else:
+            if exists(address):
+                unlink(address)
+            self._server = socketserver.ThreadingUnixStreamServer(address, Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        """
+        PROPERTY - The address the server is listening on, for TCP this includes the port chosen
+        when the server was started on port 0
+
+        :getter: The socket path, or a (host, port) tuple
+        :type: str|tuple
+        """
+        return self._server.server_address
+
+    def serve_forever(self):
+        """
+        Handle requests until close is called (from another thread)
+        """
+        self._server.serve_forever()
+
+    def start(self):
+        """
+        Start handling requests in a background thread
+        """
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop the server and release it's socket
+        """
+        if self._thread:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if self._pool:
+            self._pool.shutdown()
+        if isinstance(self.address, str) and exists(self.address):
+            unlink(self.address)
+
+    def _handle(self, rfile, sock):
+        """
+        Answer the requests arriving on one connection until the client disconnects
+        """
+        lock = Lock()
+
+        def send(frame):
+            with lock:
+                sock.sendall(frame)
+
+        running = []
+        while True:
+            frame = read_frame(rfile, REQUEST, decode=False)
+            if frame is None:
+                wait(running)
+                return
+            rid, body = frame
+            try:
+                op, name, args = loads(body.decode())
+            except Exception as error:
+                try:
+                    send(_error_frame(rid, ValueError('malformed request ({})'.format(error))))
+                except OSError:
+                    pass
+                continue
+            if self._pool is None or op in WRITES:
+                wait(running)
+                running = []
+                self._answer(rid, op, name, args or {}, send)
+            else:
+                running = [future for future in running if not future.done()]
+                if op in QUERIES:
+                    running.append(_spawn(self._answer, rid, op, name, args or {}, send))
+                else:
+                    running.append(self._pool.submit(self._answer, rid, op, name, args or {}, send))
+
+    def _answer(self, rid, op, name, args, send):
+        """
+        Run one request and send the response, query results are sent a chunk at a time. If the
+        client goes away part way through, the query is closed so it's transaction is released.
+        """
+        try:
+            try:
+                if op not in self._ops:
+                    raise ValueError('unknown operation "{}"'.format(op))
+                table = self._table(name, op in WRITES) if name else None
+                result = self._ops[op](table, args)
+                if hasattr(result, '__next__'):
+                    try:
+                        chunk = []
+                        for record in result:
+                            chunk.append(to_wire(record))
+                            if len(chunk) == args.get('chunk', CHUNK):
+                                send(encode_frame(RESPONSE, rid, chunk, STATUS_MORE))
+                                chunk = []
+                    finally:
+                        result.close()
+                    result = chunk
+                frame = encode_frame(RESPONSE, rid, result, STATUS_OK)
+            except Exception as error:
+                frame = _error_frame(rid, error)
+            send(frame)
+        except OSError:
+            pass
+
+    def _table(self, name, create):
+        """
+        Look up the table a request refers to, only writes may create a table
+        """
+        if not create and name not in self._db._tables and name not in self._db.tables_all:
+            raise xTableMissing(name)
+        return self._db.table(name)
+
+    def _ensure(self, table, args):
+        table.ensure(args['index'], args['func'], args.get('duplicates', False),
+                     unique=args.get('unique', False))
+
+    def _get(self, table, args):
+        with table.begin() as txn:
+            return [to_wire(table.get(key.encode(), txn=txn)) for key in args['keys']]
+
+    def _append(self, table, args):
+        records = [from_wire(record) for record in args['records']]
+        with self._db.begin() as txn:
+            for record in records:
+                txn.append(table, record)
+        return [record['_id'].decode() for record in records]
+
+    def _save(self, table, args):
+        with self._db.begin() as txn:
+            for record in args['records']:
+                txn.save(table, from_wire(record))
+
+    def _update(self, table, args):
+        with self._db.begin() as txn:
+            txn.update(table, args['key'].encode(), args['spec'])
+
+    def _delete(self, table, args):
+        with self._db.begin() as txn:
+            txn.delete(table, [key.encode() for key in args['keys']])
+
+    def _find(self, table, args):
+        with table.begin() as txn:
+            yield from table.find(args.get('index'), _match(args.get('match')), args.get('limit') or maxsize,
+                                  txn=txn, reverse=args.get('reverse', False), skip=args.get('skip', 0))
+
+    def _range(self, table, args):
+        expression = _match(args.get('match'))
+        limit = args.get('limit') or maxsize
+        skip = args.get('skip', 0)
+        with table.begin() as txn:
+            records = table.range(args['index'], args.get('lower'), args.get('upper'), txn=txn,
+                                  reverse=args.get('reverse', False), skip=0 if expression else skip,
+                                  limit=maxsize if expression else limit)
+            for record in records:
+                if expression:
+                    if not expression(record):
+                        continue
+                    if skip:
+                        skip -= 1
+                        continue
+                yield record
+                limit -= 1
+                if not limit:
+                    return
+
+    def _seek(self, table, args):
+        with table.begin() as txn:
+            yield from table.seek(args['index'], args['record'], args.get('limit') or maxsize, txn=txn,
+                                  reverse=args.get('reverse', False), skip=args.get('skip', 0))
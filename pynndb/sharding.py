@@ -0,0 +1,484 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from heapq import merge
+from os import listdir, makedirs
+from os.path import exists, join
+from sys import maxsize
+from zlib import crc32
+from bson import ObjectId
+from ujson import loads, dumps
+from .database import Database
+from .utils import xTableMissing, xNotFound, xNoKey
+
+
+class ShardedDatabase(object):
+    """
+    A database partitioned across a number of LMDB environments (shards), each in it's own
+    directory below the database path. Each shard has it's own writer lock and map, so writes
+    to different shards (from different threads or processes) don't serialise behind each other.
+    Tables are accessed through ShardedTable, which mirrors the Table API.
+
+    :param name: The path to the database directory
+    :type name: str
+    :param shards: The number of shards, only used when creating a new database
+    :type shards: int
+    :param conf: Any additional or custom options for each environment
+    :type conf: dict
+    :param binlog: Whether each shard keeps a binlog
+    :type binlog: bool
+    :param size: The map size for each shard
+    :type size: int
+    """
+    def __init__(self, name, shards=4, conf=None, binlog=True, size=None):
+        self._name = name
+        self._tables = {}
+        names = sorted((entry for entry in listdir(name) if entry.isdigit()), key=int) if exists(name) else []
+        if not names:
+            makedirs(name, exist_ok=True)
+            names = ['{:02}'.format(shard) for shard in range(shards)]
+        self._shards = [Database(join(name, shard), conf, binlog, size) for shard in names]
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def shards(self):
+        """
+        PROPERTY - The databases holding each shard
+
+        :getter: A list of databases
+        :type: list
+        """
+        return self._shards
+
+    @property
+    def tables(self):
+        return self._shards[0].tables
+
+    def exists(self, name):
+        """
+        Test whether a table with a given name already exists
+
+        :param name: Table name
+        :type name: str
+        :return: True if table exists
+        :rtype: bool
+        """
+        return name in self.tables
+
+    def table(self, name, shard_key=None, boundaries=None):
+        """
+        Return a reference to a sharded table, creating it first if it doesn't exist. By default
+        records are placed by a hash of their _id. If a shard key is given records are placed by
+        a hash of that field, or if boundaries are also given, by range; a record goes to the
+        first shard whose boundary is greater than its shard key. The placement of a table is
+        fixed when it is created.
+
+        :param name: Name of table
+        :type name: str
+        :param shard_key: The (top level) field records are placed by, rather than _id
+        :type shard_key: str
+        :param boundaries: A sorted list of (number of shards - 1) shard key values
+        :type boundaries: list
+        :return: Reference to table
+        :rtype: ShardedTable
+        """
+        if name not in self._tables:
+            meta = self._shards[0]._meta
+            key = '__shard_{}__'.format(name).encode()
+            with self._shards[0].env.begin(write=True) as txn:
+                doc = txn.get(key, db=meta._db)
+                if doc:
+                    doc = loads(doc.decode())
+                else:
+                    if boundaries and len(boundaries) != len(self._shards) - 1:
+                        raise ValueError('need {} boundaries'.format(len(self._shards) - 1))
+                    doc = {'shard_key': shard_key, 'boundaries': boundaries}
+                    txn.put(key, dumps(doc).encode(), db=meta._db)
+            self._tables[name] = ShardedTable(self, name, doc['shard_key'], doc['boundaries'])
+        return self._tables[name]
+
+    def drop(self, name):
+        """
+        Drop a table from every shard
+
+        :param name: Name of table to drop
+        :type name: str
+        """
+        if name not in self.tables:
+            raise xTableMissing
+        for shard in self._shards:
+            shard.drop(name)
+        with self._shards[0].env.begin(write=True) as txn:
+            txn.delete('__shard_{}__'.format(name).encode(), db=self._shards[0]._meta._db)
+        self._tables.pop(name, None)
+
+    def sync(self, force=False):
+        for shard in self._shards:
+            shard.sync(force)
+
+    def close(self):
+        """
+        Close every shard
+        """
+        for shard in getattr(self, '_shards', []):
+            shard.close()
+
+
+class ShardedTable(object):
+    """
+    A table partitioned across the shards of a ShardedDatabase. Writes are routed to a single
+    shard, reads scatter to every shard (unless the shard can be worked out from the _id) and
+    ordered reads are merged so results come back in the same order as they would from a
+    single Table. Transactions don't span shards, so none of the methods take a transaction,
+    moving a record whose shard key has changed is not atomic (the record is written to it's
+    new shard before it is removed from the old one, so for a moment both hold it) and unique
+    indexes are only unique within each shard.
+
+    :param ctx: The sharded database
+    :type ctx: ShardedDatabase
+    :param name: The table name
+    :type name: str
+    :param shard_key: The field records are placed by, or None for _id
+    :type shard_key: str
+    :param boundaries: Shard key boundaries for range placement, or None for hash placement
+    :type boundaries: list
+    """
+    def __init__(self, ctx, name, shard_key=None, boundaries=None):
+        self._ctx = ctx
+        self._name = name
+        self._shard_key = shard_key
+        self._boundaries = boundaries
+        self._tables = [shard.table(name) for shard in ctx.shards]
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def shards(self):
+        """
+        PROPERTY - The table in each shard
+
+        :getter: A list of tables
+        :type: list
+        """
+        return self._tables
+
+    def shard(self, record):
+        """
+        Work out which shard a record belongs in
+
+        :param record: A record (with an _id if placed by _id)
+        :type record: dict
+        :return: The shard number
+        :rtype: int
+        :raises: xNoKey if the table is placed by range and the record has no shard key
+        """
+        if not self._shard_key:
+            key = record['_id']
+            return crc32(key if isinstance(key, bytes) else str(key).encode()) % len(self._tables)
+        value = record.get(self._shard_key)
+        if self._boundaries:
+            if value is None:
+                raise xNoKey('record has no shard key "{}"'.format(self._shard_key))
+            return bisect_right(self._boundaries, value)
+        return crc32(dumps(value).encode()) % len(self._tables)
+
+    def _locate(self, key):
+        """
+        Find the shard holding a record
+
+        :param key: The _id of the record
+        :type key: bytes
+        :return: The shard number, or None if the record does not exist
+        :rtype: int
+        """
+        if not self._shard_key:
+            return self.shard({'_id': key})
+        for number, table in enumerate(self._tables):
+            if table.get(key):
+                return number
+        return None
+
+    def append(self, record, upsert=False):
+        """
+        Append a new record to the table (in the shard it is placed in)
+
+        :param record: The record to append
+        :type record: dict
+        :param upsert: On a unique index conflict, merge the record into the existing record
+        :type upsert: bool
+        """
+        if '_id' not in record:
+            record['_id'] = str(ObjectId()).encode()
+        return self._tables[self.shard(record)].append(record, upsert=upsert)
+
+    def load(self, records, batch=10000, progress=None):
+        """
+        Bulk load records (see Table.load), records are split by shard and each shard is loaded
+        in it's own thread
+
+        :param records: The records to load
+        :type records: iterable
+        :param batch: The number of records to sort and write at a time
+        :type batch: int
+        :return: The number of records loaded
+        :rtype: int
+        """
+        parts = [[] for table in self._tables]
+        for record in records:
+            record = dict(record)
+            if '_id' not in record:
+                record['_id'] = str(ObjectId()).encode()
+            parts[self.shard(record)].append(record)
+        with ThreadPoolExecutor(len(self._tables)) as pool:
+            jobs = [pool.submit(table.load, part, batch) for table, part in zip(self._tables, parts)]
+            return sum(job.result() for job in jobs)
+
+    def get(self, key):
+        """
+        Get a single record by key
+
+        :param key: The _id of the record
+        :type key: bytes
+        :return: The record, or None if it doesn't exist
+        :rtype: dict
+        """
+        number = self._locate(key)
+        return None if number is None else self._tables[number].get(key)
+
+    def delete(self, keys):
+        """
+        Delete records from the table
+
+        :param keys: A list of database keys to delete or a record
+        :type keys: list|dict
+        """
+        if not isinstance(keys, list):
+            keys = [keys['_id']] if isinstance(keys, dict) else [keys]
+        for key in keys:
+            number = self._locate(key)
+            if number is None:
+                raise xNotFound(key)
+            self._tables[number].delete([key])
+
+    def save(self, record):
+        """
+        Save changes to a pre-existing record, moving it to a different shard if it's shard key
+        has changed
+
+        :param record: The record to save
+        :type record: dict
+        """
+        number = self.shard(record)
+        current = self._locate(record['_id'])
+        if current is None:
+            raise xNotFound(record['_id'])
+        if current == number:
+            return self._tables[number].save(record)
+        self._move(record, current, number)
+
+    def update(self, key, spec):
+        """
+        Apply a partial update to a pre-existing record (see Table.update)
+
+        :param key: The _id of the record
+        :type key: bytes
+        :param spec: Update operators
+        :type spec: dict
+        :return: The updated record
+        :rtype: dict
+        """
+        number = self._locate(key)
+        if number is None:
+            raise xNotFound(key)
+        old = self._tables[number].get(key)
+        record = self._tables[number].update(key, spec)
+        if self._shard_key and self.shard(record) != number:
+            try:
+                self._move(record, number, self.shard(record))
+            except Exception:
+                self._tables[number].save(old)
+                raise
+        return record
+
+    def _move(self, record, current, number):
+        """
+        Move a record to another shard, it's added to the new shard first so that if that fails
+        the record is still where it was, and removed from the new shard again if it can't be
+        deleted from the old one
+        """
+        self._tables[number].append(dict(record))
+        try:
+            self._tables[current].delete([record['_id']])
+        except Exception:
+            self._tables[number].delete([record['_id']])
+            raise
+
+    def index(self, name, func=None, duplicates=False, unique=False):
+        """
+        Return the named index in each shard, creating it if it's not available
+
+        :param name: The name of the index
+        :type name: str
+        :param func: A specification of the index
+        :type func: str
+        :param duplicates: Whether this index will allow duplicate keys
+        :type duplicates: bool
+        :param unique: Whether keys must be unique (within each shard)
+        :type unique: bool
+        :return: The index in each shard
+        :rtype: list
+        """
+        return [table.index(name, func, duplicates, unique=unique) for table in self._tables]
+
+    def ensure(self, index, func, duplicates=False, force=False, unique=False):
+        return [table.ensure(index, func, duplicates, force, unique) for table in self._tables]
+
+    def drop_index(self, name):
+        for table in self._tables:
+            table.drop_index(name)
+
+    def indexes(self):
+        return self._tables[0].indexes()
+
+    def empty(self):
+        for table in self._tables:
+            table.empty()
+
+    def drop(self):
+        self._ctx.drop(self._name)
+
+    @property
+    def records(self):
+        """
+        Return the number of records in this table
+
+        :getter: Record count
+        :type: int
+        """
+        return sum(table.records for table in self._tables)
+
+    def _ordered(self, table, index, lower, upper, reverse):
+        """
+        Generate (sort key, _id, record) for the records in one shard in index (or _id) order
+        """
+        with table.begin() as txn:
+            for cursor in table.range(index, lower, upper, txn=txn, keyonly=True, reverse=reverse):
+                if index:
+                    key = cursor.value()
+                    record = table.get(key, txn=txn)
+                    yield cursor.key(), key, record
+                else:
+                    key = cursor.key()
+                    record = loads(cursor.value().decode())
+                    record['_id'] = key
+                    yield key, key, record
+
+    def range(self, index, lower=None, upper=None, reverse=False, limit=maxsize, skip=0):
+        """
+        Find all records with a key >= lower and <= upper across every shard, in key order
+        (see Table.range)
+
+        :param index: The name of the index to search, or None for _id order
+        :type index: str
+        :param lower: A template record containing the lower end of the range
+        :type lower: dict
+        :param upper: A template record containing the upper end of the range
+        :type upper: dict
+        :param reverse: Return records in descending order
+        :type reverse: bool
+        :param limit: The maximum number of records to return
+        :type limit: int
+        :param skip: The number of records to skip before returning results
+        :type skip: int
+        :return: The records with keys within the specified range (generator)
+        :rtype: dict
+        """
+        streams = [self._ordered(table, index, lower, upper, reverse) for table in self._tables]
+        count = 0
+        for key, _id, record in merge(*streams, key=lambda entry: entry[:2], reverse=reverse):
+            if count >= limit:
+                break
+            if skip:
+                skip -= 1
+                continue
+            yield record
+            count += 1
+
+    def find(self, index=None, expression=None, limit=maxsize, reverse=False, skip=0):
+        """
+        Find all records either sequentially or based on an index, across every shard, in the
+        same order as Table.find
+
+        :param index: The name of the index to use [OR use natural order]
+        :type index: str
+        :param expression: An optional filter expression
+        :type expression: function
+        :param limit: The maximum number of records to return
+        :type limit: int
+        :param reverse: Return records in descending order
+        :type reverse: bool
+        :param skip: The number of (matching) records to skip before returning results
+        :type skip: int
+        :return: The next record (generator)
+        :rtype: dict
+        """
+        count = 0
+        for record in self.range(index, reverse=reverse):
+            if count >= limit:
+                break
+            if callable(expression) and not expression(record):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield record
+            count += 1
+
+    def seek(self, index, record, limit=maxsize, reverse=False, skip=0):
+        """
+        Find all records matching the key in the specified index, across every shard
+
+        :param index: Name of the index to seek on
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :return: The records with matching keys (generator)
+        :rtype: dict
+        """
+        streams = [table.seek(index, record, reverse=reverse) for table in self._tables]
+        count = 0
+        for doc in merge(*streams, key=lambda doc: doc['_id'], reverse=reverse):
+            if count >= limit:
+                break
+            if skip:
+                skip -= 1
+                continue
+            yield doc
+            count += 1
+
+    def seek_one(self, index, record):
+        """
+        Find the first record matching the key in the specified index, across every shard
+
+        :param index: Name of the index to seek on
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :return: The record with the lowest _id and a matching key
+        :rtype: dict
+        """
+        return next(self.seek(index, record, limit=1), None)
+
+    def count(self, index, record):
+        return sum(table.count(index, record) for table in self._tables)
+
+    def count_range(self, index, lower=None, upper=None):
+        return sum(table.count_range(index, lower, upper) for table in self._tables)
+
+    def exists(self, index, record=None):
+        if record is None:
+            return self._tables[0].exists(index)
+        return any(table.exists(index, record) for table in self._tables)
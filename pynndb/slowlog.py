@@ -0,0 +1,293 @@
+"""
+A log of slow read operations, enabled per database with Database.set_slowlog. Like metrics
+(see metrics.py) it works by replacing the read methods of each table with versions that
+watch what the operation does, so there's no cost when it's off. While it's on each operation
+runs against a transaction that counts the records it reads, and any that take longer than
+the threshold are recorded along with how they were answered (the plan), how many records
+were examined versus returned and the number of bytes decoded. A find with a filter that
+examines a million records to return ten is the sort of thing that needs an index.
+
+The most recent entries are held in a ring buffer, and can optionally be written to the
+__slowlog__ table (by a background thread, so recording an entry never waits on a write
+transaction) to survive a restart.
+"""
+from collections import deque
+from functools import wraps
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import perf_counter, time
+from bson import ObjectId
+from ujson import loads, dumps
+
+QUERIES = ('find', 'range', 'seek')
+TXN_ARGUMENT = {'get': 1, 'find': 3, 'range': 3, 'seek': 3}
+
+
+class _Counter(object):
+    __slots__ = ('examined', 'bytes')
+
+    def __init__(self):
+        self.examined = 0
+        self.bytes = 0
+
+
+class _CountingCursor(object):
+    """
+    A cursor that counts the values it reads from the table itself (as opposed to an index)
+    """
+    def __init__(self, cursor, counter, counted):
+        self._cursor = cursor
+        self._counter = counter
+        self._counted = counted
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        setattr(self, name, attr)
+        return attr
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+    def value(self):
+        value = self._cursor.value()
+        if self._counted:
+            self._counter.examined += 1
+            self._counter.bytes += len(value)
+        return value
+
+
+class _CountingTransaction(object):
+    """
+    A transaction that counts the records read from a table, used in place of the caller's
+    transaction while an operation is being watched
+    """
+    def __init__(self, txn, db, counter):
+        self._txn = txn
+        self._db = db
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._txn, name)
+
+    def get(self, key, default=None, db=None):
+        value = self._txn.get(key, default, db=db)
+        if db is self._db and value:
+            self._counter.examined += 1
+            self._counter.bytes += len(value)
+        return value
+
+    def cursor(self, db=None):
+        return _CountingCursor(self._txn.cursor(db), self._counter, db is self._db)
+
+
+def _counting(table, op, args, kwargs, txn, counter):
+    """
+    Swap the transaction an operation runs against (the caller's, or txn if they didn't pass one)
+    for one that counts the records it reads from the table
+    """
+    position = TXN_ARGUMENT[op]
+    if len(args) > position:
+        txn = _CountingTransaction(args[position] or txn, table._db, counter)
+        return args[:position] + (txn,) + args[position + 1:], kwargs
+    txn = _CountingTransaction(kwargs.get('txn') or txn, table._db, counter)
+    return args, dict(kwargs, txn=txn)
+
+
+def _plan(op, index, expression):
+    if op == 'get':
+        return 'key lookup'
+    if op == 'seek':
+        return 'index seek'
+    if op == 'range':
+        return 'index range' if index else 'key range'
+    return ('index scan' if index else 'table scan') + (' with filter' if callable(expression) else '')
+
+
+class SlowLog(object):
+    """
+    The slow operations for one database
+
+    :param db: The database being watched
+    :type db: Database
+    :param threshold: Operations taking longer than this (seconds) are recorded
+    :type threshold: float
+    :param size: The number of entries to keep in memory
+    :type size: int
+    :param persist: Also write each entry to the __slowlog__ table
+    :type persist: bool
+    """
+    def __init__(self, db, threshold=0.1, size=1000, persist=False):
+        self._db = db
+        self._threshold = threshold
+        self._entries = deque(maxlen=size)
+        self._lock = Lock()
+        self._queue = None
+        self._thread = None
+        self._slowlog = None
+        if persist:
+            self._slowlog = db.env.open_db(b'__slowlog__')
+            self._queue = Queue()
+            self._thread = Thread(target=self._writer, daemon=True)
+            self._thread.start()
+
+    @property
+    def threshold(self):
+        """
+        PROPERTY - Operations taking longer than this many seconds are recorded
+
+        :getter: The threshold
+        :setter: Change the threshold
+        :type: float
+        """
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, threshold):
+        self._threshold = threshold
+
+    def entries(self):
+        """
+        The entries held in memory
+
+        :return: The most recent slow operations, oldest first
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def stored(self, limit=100):
+        """
+        The entries written to the __slowlog__ table (if persisting), which may include entries
+        from earlier sessions
+
+        :param limit: The maximum number of entries to return
+        :type limit: int
+        :return: The most recent slow operations, newest first
+        :rtype: list
+        """
+        results = []
+        if self._slowlog is None:
+            return results
+        with self._db.env.begin() as txn:
+            with txn.cursor(self._slowlog) as cursor:
+                have_data = cursor.last()
+                while have_data and len(results) < limit:
+                    results.append(loads(cursor.value().decode()))
+                    have_data = cursor.prev()
+        return results
+
+    def clear(self):
+        """
+        Discard the entries held in memory
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def record(self, entry):
+        """
+        Add an entry to the log
+
+        :param entry: The details of the operation
+        :type entry: dict
+        """
+        with self._lock:
+            self._entries.append(entry)
+        if self._queue:
+            self._queue.put(entry)
+
+    def close(self):
+        """
+        Stop the background writer once it has written everything queued
+        """
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _writer(self):
+        while True:
+            entries = [self._queue.get()]
+            try:
+                while entries[-1] is not None:
+                    entries.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            with self._db.env.begin(write=True) as txn:
+                for entry in entries:
+                    if entry is not None:
+                        txn.put(str(ObjectId()).encode(), dumps(entry).encode(), db=self._slowlog)
+            if entries[-1] is None:
+                return
+
+    def instrument(self, table):
+        """
+        Replace the read methods of a table with versions that record slow operations, these wrap
+        whatever is there already so they sit on top of any metrics instrumentation
+
+        :param table: The table to watch
+        :type table: Table
+        """
+        if table.name.startswith('__'):
+            return
+        for op in TXN_ARGUMENT:
+            method = getattr(table, op)
+            setattr(table, op, (self._watch_query if op in QUERIES else self._watch)(table, op, method))
+
+    def _observe(self, table, op, args, kwargs, counter, returned, seconds):
+        if seconds < self._threshold:
+            return
+        index = kwargs.get('index', args[0] if args else None) if op != 'get' else None
+        expression = kwargs.get('expression', args[1] if len(args) > 1 else None) if op == 'find' else None
+        self.record({
+            'when': time(),
+            'table': table.name,
+            'op': op,
+            'plan': _plan(op, index, expression),
+            'index': index,
+            'examined': counter.examined,
+            'returned': returned,
+            'bytes': counter.bytes,
+            'seconds': seconds
+        })
+
+    def _watch(self, table, op, method):
+        @wraps(method)
+        def watched(*args, **kwargs):
+            counter = _Counter()
+            with table.begin() as txn:
+                counted_args, counted_kwargs = _counting(table, op, args, kwargs, txn, counter)
+                start = perf_counter()
+                record = method(*counted_args, **counted_kwargs)
+                seconds = perf_counter() - start
+            self._observe(table, op, args, kwargs, counter, int(record is not None), seconds)
+            return record
+        return watched
+
+    def _watch_query(self, table, op, method):
+        @wraps(method)
+        def watched(*args, **kwargs):
+            counter = _Counter()
+            elapsed = 0.0
+            count = 0
+            with table.begin() as txn:
+                counted_args, counted_kwargs = _counting(table, op, args, kwargs, txn, counter)
+                records = method(*counted_args, **counted_kwargs)
+                try:
+                    while True:
+                        start = perf_counter()
+                        try:
+                            record = next(records)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += perf_counter() - start
+                        count += 1
+                        yield record
+                finally:
+                    records.close()
+                    self._observe(table, op, args, kwargs, counter, count, elapsed)
+        return watched
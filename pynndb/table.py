@@ -1,10 +1,23 @@
 import lmdb
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as Base64Error
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+from operator import itemgetter
+from struct import pack, unpack, error as StructError
 from sys import maxsize
+from time import perf_counter
 from bson import ObjectId
 from ujson import loads, dumps
 # from ujson_delta import diff
+from .aggregate import Aggregation, MaterializedAggregate
+from .columns import to_columns
 from .index import Index
-from .utils import _index_name, xWriteFail, xNoKey, xIndexMissing, xNotFound
+from .utils import _index_name, _view_name, xWriteFail, xNoKey, xIndexMissing, xNotFound, xBadOperator, \
+    xDuplicateKey
+
+UPDATE_OPERATORS = ('$set', '$unset', '$inc', '$push')
 
 
 def write_transaction(func):
@@ -14,11 +27,303 @@ def write_transaction(func):
     def wrapped_f(*args, **kwargs):
         if 'txn' in kwargs and kwargs['txn']:
             return func(*args, **kwargs)
-        with args[0]._ctx.env.begin(write=True) as kwargs['txn']:
-            return func(*args, **kwargs)
+        metrics = args[0]._ctx.metrics
+        if not metrics:
+            with args[0]._ctx.env.begin(write=True) as kwargs['txn']:
+                return func(*args, **kwargs)
+        txn = kwargs['txn'] = args[0]._ctx.env.begin(write=True)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            txn.abort()
+            raise
+        start = perf_counter()
+        txn.commit()
+        metrics.observe('commit_seconds', (), perf_counter() - start)
+        return result
     return wrapped_f
 
 
+def _update_path(record, path):
+    """
+    Walk a dotted path down through a record, copying any nested dicts on the way so
+    that the original record is never modified in place
+
+    :param record: The (copied) record to walk
+    :type record: dict
+    :param path: A dotted field path, i.e. "address.postcode"
+    :type path: str
+    :return: The dict holding the final field, and the name of that field
+    :rtype: tuple
+    """
+    parts = path.split('.')
+    node = record
+    for part in parts[:-1]:
+        child = node.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        node[part] = child
+        node = child
+    return node, parts[-1]
+
+
+def _apply_update(record, spec):
+    """
+    Apply a set of update operators to a copy of a record
+
+    :param record: The record to update
+    :type record: dict
+    :param spec: The update operators to apply
+    :type spec: dict
+    :return: The updated record, and the set of top level fields that were changed
+    :rtype: tuple
+    :raises: xBadOperator if the spec contains an unknown operator
+    """
+    rec = dict(record)
+    fields = set()
+    for op, values in spec.items():
+        if op not in UPDATE_OPERATORS:
+            raise xBadOperator(op)
+        for path in values:
+            if path == '_id':
+                raise xBadOperator('{} _id'.format(op))
+            fields.add(path.split('.')[0])
+            if op == '$unset':
+                node, parts = rec, path.split('.')
+                for part in parts[:-1]:
+                    node = node.get(part)
+                    if not isinstance(node, dict):
+                        break
+                else:
+                    if parts[-1] in node:
+                        node, leaf = _update_path(rec, path)
+                        del node[leaf]
+                continue
+            node, leaf = _update_path(rec, path)
+            if op == '$set':
+                node[leaf] = values[path]
+            elif op == '$inc':
+                node[leaf] = node.get(leaf, 0) + values[path]
+            else:
+                node[leaf] = list(node.get(leaf) or []) + [values[path]]
+    return rec, fields
+
+
+def _make_token(key, value=b''):
+    """
+    Generate an opaque continuation token for a cursor position
+
+    :param key: The key at the current position
+    :type key: bytes
+    :param value: The value at the current position (for index cursors, the primary key)
+    :type value: bytes
+    :return: A continuation token
+    :rtype: str
+    """
+    return urlsafe_b64encode(pack('>I', len(key)) + key + value).decode()
+
+
+def _read_token(token):
+    """
+    Decode a continuation token generated by _make_token
+
+    :param token: A continuation token
+    :type token: str
+    :return: The key and value of the position the token refers to
+    :rtype: tuple
+    :raises ValueError: If the token has been altered or truncated
+    """
+    try:
+        data = urlsafe_b64decode(token.encode() if isinstance(token, str) else token)
+        size = unpack('>I', data[:4])[0]
+    except (Base64Error, StructError, TypeError, UnicodeError):
+        size, data = None, b''
+    if size is None or len(data) < 4 + size:
+        raise ValueError('invalid continuation token "{}"'.format(token))
+    return data[4:4+size], data[4+size:]
+
+
+def _distinct(records):
+    """
+    Drop repeats of a record, a scan of a multikey index returns a record once for each of it's
+    entries in the range
+    """
+    seen = set()
+    for record in records:
+        if record['_id'] not in seen:
+            seen.add(record['_id'])
+            yield record
+
+
+def _scan(cursor, lower=None, upper=None, reverse=False, dupsort=False, after=None):
+    """
+    Walk a cursor over all the keys between lower and upper (inclusive) in either direction
+
+    :param cursor: An open cursor
+    :type cursor: Cursor
+    :param lower: The lowest key to return, or None to start at the beginning
+    :type lower: bytes
+    :param upper: The highest key to return, or None to continue to the end
+    :type upper: bytes
+    :param reverse: Walk from upper to lower
+    :type reverse: bool
+    :param dupsort: Whether the cursor is on a dupsort database
+    :type dupsort: bool
+    :param after: A (key, value) position to resume from, the walk starts with the next entry
+    :type after: tuple
+    :return: The cursor, positioned on each entry in turn (generator)
+    :rtype: Cursor
+    """
+    if not reverse:
+        if after:
+            key, value = after
+            if dupsort and cursor.set_range_dup(key, value):
+                have_data = cursor.next() if cursor.value() == value else True
+            elif cursor.set_range(key):
+                if cursor.key() != key:
+                    have_data = True
+                else:
+                    have_data = cursor.next_nodup() if dupsort else cursor.next()
+            else:
+                have_data = False
+            if have_data and lower and cursor.key() < lower:
+                have_data = cursor.set_range(lower)
+        else:
+            have_data = cursor.set_range(lower) if lower else cursor.first()
+        while have_data:
+            if upper and cursor.key() > upper:
+                break
+            yield cursor
+            have_data = cursor.next()
+        return
+
+    def seek_upper():
+        if not upper or not cursor.set_range(upper):
+            return cursor.last()
+        if cursor.key() > upper:
+            return cursor.prev()
+        return cursor.last_dup() if dupsort else True
+
+    if not after:
+        have_data = seek_upper()
+    else:
+        key, value = after
+        if dupsort and cursor.set_range_dup(key, value):
+            have_data = cursor.prev()
+        elif dupsort and cursor.set_key(key):
+            have_data = cursor.last_dup()
+        elif cursor.set_range(key):
+            have_data = cursor.prev()
+        else:
+            have_data = cursor.last()
+        if have_data and upper and cursor.key() > upper:
+            have_data = seek_upper()
+    while have_data:
+        if lower and cursor.key() < lower:
+            break
+        yield cursor
+        have_data = cursor.prev()
+
+
+def _split_keys(cursor, parts, sample=256):
+    """
+    Choose boundary keys that split a table into (roughly) equal key ranges. Keys are sampled
+    from each end of the table to find the alphabet they are drawn from, candidate keys are
+    interpolated between the first and last keys in that alphabet, then snapped to real keys
+    with set_range.
+
+    :param cursor: A cursor on the table
+    :type cursor: Cursor
+    :param parts: The number of ranges required
+    :type parts: int
+    :param sample: The number of keys to sample from each end of the table
+    :type sample: int
+    :return: A list of (lower, upper) key pairs, upper is exclusive and None is unbounded
+    :rtype: list
+    """
+    if not cursor.first():
+        return []
+    first = cursor.key()
+    keys = [key for key, _ in zip(cursor.iternext(values=False), range(sample))]
+    cursor.last()
+    last = cursor.key()
+    keys += [key for key, _ in zip(cursor.iterprev(values=False), range(sample))]
+    prefix = 0
+    while prefix < min(len(first), len(last)) and first[prefix] == last[prefix]:
+        prefix += 1
+    alphabet = sorted(set(byte for key in keys for byte in key[prefix:]))
+    if len(alphabet) < 2:
+        return [(None, None)]
+    base = len(alphabet)
+    width = max(len(first), len(last)) - prefix
+
+    def number(key):
+        value = 0
+        for byte in key[prefix:prefix+width].ljust(width, bytes([alphabet[0]])):
+            value = value * base + min(bisect_left(alphabet, byte), base - 1)
+        return value
+
+    def string(value):
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, base)
+            digits.append(alphabet[digit])
+        return first[:prefix] + bytes(reversed(digits))
+
+    lo, hi = number(first), number(last)
+    bounds = set()
+    for part in range(1, parts):
+        if cursor.set_range(string(lo + (hi - lo) * part // parts)) and cursor.key() > first:
+            bounds.add(cursor.key())
+    bounds = [None] + sorted(bounds) + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+_scan_envs = {}
+
+
+def _scan_partition(path, name, lower, upper, expression, function):
+    """
+    Scan one key range of a table, this runs in a worker process and opens it's own read-only
+    environment (cached for the life of the worker)
+
+    :param path: The path to the database
+    :type path: str
+    :param name: The name of the table
+    :type name: str
+    :param lower: The first key to scan (inclusive), or None
+    :type lower: bytes
+    :param upper: The key to stop at (exclusive), or None
+    :type upper: bytes
+    :param expression: An optional filter expression
+    :type expression: function
+    :param function: An optional function applied to each matching record
+    :type function: function
+    :return: The matching (mapped) records
+    :rtype: list
+    """
+    if path not in _scan_envs:
+        _scan_envs[path] = lmdb.open(path, readonly=True, max_dbs=1)
+    env = _scan_envs[path]
+    results = []
+    with env.begin() as txn:
+        db = env.open_db(name.encode(), txn=txn, create=False)
+        with txn.cursor(db) as cursor:
+            if not (cursor.set_range(lower) if lower else cursor.first()):
+                return results
+            for key, record in cursor.iternext():
+                if upper and key >= upper:
+                    break
+                try:
+                    record = loads(record.decode())
+                    if callable(expression) and not expression(record):
+                        continue
+                    record['_id'] = key
+                except ValueError:
+                    record = {'_id': key, 'value': record}
+                results.append(function(record) if function else record)
+    return results
+
+
 class Table(object):
     """
     Representation of a database table
@@ -35,6 +340,7 @@ class Table(object):
         self._ctx = ctx
         self._name = name
         self._indexes = {}
+        self._views = {}
         self._open_(txn=txn)
 
     def begin(self):
@@ -50,10 +356,14 @@ class Table(object):
         for index in self.indexes(txn):
             key = _index_name(self, index)
             doc = loads(txn.get(key.encode(), db=self._ctx._meta._db).decode())
-            self._indexes[index] = Index(self._ctx, index, doc['func'], doc['conf'], txn)
+            unique = doc.get('unique', False)
+            self._indexes[index] = Index(self._ctx, index, doc['func'], doc['conf'], txn, unique)
+        for view in self.views(txn):
+            doc = loads(txn.get(_view_name(self, view).encode(), db=self._ctx._meta._db).decode())
+            self._views[view] = MaterializedAggregate(self._ctx, view, doc['pipeline'], doc['conf'], txn)
 
     @write_transaction
-    def append(self, record, txn=None):
+    def append(self, record, txn=None, upsert=False):
         """
         Append a new record to this table
 
@@ -61,7 +371,9 @@ class Table(object):
         :type record: dict
         :param txn: An open transaction
         :type txn: Transaction
-        :raises: xWriteFail on write error
+        :param upsert: On a unique index conflict, merge the record into the existing record
+        :type upsert: bool
+        :raises: xWriteFail on write error, xDuplicateKey on a unique index conflict
         """
         if '_id' not in record:
             key = str(ObjectId()).encode()
@@ -79,11 +391,34 @@ class Table(object):
 
         if '_id' in record:
             del record['_id']
+        unique = [name for name in self._indexes if self._indexes[name].unique]
+        done = []
+        try:
+            for name in unique:
+                self._indexes[name].put(txn, key, record)
+                done.append(name)
+        except xDuplicateKey as error:
+            for name in done:
+                self._indexes[name].delete(txn, key, record)
+            if not upsert:
+                raise
+            existing = error.args[2]
+            doc = txn.get(existing, db=self._db)
+            if not doc: raise xNotFound(existing)
+            doc = loads(doc.decode())
+            doc.update(record)
+            doc['_id'] = existing
+            self.save(doc, txn=txn)
+            record['_id'] = existing
+            return
+
         if not txn.put(key, dumps(record).encode(), db=self._db, append=False): raise xWriteFail(key)
 
         record['_id'] = key
         for name in self._indexes:
-            if not self._indexes[name].put(txn, key, record): raise xWriteFail(name)
+            if name not in unique and not self._indexes[name].put(txn, key, record): raise xWriteFail(name)
+        for view in self._views.values():
+            view.put(txn, key, record)
 
     @write_transaction
     def delete(self, keys, txn=None):
@@ -106,6 +441,8 @@ class Table(object):
             if not txn.delete(key, db=self._db): raise xWriteFail
             for name in self._indexes:
                 self._indexes[name].delete(txn, key, doc)
+            for view in self._views.values():
+                view.delete(txn, key, doc)
 
     @write_transaction
     def save(self, record, txn):
@@ -116,6 +453,7 @@ class Table(object):
         :type record: dict
         :param txn: An open transaction
         :type txn: Transaction
+        :raises: xDuplicateKey on a unique index conflict
         """
         if not '_id' in record: raise xNoKey
         key = record['_id']
@@ -124,12 +462,148 @@ class Table(object):
         doc = txn.get(key, db=self._db)
         if not doc: raise xWriteFail('old record is missing')
         old = loads(doc.decode())
+        self._save_indexes(txn, key, old, rec, self._indexes)
         if not txn.put(key, dumps(rec).encode(), db=self._db): raise xWriteFail('main record')
-        for name in self._indexes:
-            self._indexes[name].save(txn, key, old, rec)
+        for view in self._views.values():
+            view.save(txn, key, old, rec)
         # if self._ctx.binlog:
         #     return diff(old, record, verbose=False)
 
+    @write_transaction
+    def update(self, key, spec, txn=None):
+        """
+        Apply a partial update to a pre-existing record, only indexes that reference one of the
+        modified fields are recomputed
+
+        :param key: The _id of the record to update
+        :type key: bytes
+        :param spec: Update operators, i.e. {'$set': {'status': 'done'}, '$inc': {'count': 1}}
+        :type spec: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The updated record
+        :rtype: dict
+        :raises: xNotFound if the record does not exist
+        """
+        doc = txn.get(key, db=self._db)
+        if not doc: raise xNotFound(key)
+        return self._update(key, loads(doc.decode()), spec, txn)
+
+    @write_transaction
+    def upsert(self, key, spec, txn=None):
+        """
+        Apply a partial update to a record, creating the record if it does not already exist
+
+        :param key: The _id of the record to update or create
+        :type key: bytes
+        :param spec: Update operators, i.e. {'$set': {'status': 'done'}, '$inc': {'count': 1}}
+        :type spec: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The updated (or new) record
+        :rtype: dict
+        """
+        doc = txn.get(key, db=self._db)
+        if doc:
+            return self._update(key, loads(doc.decode()), spec, txn)
+        record, _ = _apply_update({}, spec)
+        record['_id'] = key
+        self.append(record, txn=txn)
+        return record
+
+    @write_transaction
+    def find_and_modify(self, index, record, spec, new=True, upsert=False, txn=None):
+        """
+        Apply a partial update to the first record matching the key in the specified index
+
+        :param index: Name of the index to seek on
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :param spec: Update operators, i.e. {'$set': {'status': 'done'}, '$inc': {'count': 1}}
+        :type spec: dict
+        :param new: Return the record after (True) or before (False) the update
+        :type new: bool
+        :param upsert: Create a new record from the template if no record matches
+        :type upsert: bool
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The matching record, or None
+        :rtype: dict
+        """
+        if index not in self._indexes:
+            raise xIndexMissing(index)
+        key = self._indexes[index].get(txn, record)
+        if not key:
+            if not upsert:
+                return None
+            record, _ = _apply_update(record, spec)
+            self.append(record, txn=txn)
+            return record if new else None
+
+        old = loads(txn.get(key, db=self._db).decode())
+        record = self._update(key, old, spec, txn)
+        if new:
+            return record
+        old['_id'] = key
+        return old
+
+    def _update(self, key, old, spec, txn):
+        """
+        Apply update operators to a record and write it back, updating affected indexes
+
+        :param key: The _id of the record
+        :type key: bytes
+        :param old: The current (decoded) record
+        :type old: dict
+        :param spec: The update operators to apply
+        :type spec: dict
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :return: The updated record
+        :rtype: dict
+        """
+        rec, fields = _apply_update(old, spec)
+        names = [name for name in self._indexes if self._indexes[name].fields & fields]
+        self._save_indexes(txn, key, old, rec, names)
+        if not txn.put(key, dumps(rec).encode(), db=self._db): raise xWriteFail('main record')
+        for view in self._views.values():
+            if view.fields & fields:
+                view.save(txn, key, old, rec)
+        rec['_id'] = key
+        return rec
+
+    def _save_indexes(self, txn, key, old, rec, names):
+        """
+        Update the named indexes to reflect a change to a record, unique indexes are updated
+        first so that a conflict can be backed out before anything else is written
+
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :param key: The _id of the record
+        :type key: bytes
+        :param old: The record in it's previous state
+        :type old: dict
+        :param rec: The record in it's amended state
+        :type rec: dict
+        :param names: The names of the indexes to update
+        :type names: list
+        :raises: xDuplicateKey on a unique index conflict
+        """
+        unique = [name for name in names if self._indexes[name].unique]
+        done = []
+        try:
+            for name in unique:
+                self._indexes[name].save(txn, key, old, rec)
+                done.append(name)
+        except xDuplicateKey:
+            for name in done:
+                self._indexes[name].save(txn, key, rec, old)
+            raise
+        for name in names:
+            if name not in unique:
+                self._indexes[name].save(txn, key, old, rec)
+
     @write_transaction
     def empty(self, txn):
         """
@@ -137,10 +611,12 @@ class Table(object):
         """
         for name in self.indexes(txn):
             self._indexes[name].empty(txn)
+        for view in self._views.values():
+            view.empty(txn)
         txn.drop(self._db, False)
 
     @write_transaction
-    def index(self, name, func=None, duplicates=False, txn=None):
+    def index(self, name, func=None, duplicates=False, txn=None, unique=False):
         """
         Return a reference for a names index, or create if not available
 
@@ -152,21 +628,29 @@ class Table(object):
         :type duplicates: bool
         :param txn: An optional transaction
         :type txn: Transaction
+        :param unique: Whether to raise xDuplicateKey rather than overwrite another record's key
+        :type unique: bool
         :return: A reference to the index, created index, or None if index creation fails
         :rtype: Index
         """
         if name not in self._indexes:
+            if duplicates and unique:
+                raise ValueError('a unique index can not allow duplicates')
             conf = {
                 'key': _index_name(self, name),
                 'dupsort': duplicates,
                 'create': True,
             }
-            self._indexes[name] = Index(self._ctx, name, func, conf, txn)
+            self._indexes[name] = Index(self._ctx, name, func, conf, txn, unique)
             key = _index_name(self, name)
-            val = {'conf': conf, 'func': func}
+            val = {'conf': conf, 'func': func, 'unique': unique}
             val = dumps(val)
             if not txn.put(key.encode(), val.encode(), db=self._ctx._meta._db): raise xWriteFail
-            self._reindex(name, txn)
+            try:
+                self._reindex(name, txn)
+            except xDuplicateKey:
+                self._unindex(name, txn)
+                raise
 
         return self._indexes[name]
 
@@ -196,20 +680,12 @@ class Table(object):
         """
         for name in self.indexes(txn):
             self._unindex(name, txn)
+        for name in list(self._views):
+            self.drop_materialized(name, txn=txn)
         return txn.drop(self._db, True)
 
-    def exists(self, name):
-        """
-        See whether an index already exists or not
-
-        :param name: Name of the index
-        :type name: str
-        :return: True if index already exists
-        :rtype: bool
-        """
-        return name in self._indexes
-
-    def find(self, index=None, expression=None, limit=maxsize, txn=None, abort=False):
+    def find(self, index=None, expression=None, limit=maxsize, txn=None, abort=False, reverse=False, skip=0,
+             after=None):
         """
         Find all records either sequential or based on an index
 
@@ -221,6 +697,12 @@ class Table(object):
         :type limit: int
         :param txn: An optional transaction
         :type txn: Transaction
+        :param reverse: Return records in descending order
+        :type reverse: bool
+        :param skip: The number of (matching) records to skip before returning results
+        :type skip: int
+        :param after: A continuation token (see page), resume with the entry after this position
+        :type after: str
         :return: The next record (generator)
         :rtype: dict
         """
@@ -235,11 +717,13 @@ class Table(object):
                 db = index._db
             with txn.cursor(db) as cursor:
                 count = 0
-                first = True
-                while count < limit:
-                    if not (cursor.first() if first else cursor.next()):
+                after = _read_token(after) if after else None
+                for cursor in _scan(cursor, reverse=reverse, dupsort=index and index.duplicates, after=after):
+                    if count >= limit:
                         break
-                    first = False
+                    if skip and not callable(expression):
+                        skip -= 1
+                        continue
                     record = cursor.value()
                     if index:
                         key = record
@@ -254,15 +738,49 @@ class Table(object):
                         record['_id'] = key
                     except ValueError:
                         record = {'_id': key, 'value': record}
+                    if skip:
+                        skip -= 1
+                        continue
                     yield record
                     count += 1
 
-    def range(self, index, lower=None, upper=None, txn=None, keyonly=False):
+    def parallel_scan(self, expression=None, workers=None, function=None, partitions=4):
         """
-        Find all records with a key >= lower and <= upper. If you set inclusive to false the range
-        becomes key > lower and key < upper. Upper and/or Lower can be set to None, if lower is none
-        the range starts at the beginning of the table, and if upper is None searching will continue
-        to the end.
+        Scan the whole table in natural order across a pool of worker processes. The key space is
+        split into ranges, each worker opens the database read-only and filters (and optionally
+        maps) the records in it's ranges, and the results are streamed back in key order. The
+        expression and function must be picklable, i.e. module level functions.
+
+        :param expression: An optional filter expression
+        :type expression: function
+        :param workers: The number of worker processes (defaults to the number of cpus)
+        :type workers: int
+        :param function: An optional function applied to each matching record in the worker
+        :type function: function
+        :param partitions: The number of key ranges per worker, more ranges balance better
+        :type partitions: int
+        :return: The matching (mapped) records (generator)
+        :rtype: dict
+        """
+        workers = workers or cpu_count()
+        with self.begin() as txn:
+            with txn.cursor(self._db) as cursor:
+                ranges = _split_keys(cursor, workers * partitions)
+        if not ranges:
+            return
+        path = self._ctx.env.path()
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            jobs = [pool.submit(_scan_partition, path, self._name, lower, upper, expression, function)
+                    for lower, upper in ranges]
+            for job in jobs:
+                yield from job.result()
+
+    def range(self, index, lower=None, upper=None, txn=None, keyonly=False, reverse=False, limit=maxsize,
+              skip=0, after=None):
+        """
+        Find all records with a key >= lower and <= upper. Upper and/or Lower can be set to None, if
+        lower is none the range starts at the beginning of the table, and if upper is None searching
+        will continue to the end.
 
         :param index: The name of the index to search
         :type index: str
@@ -272,56 +790,329 @@ class Table(object):
         :type upper: dict
         :param txn: An optional transaction
         :type txn: Transaction
+        :param keyonly: Yield the cursor rather than reading each record
+        :type keyonly: bool
+        :param reverse: Return records in descending order, starting from upper
+        :type reverse: bool
+        :param limit: The maximum number of records to return
+        :type limit: int
+        :param skip: The number of records to skip before returning results
+        :type skip: int
+        :param after: A continuation token (see page), resume with the entry after this position
+        :type after: str
         :return: The records with keys within the specified range (generator)
         :type: dict
         """
         with self.begin() as transaction:
             txn = txn if txn else transaction
+            after = _read_token(after) if after else None
             if not index:
+                lower = lower['_id'] if lower else None
+                upper = upper['_id'] if upper else None
+                count = 0
                 with txn.cursor(self._db) as cursor:
-                    def forward():
-                        if not cursor.next(): return False
-                        if upper and cursor.key() > upper: return False
-                        return True
-
-                    lower = lower['_id'] if lower else None
-                    upper = upper['_id'] if upper else None
-                    inclusive = True
-                    cursor.set_range(lower) if lower else cursor.first()
-                    while not inclusive and cursor.key() == lower:
-                        if not cursor.next() or cursor.key() == upper: return
-                    while True:
-                        key = cursor.key()
-                        if not key: break
-                        record = loads(cursor.value().decode())
-                        record['_id'] = key
-                        if not inclusive:
-                            if not forward(): break
-                            yield record
+                    for cursor in _scan(cursor, lower, upper, reverse, after=after):
+                        if count >= limit:
+                            break
+                        if skip:
+                            skip -= 1
+                            continue
+                        if keyonly:
+                            yield cursor
                         else:
+                            record = loads(cursor.value().decode())
+                            record['_id'] = cursor.key()
                             yield record
-                            if not forward(): break
+                        count += 1
             else:
                 index = self._indexes[index]
+                lower = index.key(lower) if lower else None
+                upper = index.key(upper) if upper else None
+                count = 0
                 with txn.cursor(index._db) as cursor:
-                    if lower:
-                        index.set_range(cursor, lower)
-                        if upper:
-                            have_data = index.match(cursor.key(), lower) >= 0 and index.match(cursor.key(), upper) <= 0
-                        else:
-                            have_data = index.match(cursor.key(), lower) >= 0
-                    else:
-                        have_data = cursor.first()
-                    while have_data:
+                    for cursor in _scan(cursor, lower, upper, reverse, index.duplicates, after):
+                        if count >= limit:
+                            break
+                        if skip:
+                            skip -= 1
+                            continue
                         if keyonly:
                             yield cursor
                         else:
                             record = txn.get(cursor.value(), db=self._db)
-                            if not record: raise xNotFound(cursor.value())
+                            if not record:
+                                raise xNotFound(cursor.value())
                             record = loads(record.decode())
                             record['_id'] = cursor.value()
                             yield record
-                        have_data = index.set_next(cursor, upper) if upper else cursor.next()
+                        count += 1
+
+    def page(self, index=None, lower=None, upper=None, limit=100, token=None, reverse=False, expression=None,
+             txn=None):
+        """
+        Recover a page of records, along with a continuation token which can be passed back in
+        to recover the next page. The token records the last index key and primary key seen, so
+        the next page starts by seeking directly to that position rather than skipping records.
+
+        :param index: The name of the index to use [OR use natural order]
+        :type index: str
+        :param lower: A template record containing the lower end of the range
+        :type lower: dict
+        :param upper: A template record containing the upper end of the range
+        :type upper: dict
+        :param limit: The maximum number of records in the page
+        :type limit: int
+        :param token: The token returned with the previous page
+        :type token: str
+        :param reverse: Page through records in descending order
+        :type reverse: bool
+        :param expression: An optional filter expression
+        :type expression: function
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: A list of records, and the token for the next page (None if there are no more)
+        :rtype: tuple
+        :raises ValueError: If limit is less than 1
+
+        The page is only returned with a token if there is at least one more (matching) record
+        after it, so a range that is an exact multiple of the page size doesn't end with an empty
+        page.
+        """
+        if limit < 1:
+            raise ValueError('page limit must be at least 1, not {}'.format(limit))
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            if index and index not in self._indexes:
+                raise xIndexMissing(index)
+            records = []
+            position = None
+            more = False
+            cursors = self.range(index, lower, upper, txn=txn, keyonly=True, reverse=reverse, after=token)
+            for cursor in cursors:
+                key, value = cursor.item()
+                if index:
+                    current = (key, value)
+                    record, key = txn.get(value, db=self._db), value
+                    if not record:
+                        raise xNotFound(key)
+                else:
+                    current = (key, b'')
+                    record = value
+                record = loads(record.decode())
+                if callable(expression) and not expression(record):
+                    continue
+                if len(records) >= limit:
+                    more = True
+                    break
+                position = current
+                record['_id'] = key
+                records.append(record)
+            return records, _make_token(*position) if more else None
+
+    def aggregate(self, pipeline, index=None, lower=None, upper=None, expression=None, batch=0, txn=None):
+        """
+        Compute grouped aggregates (count, sum, min, max, avg, histogram) in a single streaming
+        pass over the table, or over a range of an index. If the group fields are the leading
+        fields of the index, records arrive in group order and each group is returned as soon as
+        it is complete, otherwise groups are accumulated and returned at the end of the scan.
+        See aggregate.Aggregation for the pipeline format. Over a multikey index each record is
+        only counted once, however many of it's entries fall in the range.
+
+        :param pipeline: The aggregation specification
+        :type pipeline: dict
+        :param index: The name of the index to scan [OR use natural order]
+        :type index: str
+        :param lower: A template record containing the lower end of the range
+        :type lower: dict
+        :param upper: A template record containing the upper end of the range
+        :type upper: dict
+        :param expression: An optional filter expression
+        :type expression: function
+        :param batch: If set, records are aggregated in batches of this size by column
+        :type batch: int
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The results for each group (generator)
+        :rtype: dict
+        """
+        if index and index not in self._indexes:
+            raise xIndexMissing(index)
+        aggregation = Aggregation(pipeline)
+        ordered = bool(index and aggregation.group and self._indexes[index].ordered_by(aggregation.group))
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            records = self.range(index, lower, upper, txn=txn)
+            if index and self._indexes[index].multikey:
+                records = _distinct(records)
+            if callable(expression):
+                records = (record for record in records if expression(record))
+            if batch:
+                rows = []
+                for record in records:
+                    rows.append(record)
+                    if len(rows) < batch:
+                        continue
+                    keys = aggregation.add_batch(rows)
+                    rows = []
+                    if ordered:
+                        yield from aggregation.flush(keys[-1])
+                if rows:
+                    aggregation.add_batch(rows)
+            else:
+                last = None
+                for record in records:
+                    key = aggregation.add(record)
+                    if ordered and key != last:
+                        yield from aggregation.flush(key)
+                        last = key
+            yield from aggregation.flush()
+
+    def to_columns(self, fields, index=None, lower=None, upper=None, expression=None, chunk=4096, arrow=False,
+                   txn=None):
+        """
+        Read a range of records into one typed NumPy array per field, values are converted a chunk
+        at a time into growable buffers. Requires numpy (and pyarrow if arrow is set). Over a
+        multikey index each record is only read once, however many of it's entries are in range.
+
+        :param fields: The (dotted) names of the fields to read, "_id" is the record key
+        :type fields: list
+        :param index: The name of the index to scan [OR use natural order]
+        :type index: str
+        :param lower: A template record containing the lower end of the range
+        :type lower: dict
+        :param upper: A template record containing the upper end of the range
+        :type upper: dict
+        :param expression: An optional filter expression
+        :type expression: function
+        :param chunk: The number of records to convert at a time
+        :type chunk: int
+        :param arrow: Return a pyarrow RecordBatch rather than a dict of arrays
+        :type arrow: bool
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: A dict of field name to numpy array, or a RecordBatch
+        :rtype: dict|pyarrow.RecordBatch
+        """
+        if index and index not in self._indexes:
+            raise xIndexMissing(index)
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            records = self.range(index, lower, upper, txn=txn)
+            if index and self._indexes[index].multikey:
+                records = _distinct(records)
+            if callable(expression):
+                records = filter(expression, records)
+            return to_columns(records, fields, chunk, arrow)
+
+    def count(self, index, record, txn=None):
+        """
+        Count the number of records matching the key in the specified index, this only reads
+        the index and never touches the primary table.
+
+        :param index: Name of the index to count on
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The number of matching records
+        :rtype: int
+        """
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            if index not in self._indexes:
+                raise xIndexMissing(index)
+            index = self._indexes[index]
+            with index.cursor(txn) as cursor:
+                if not index.set_key(cursor, record):
+                    return 0
+                return cursor.count() if index.duplicates else 1
+
+    def count_range(self, index, lower=None, upper=None, txn=None):
+        """
+        Count the number of records with a key >= lower and <= upper in the specified index, this
+        only reads the index and never touches the primary table.
+
+        :param index: Name of the index to count on
+        :type index: str
+        :param lower: A template record containing the lower end of the range
+        :type lower: dict
+        :param upper: A template record containing the upper end of the range
+        :type upper: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The number of records in the range
+        :rtype: int
+        """
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            if index not in self._indexes:
+                raise xIndexMissing(index)
+            index = self._indexes[index]
+            upper = index.key(upper) if upper else None
+            count = 0
+            with index.cursor(txn) as cursor:
+                have_data = index.set_range(cursor, lower) if lower else cursor.first()
+                while have_data:
+                    if upper is not None and cursor.key() > upper:
+                        break
+                    if index.duplicates:
+                        count += cursor.count()
+                        have_data = cursor.next_nodup()
+                    else:
+                        count += 1
+                        have_data = cursor.next()
+            return count
+
+    def exists(self, index, record=None, txn=None):
+        """
+        Test whether a record matching the key in the specified index exists, or if called with
+        only a name, whether the named index exists.
+
+        :param index: Name of the index to check
+        :type index: str
+        :param record: A template record containing the fields to search on
+        :type record: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: True if a matching entry exists
+        :rtype: bool
+        """
+        if record is None:
+            return index in self._indexes
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            if index not in self._indexes:
+                raise xIndexMissing(index)
+            return self._indexes[index].get(txn, record) is not None
+
+    def distinct(self, index, counts=False, txn=None):
+        """
+        Generate each unique key in the specified index, optionally with the number of records
+        sharing that key. This only reads the index and never touches the primary table.
+
+        :param index: Name of the index to walk
+        :type index: str
+        :param counts: Whether to yield (key, count) tuples rather than just keys
+        :type counts: bool
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The next unique key (generator)
+        :rtype: bytes|tuple
+        """
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            if index not in self._indexes:
+                raise xIndexMissing(index)
+            index = self._indexes[index]
+            with index.cursor(txn) as cursor:
+                have_data = cursor.first()
+                while have_data:
+                    if counts:
+                        yield cursor.key(), cursor.count() if index.duplicates else 1
+                    else:
+                        yield cursor.key()
+                    have_data = cursor.next_nodup()
 
     def get(self, key, txn=None, abort=False):
         """
@@ -344,6 +1135,29 @@ class Table(object):
 
             return record
 
+    def get_many(self, keys, txn=None):
+        """
+        Get a number of records by key with one cursor in one transaction, keys that don't exist
+        are skipped and the records come back in the order the keys were supplied
+
+        :param keys: The _id's of the records to get
+        :type keys: list
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The requested records (generator)
+        :rtype: dict
+        """
+        with self.begin() as transaction:
+            txn = txn if txn else transaction
+            with txn.cursor(db=self._db) as cursor:
+                for key, record in cursor.getmulti(keys):
+                    try:
+                        record = loads(record.decode())
+                        record['_id'] = key
+                    except ValueError:
+                        record = {'_id': key, 'value': record}
+                    yield record
+
     def tail(self, key, txn=None):
         """Recover all records from this point onwards
 
@@ -387,7 +1201,7 @@ class Table(object):
                 doc['_id'] = key
                 return doc
 
-    def ensure(self, index, func, duplicates=False, force=False):
+    def ensure(self, index, func, duplicates=False, force=False, unique=False):
         """
         Ensure than an index exists and create if it's missing
 
@@ -399,6 +1213,8 @@ class Table(object):
         :type duplicates: bool
         :param force: whether to force creation even if it already exists
         :type force: bool
+        :param unique: Whether the index should enforce unique keys
+        :type unique: bool
         :return: The index we're checking for
         :rtype: Index
         """
@@ -407,7 +1223,7 @@ class Table(object):
                 self.drop_index(index)
             else:
                 return self._indexes[index]
-        return self.index(index, func, duplicates)
+        return self.index(index, func, duplicates, unique=unique)
 
     @write_transaction
     def reindex(self, txn):
@@ -421,6 +1237,8 @@ class Table(object):
         """
         for name in self._indexes:
             self._reindex(name, txn)
+        for view in self._views.values():
+            self._rebuild(view, txn)
 
     def _reindex(self, name, txn=None):
         """
@@ -434,24 +1252,204 @@ class Table(object):
         :rtype: int
         """
         if name not in self._indexes: raise xIndexMissing
-        index = self._indexes[name]
+        return self._rebuild(self._indexes[name], txn)
 
+    def _rebuild(self, target, txn=None):
+        """
+        Empty an index (or materialized aggregate) and feed every record in the table back into it
+
+        :param target: The index or materialized aggregate to rebuild
+        :type target: Index|MaterializedAggregate
+        :param txn: An open transaction
+        :type txn: Transaction
+        :return: Number of records written
+        :rtype: int
+        """
         with self.begin() as transaction:
             txn = txn if txn else transaction
             count = 0
-            self._indexes[name].empty(txn)
+            target.empty(txn)
 
             with lmdb.Cursor(self._db, txn) as cursor:
                 if cursor.first():
                     while True:
                         record = loads(cursor.value().decode())
-                        if index.put(txn, cursor.key().decode(), record):
+                        if target.put(txn, cursor.key().decode(), record):
                             count += 1
                         if not cursor.next():
                             break
             return count
 
-    def seek(self, index, record, limit=maxsize, txn=None):
+    @write_transaction
+    def materialize(self, name, pipeline=None, txn=None):
+        """
+        Return a reference to a named materialized aggregate, or create it if not available. The
+        per-group results are stored in the database and updated in the same transaction as every
+        append, save, update and delete, so reading a group does not scan the table. Only count,
+        sum, avg and histogram aggregates can be materialized.
+
+        :param name: The name of the aggregate
+        :type name: str
+        :param pipeline: The aggregation specification (see Table.aggregate)
+        :type pipeline: dict
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: A reference to the aggregate
+        :rtype: MaterializedAggregate
+        :raises: xBadOperator if the pipeline can not be maintained incrementally
+        """
+        if name not in self._views:
+            if not pipeline:
+                raise xIndexMissing(name)
+            conf = {
+                'key': _view_name(self, name),
+                'create': True,
+            }
+            view = MaterializedAggregate(self._ctx, name, pipeline, conf, txn)
+            val = dumps({'conf': conf, 'pipeline': pipeline})
+            key = _view_name(self, name).encode()
+            if not txn.put(key, val.encode(), db=self._ctx._meta._db): raise xWriteFail
+            self._rebuild(view, txn)
+            self._views[name] = view
+        return self._views[name]
+
+    @write_transaction
+    def rematerialize(self, name, txn=None):
+        """
+        Rebuild a materialized aggregate from the records in the table
+
+        :param name: The name of the aggregate
+        :type name: str
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: The number of records aggregated
+        :rtype: int
+        """
+        if name not in self._views: raise xIndexMissing(name)
+        return self._rebuild(self._views[name], txn)
+
+    @write_transaction
+    def drop_materialized(self, name, txn=None):
+        """
+        Drop a materialized aggregate
+
+        :param name: The name of the aggregate
+        :type name: str
+        :param txn: An optional transaction
+        :type txn: Transaction
+        """
+        if name not in self._views: raise xIndexMissing(name)
+        self._views.pop(name).drop(txn)
+        if not txn.delete(_view_name(self, name).encode(), db=self._ctx._meta._db): raise xWriteFail
+
+    def views(self, txn=None):
+        """
+        Return a list of the materialized aggregates for this table
+
+        :param txn: An optional transaction
+        :type txn: Transaction
+        :return: Aggregate names
+        :rtype: list
+        """
+        def views_inner():
+            results = []
+            prefix = _view_name(self, '').encode()
+            db = self._ctx.env.open_db(txn=txn)
+            with txn.cursor(db=db) as cursor:
+                if cursor.set_range(prefix):
+                    for name in cursor.iternext(keys=True, values=False):
+                        if not name.startswith(prefix):
+                            break
+                        results.append(name[len(prefix):].decode())
+            return results
+
+        if txn:
+            return views_inner()
+        with self.begin() as txn:
+            return views_inner()
+
+    def load(self, records, batch=10000, progress=None):
+        """
+        Bulk load records into this table. The whole load runs in a single write transaction,
+        records are written in batches, with each batch sorted by _id and appended (rather than
+        inserted) when it sorts after everything already in the table. Indexes are not updated
+        as records are written, instead each index is rebuilt from a sorted list of entries once
+        all the records are in, followed by any materialized aggregates. If anything fails (a
+        unique index finds a duplicate key) the transaction is aborted, so the table and it's
+        indexes are left as they were, and readers never see records without index entries.
+
+        Records are written straight to the table rather than through Database.begin, so a load
+        is not recorded in the binlog, replicas and point in time restores will not see it.
+
+        :param records: The records to load, records without an _id are given a new one
+        :type records: iterable
+        :param batch: The number of records to sort and write at a time
+        :type batch: int
+        :param progress: An optional function called with the number of records loaded so far
+        :type progress: function
+        :return: The number of records loaded
+        :rtype: int
+        :raises: xDuplicateKey if a unique index is violated
+        """
+        def write(rows, cursor):
+            rows.sort(key=itemgetter(0))
+            append = not cursor.last() or cursor.key() < rows[0][0]
+            last = None
+            for key, value in rows:
+                if not cursor.put(key, value, append=append and key != last):
+                    raise xWriteFail(key)
+                last = key
+
+        count = 0
+        rows = []
+        with self._ctx.env.begin(write=True) as txn:
+            with txn.cursor(self._db) as cursor:
+                for record in records:
+                    record = dict(record)
+                    key = record.pop('_id', None) or str(ObjectId())
+                    key = key if isinstance(key, bytes) else str(key).encode()
+                    rows.append((key, dumps(record).encode()))
+                    if len(rows) == batch:
+                        write(rows, cursor)
+                        count += len(rows)
+                        rows = []
+                        if progress:
+                            progress(count)
+                if rows:
+                    write(rows, cursor)
+                    count += len(rows)
+                    if progress:
+                        progress(count)
+            for name in self._indexes:
+                self._bulk_reindex(name, txn)
+            for view in self._views.values():
+                self._rebuild(view, txn)
+        return count
+
+    def _bulk_reindex(self, name, txn):
+        """
+        Rebuild an index by generating all of it's entries, sorting them and appending them
+        to the (emptied) index
+
+        :param name: The name of the index to rebuild
+        :type name: str
+        :param txn: An open (write) transaction
+        :type txn: Transaction
+        :return: The number of index entries written
+        :rtype: int
+        """
+        if name not in self._indexes: raise xIndexMissing
+        index = self._indexes[name]
+        entries = []
+        with txn.cursor(self._db) as cursor:
+            for key, value in cursor.iternext():
+                for ikey in index.keys(loads(value.decode())):
+                    entries.append((ikey, key))
+        entries = index.resolve(sorted(entries))
+        index.empty(txn)
+        return index.load(txn, entries)
+
+    def seek(self, index, record, limit=maxsize, txn=None, reverse=False, skip=0):
         """
         Find all records matching the key in the specified index.
 
@@ -462,6 +1460,10 @@ class Table(object):
         :param limit: maximum number of records to return
         :param txn: An optional transaction
         :type txn: Transaction
+        :param reverse: Return matching records in descending order
+        :type reverse: bool
+        :param skip: The number of matching records to skip before returning results
+        :type skip: int
         :return: The records with matching keys (generator)
         :type: dict
         """
@@ -469,18 +1471,27 @@ class Table(object):
             txn = txn if txn else transaction
             index = self._indexes[index]
             with index.cursor(txn) as cursor:
-                index.set_key(cursor, record)
+                if not index.set_key(cursor, record):
+                    return
+                if not index.duplicates:
+                    step = None
+                elif reverse:
+                    cursor.last_dup()
+                    step = cursor.prev_dup
+                else:
+                    step = cursor.next_dup
                 count = 0
                 while count < limit:
-                    count += 1
-                    if not cursor.key():
-                        break
-                    key = cursor.value()
-                    record = txn.get(key, db=self._db)
-                    record = loads(record.decode())
-                    record['_id'] = key
-                    yield record
-                    if not cursor.next_dup():
+                    if skip:
+                        skip -= 1
+                    else:
+                        key = cursor.value()
+                        record = txn.get(key, db=self._db)
+                        record = loads(record.decode())
+                        record['_id'] = key
+                        yield record
+                        count += 1
+                    if not step or not step():
                         break
 
     def seek_one(self, index, record, txn=None, abort=False):
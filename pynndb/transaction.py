@@ -2,9 +2,17 @@ import lmdb
 from .utils import xWriteFail
 from bson import ObjectId
 from struct import pack, unpack
+from time import perf_counter
 from ujson import dumps
 
 
+def _decode(key):
+    """
+    Make a key JSON serialisable for the binlog
+    """
+    return key.decode() if isinstance(key, bytes) else key
+
+
 class Transaction(object):
 
     def __init__(self, database, write=False, buffers=False):
@@ -18,20 +26,38 @@ class Transaction(object):
     def __enter__(self):
         return self
 
+    @property
+    def tid(self):
+        """
+        PROPERTY - The id of this transaction in the binlog, set once the transaction is committed
+
+        :getter: The transaction id
+        :type: str
+        """
+        return self._tid
+
     def __exit__(self, txn_type, txn_value, traceback):
         self._db._locks = []
         if txn_type or not len(self._transactions):
             self._txn.abort()
             return
         if not self._db.binlog: # or self._replicated:
-            self._txn.commit()
+            self._commit()
             return
 
         self._record_binlog()
-        self._txn.commit()
+        self._commit()
         # self._db._semaphore.release() if self._db._semaphore else None
         self._txn = None
 
+    def _commit(self):
+        metrics = self._db.metrics
+        if not metrics:
+            return self._txn.commit()
+        start = perf_counter()
+        self._txn.commit()
+        metrics.observe('commit_seconds', (), perf_counter() - start)
+
     def _record_binlog(self):
         cursor = self._txn.cursor(db=self._db._binlog)
         key = pack('>Q', 1 if not cursor.last() else unpack('>Q', cursor.key())[0] + 1)
@@ -42,6 +68,8 @@ class Transaction(object):
             'coc': self._coc,
             'tid': self._tid
         }).encode()
+        if self._db.metrics:
+            self._db.metrics.inc('binlog_bytes', (), len(doc))
         if not self._txn.put(key, doc, db=self._db.binlog, append=False):
             raise xWriteFail('Fatal: Unable to record transaction #{}'.format(key))
         if not self._txn.put(self._tid.encode(), key, db=self._db.binidx, append=False):
@@ -50,34 +78,47 @@ class Transaction(object):
     def append(self, table, doc):
         if '_id' not in doc:
             doc['_id'] = str(ObjectId()).encode()
-        self._transactions.append({'cmd': 'add', 'tab': table.name, 'doc': doc})
+        self._transactions.append({
+            'cmd': 'add', 'tab': table.name, 'doc': dict(doc, _id=_decode(doc['_id']))
+        })
         return table.append(doc, txn=self._txn)
 
     def delete(self, table, keys):
-        self._transactions.append({'cmd': 'del', 'tab': table, 'keys': keys})
+        if isinstance(keys, dict):
+            keys = keys['_id']
+        logged = [_decode(key) for key in keys] if isinstance(keys, list) else [_decode(keys)]
+        self._transactions.append({'cmd': 'del', 'tab': table.name, 'keys': logged})
         return table.delete(keys, txn=self._txn)
 
     def save(self, table, doc):
-        delta = table.save(doc, txn=self._txn)
-        self._transactions.append({'cmd': 'upd', 'tab': table, 'key': doc['_id'], 'yyy': delta})
+        table.save(doc, txn=self._txn)
+        self._transactions.append({
+            'cmd': 'sav', 'tab': table.name, 'doc': dict(doc, _id=_decode(doc['_id']))
+        })
+
+    def update(self, table, key, spec):
+        self._transactions.append({'cmd': 'upd', 'tab': table.name, 'key': _decode(key), 'ops': spec})
+        return table.update(key, spec, txn=self._txn)
 
     def empty_table(self, table):
-        self._transactions.append({'cmd': 'emp', 'tab': table})
+        self._transactions.append({'cmd': 'emp', 'tab': table.name})
         return table.empty(txn=self._txn)
 
-    def create_index(self, table, name, func, duplicates):
-        self._transactions.append({'cmd': 'idx', 'tab': table, 'idx': name, 'fun': func, 'dup': duplicates})
-        return table.index(name, func, duplicates, txn=self._txn)
+    def create_index(self, table, name, func, duplicates, unique=False):
+        self._transactions.append({
+            'cmd': 'idx', 'tab': table.name, 'idx': name, 'fun': func, 'dup': duplicates, 'unq': unique
+        })
+        return table.index(name, func, duplicates, txn=self._txn, unique=unique)
 
     def drop_index(self, table, name):
-        self._transactions.append({'cmd': 'uix', 'tab': table, 'idx': name})
+        self._transactions.append({'cmd': 'uix', 'tab': table.name, 'idx': name})
         return table.drop_index(name, txn=self._txn)
 
     def create_table(self, table):
-        self._transactions.append({'cmd': 'cre', 'tab': table})
+        self._transactions.append({'cmd': 'cre', 'tab': table.name})
         return self._db.table(table.name, txn=self._txn)
 
     def drop_table(self, table):
-        self._transactions.append({'cmd': 'drp', 'tab': table})
+        self._transactions.append({'cmd': 'drp', 'tab': table.name})
         return table.drop(txn=self._txn)
 
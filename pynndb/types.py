@@ -1,4 +1,59 @@
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
+from threading import local
+from time import localtime
+
+_clock = local()
+
+
+def current_time():
+    """
+    The time calculated fields treat as "now", the snapshot taken by the innermost snapshot()
+    block on this thread, or else the real time
+    :return: datetime (local)
+    """
+    return getattr(_clock, 'now', None) or datetime.now()
+
+
+@contextmanager
+def snapshot(now=None):
+    """
+    Fix the time used by calculated fields (AgeType) for the duration of a query, so every record
+    sees the same "now" and the clock is only read once
+    :param now: the time to use, defaults to the current time
+    :return: the snapshot time
+    """
+    previous = getattr(_clock, 'now', None)
+    _clock.now = now or datetime.now()
+    try:
+        yield _clock.now
+    finally:
+        _clock.now = previous
+
+
+@lru_cache(maxsize=4096)
+def _strptime(value, fmt):
+    """
+    Parse a date string into a timestamp, memoised as the same dates tend to repeat
+    """
+    return datetime.strptime(value, fmt).timestamp()
+
+
+@lru_cache(maxsize=4096)
+def _strftime(value, fmt):
+    """
+    Format a timestamp as a date string, memoised as the same dates tend to repeat
+    """
+    return datetime.fromtimestamp(value).strftime(fmt)
+
+
+@lru_cache(maxsize=4096)
+def _utcoffset(value):
+    """
+    The local UTC offset (seconds) in force at a timestamp
+    """
+    return localtime(value).tm_gmtoff
 
 
 class BaseType(object):
@@ -38,6 +93,14 @@ class BaseType(object):
         """
         doc[self._base_name] = value
 
+    def from_internal_many(self, docs):
+        """
+        Return the field in 'external' format for a number of records
+        :param docs: the records
+        :return: a list of values, one per record
+        """
+        return [self.from_internal(doc) for doc in docs]
+
 
 class DateType(BaseType):
 
@@ -57,8 +120,17 @@ class DateType(BaseType):
         :param doc: current record
         :return: date (string)
         """
-        val = doc.get(self._base_name, None)
-        return datetime.fromtimestamp(val).strftime(self._format)
+        return _strftime(doc.get(self._base_name, None), self._format)
+
+    def from_internal_many(self, docs):
+        """
+        Convert the dates for a number of records
+        :param docs: the records
+        :return: a list of dates (strings)
+        """
+        name = self._base_name
+        fmt = self._format
+        return [_strftime(doc.get(name, None), fmt) for doc in docs]
 
     def to_internal(self, doc, value):
         """
@@ -67,7 +139,7 @@ class DateType(BaseType):
         :param value: string date
         :return: integer date
         """
-        doc[self._base_name] = datetime.strptime(value, self._format).timestamp()
+        doc[self._base_name] = _strptime(value, self._format)
 
 
 class AgeType(BaseType):
@@ -78,10 +150,36 @@ class AgeType(BaseType):
         :param doc: the current record
         :return: age (integer)
         """
-        now = datetime.now()
-        val = doc.get(self._base_name, now)
-        dob = datetime.fromtimestamp(val)
-        return (now - dob).days // 365
+        now = current_time()
+        val = doc.get(self._base_name, None)
+        if val is None:
+            return 0
+        return (now - datetime.fromtimestamp(val)).days // 365
+
+    def from_internal_many(self, docs):
+        """
+        Calculate the ages for a number of records against a single "now", using NumPy datetime64
+        arithmetic when it's available (each distinct date of birth is only converted to local
+        time once)
+        :param docs: the records
+        :return: a list of ages (integers)
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            with snapshot(current_time()):
+                return [self.from_internal(doc) for doc in docs]
+        now = current_time()
+        name = self._base_name
+        stamps = np.array([doc.get(name, None) for doc in docs], dtype='float64')
+        missing = np.isnan(stamps)
+        stamps[missing] = now.timestamp()
+        values, inverse = np.unique(stamps, return_inverse=True)
+        offsets = np.array([_utcoffset(value) for value in values.tolist()], dtype='float64')[inverse]
+        dobs = ((stamps + offsets) * 1e6).astype('int64').astype('datetime64[us]')
+        ages = (np.datetime64(now, 'us') - dobs) // np.timedelta64(1, 'D') // 365
+        ages[missing] = 0
+        return ages.tolist()
 
 
 class NameType(BaseType):
@@ -35,20 +35,6 @@ def _debug(self, msg):
         print("{}: #{} - {}".format(name, line, msg))
 
 
-def _anonymous(text):
-    """
-    An function used to generate anonymous functions for database indecies
-
-    :param text: The body of the function call to generate
-    :type text: str
-    :return: Anonymous function to calculate key value
-    :rtype: function
-    """
-    scope = {}
-    exec('def func{0}'.format(text), scope)
-    return scope['func']
-
-
 def _index_name(self, name):
     """
     Generate the name of the object in which to store index records
@@ -61,6 +47,18 @@ def _index_name(self, name):
     return '_{}_{}'.format(self._name, name)
 
 
+def _view_name(self, name):
+    """
+    Generate the name of the object in which to store a materialized aggregate
+
+    :param name: The name of the aggregate
+    :type name: str
+    :return: A string representation of the full aggregate name
+    :rtype: str
+    """
+    return '_{}#{}'.format(self._name, name)
+
+
 def semaphore_path(path, peer=None):
     """
     Generate a name/path for a semaphore
@@ -130,3 +128,19 @@ class xDropFail(Exception):
 
 class xNoKey(Exception):
     """No key was specified for operation"""
+
+
+class xBadOperator(Exception):
+    """Exception - unknown or invalid update operator"""
+
+
+class xDuplicateKey(Exception):
+    """Exception - key already exists in a unique index, args are (index, key, existing _id)"""
+
+
+class xBinlogMissing(Exception):
+    """Exception - the binlog does not cover the requested transactions"""
+
+
+class xServerError(Exception):
+    """Exception - the database server failed a request, args are (exception name, message ...)"""
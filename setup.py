@@ -53,8 +53,9 @@ setup(
         'Intended Audience :: Developers',
         'Topic :: Database :: Database Engines/Servers',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
+    python_requires='>=3.7',
     keywords=['pynndb', 'database', 'LMDB', 'python', 'ORM'],
     install_requires=requirements,
     data_files=[('', ['Pipfile', 'requirements.txt'])],
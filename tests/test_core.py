@@ -1,10 +1,27 @@
 #!/usr/bin/python3
 
+import asyncio
+import json
 import unittest
-from pynndb import Database, Table, xIndexMissing, xWriteFail, xTableMissing, size_mb, size_gb
+from pynndb import Database, Table, xIndexMissing, xWriteFail, xTableMissing, size_mb, size_gb, \
+    xBadOperator, xNotFound, xDuplicateKey, xNoKey, xBinlogMissing
+from pynndb.aggregate import Aggregation
+from pynndb.dump import export_table, import_table
+from pynndb.utils import _index_name
+from pynndb.__main__ import main
+from pynndb.sharding import ShardedDatabase
+from pynndb.server import Server, REQUEST, RESPONSE, STATUS_OK, STATUS_ERROR, read_frame, encode_frame
+from pynndb.client import Client, Pool, AsyncClient
+from pynndb import bench
+from pynndb.types import DateType, AgeType, NameType, snapshot, current_time
 from subprocess import call
 from sys import maxsize, _getframe
 from datetime import datetime
+from importlib.util import find_spec
+from io import BytesIO
+from socket import socket, AF_UNIX
+from struct import pack
+from threading import Thread
 
 
 def _debug(self, msg):
@@ -22,6 +39,14 @@ def _debug(self, msg):
         print("{}: #{} - {}".format(name, line, msg))
 
 
+def _older_than_30(doc):
+    return doc['age'] > 30
+
+
+def _name_of(doc):
+    return doc['name']
+
+
 class UnitTests(unittest.TestCase):
 
     _db_name = 'databases/unit-db'
@@ -745,3 +770,919 @@ class UnitTests(unittest.TestCase):
            'sid': '0000b3f9cf2e4b43a6bb7b52e9597000'
         })
         self.assertEqual(len(list(sessions.range('by_expiry', lower={'expiry': 0}, upper={'expiry': now}))), 3)
+
+    def test_31_update(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_age', '{age:03}', duplicates=True)
+        table.index('by_cat', '{cat}', duplicates=True)
+        doc = table.seek_one('by_age', {'age': 3000})
+        result = table.update(doc['_id'], {
+            '$set': {'name': 'Squizzey!', 'address.town': 'Ramsey'},
+            '$inc': {'age': 1, 'visits': 1},
+            '$unset': ['cat'],
+            '$push': {'tags': 'dragon'}
+        })
+        self.assertEqual(result['age'], 3001)
+        self.assertEqual(result['visits'], 1)
+        self.assertEqual(result['address'], {'town': 'Ramsey'})
+        self.assertEqual(result['tags'], ['dragon'])
+        self.assertNotIn('cat', result)
+        doc = table.get(doc['_id'])
+        self.assertEqual(doc, result)
+        self.assertIsNone(table.seek_one('by_age', {'age': 3000}))
+        self.assertEqual(table.seek_one('by_age', {'age': 3001})['name'], 'Squizzey!')
+        self.assertEqual(len(list(table.seek('by_cat', {'cat': 'A'}))), 2)
+        with self.assertRaises(xBadOperator):
+            table.update(doc['_id'], {'$rename': {'name': 'nom'}})
+        with self.assertRaises(xNotFound):
+            table.update(b'missing', {'$inc': {'age': 1}})
+
+    def test_32_upsert_find_and_modify(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_name', '{name}')
+        counters = db.table('counters')
+        doc = counters.upsert(b'counter', {'$inc': {'hits': 1}})
+        self.assertEqual(doc, {'_id': b'counter', 'hits': 1})
+        counters.upsert(b'counter', {'$inc': {'hits': 1}})
+        self.assertEqual(counters.get(b'counter')['hits'], 2)
+
+        old = table.find_and_modify('by_name', {'name': 'John Doe'}, {'$set': {'age': 41}}, new=False)
+        self.assertEqual(old['age'], 40)
+        self.assertEqual(table.seek_one('by_name', {'name': 'John Doe'})['age'], 41)
+        self.assertIsNone(table.find_and_modify('by_name', {'name': 'Nobody'}, {'$set': {'age': 1}}))
+        new = table.find_and_modify('by_name', {'name': 'Nobody'}, {'$set': {'age': 1}}, upsert=True)
+        self.assertEqual(table.seek_one('by_name', {'name': 'Nobody'}), new)
+        self.assertEqual(table.records, len(self._data) + 1)
+
+    def test_33_count_exists_distinct(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_age', '{age:03}', duplicates=True)
+        table.index('by_name', '{name}')
+        self.assertEqual(table.count('by_age', {'age': 40}), 3)
+        self.assertEqual(table.count('by_age', {'age': 21}), 2)
+        self.assertEqual(table.count('by_age', {'age': 99}), 0)
+        self.assertEqual(table.count('by_name', {'name': 'John Doe'}), 1)
+        self.assertEqual(table.count_range('by_age', {'age': 21}, {'age': 45}), 6)
+        self.assertEqual(table.count_range('by_age', {'age': 22}), 5)
+        self.assertEqual(table.count_range('by_age', upper={'age': 40}), 5)
+        self.assertEqual(table.count_range('by_name', {'name': 'J'}, {'name': 'K'}), 3)
+        self.assertTrue(table.exists('by_name', {'name': 'Squizzey'}))
+        self.assertFalse(table.exists('by_name', {'name': 'Nobody'}))
+        self.assertEqual(list(table.distinct('by_age')), [b'021', b'040', b'045', b'3000'])
+        self.assertEqual(dict(table.distinct('by_age', counts=True))[b'040'], 3)
+        self.assertEqual(len(list(table.distinct('by_name'))), len(self._data))
+        with self.assertRaises(xIndexMissing):
+            table.count('fred', {})
+
+    def test_34_multikey_nested_index(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        table.append({'name': 'Tom', 'tags': ['red', 'blue'], 'address': {'town': 'Ramsey'}})
+        table.append({'name': 'Dick', 'tags': ['blue', 'blue', 'green'], 'address': {'town': 'Douglas'}})
+        table.append({'name': 'Harry', 'tags': [], 'address': {'town': 'Ramsey'}})
+        table.index('by_tag', '{tags[]}', duplicates=True)
+        table.index('by_town', '{address.town}|{name}')
+        table.index('by_town_tag', '{address.town}|{tags[]}', duplicates=True)
+        self.assertEqual(table.index('by_tag').count(), 4)
+        self.assertEqual(sorted(doc['name'] for doc in table.seek('by_tag', {'tags': 'blue'})), ['Dick', 'Tom'])
+        self.assertEqual([doc['name'] for doc in table.seek('by_tag', {'tags': 'green'})], ['Dick'])
+        self.assertEqual([doc['name'] for doc in table.find('by_town')], ['Dick', 'Harry', 'Tom'])
+        self.assertEqual(table.count('by_town_tag', {'address': {'town': 'Ramsey'}, 'tags': 'red'}), 1)
+        self.assertTrue(table.index('by_tag').multikey)
+        self.assertFalse(table.index('by_town').multikey)
+        self.assertEqual(list(table.aggregate({'fields': {'n': 'count'}}, 'by_tag')), [{'n': 2}])
+        self.assertEqual(list(table.aggregate({'fields': {'n': 'count'}}, 'by_tag', batch=2)), [{'n': 2}])
+        self.assertEqual(list(table.to_columns(['name'], 'by_tag')['name']), ['Tom', 'Dick'])
+
+        tom = table.seek_one('by_town', {'address': {'town': 'Ramsey'}, 'name': 'Tom'})
+        tom['tags'] = ['blue', 'yellow']
+        table.save(tom)
+        self.assertEqual(table.count('by_tag', {'tags': 'red'}), 0)
+        self.assertEqual(table.count('by_tag', {'tags': 'blue'}), 2)
+        self.assertEqual(table.count('by_tag', {'tags': 'yellow'}), 1)
+        table.update(tom['_id'], {'$push': {'tags': 'red'}, '$set': {'address.town': 'Peel'}})
+        self.assertEqual(table.count('by_tag', {'tags': 'red'}), 1)
+        self.assertEqual(table.count('by_town_tag', {'address': {'town': 'Peel'}, 'tags': 'red'}), 1)
+        self.assertEqual(table.count('by_town_tag', {'address': {'town': 'Ramsey'}, 'tags': 'blue'}), 0)
+
+        table.delete(tom['_id'])
+        self.assertEqual(table.index('by_tag').count(), 2)
+        self.assertEqual(table.index('by_town_tag').count(), 2)
+        table.reindex()
+        self.assertEqual(table.index('by_tag').count(), 2)
+
+    def test_35_sparse_index(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        table.index('by_admin', '{admin}', duplicates=True)
+        table.index('by_cat_age', '{cat}|{age:03}', duplicates=True)
+        self.generate_data(db, self._tb_name)
+        table.append({'name': 'Nobody', 'admin': None, 'cat': None, 'age': 1})
+        self.assertEqual(table.records, len(self._data) + 1)
+        self.assertEqual(table.index('by_admin').count(), 3)
+        self.assertEqual(table.index('by_cat_age').count(), len(self._data))
+        doc = table.seek_one('by_cat_age', {'cat': 'A', 'age': 21})
+        doc['admin'] = None
+        table.save(doc)
+        self.assertEqual(table.index('by_admin').count(), 2)
+        table.delete(doc['_id'])
+        self.assertEqual(table.index('by_cat_age').count(), len(self._data) - 1)
+        with self.assertRaisesRegex(ValueError, '"constant"'):
+            table.index('by_constant', 'constant')
+        self.assertEqual(table.indexes(), ['by_admin', 'by_cat_age'])
+
+    def test_36_unique_index(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        table.index('by_name', '{name}', unique=True)
+        table.index('by_age', '{age:03}', duplicates=True)
+        self.generate_data(db, self._tb_name)
+        with self.assertRaises(xDuplicateKey) as error:
+            table.append({'name': 'John Doe', 'age': 99})
+        existing = table.seek_one('by_name', {'name': 'John Doe'})
+        self.assertEqual(error.exception.args[2], existing['_id'])
+        self.assertEqual(table.records, len(self._data))
+        self.assertEqual(table.index('by_age').count(), len(self._data))
+
+        doc = table.seek_one('by_name', {'name': 'Squizzey'})
+        doc['name'] = 'John Doe'
+        with self.assertRaises(xDuplicateKey):
+            table.save(doc)
+        self.assertEqual(table.seek_one('by_name', {'name': 'Squizzey'})['_id'], doc['_id'])
+        with self.assertRaises(xDuplicateKey):
+            table.update(doc['_id'], {'$set': {'name': 'John Doe', 'age': 1}})
+        self.assertEqual(table.count('by_age', {'age': 1}), 0)
+
+        record = {'name': 'John Doe', 'age': 41}
+        table.append(record, upsert=True)
+        self.assertEqual(record['_id'], existing['_id'])
+        self.assertEqual(table.records, len(self._data))
+        self.assertEqual(table.seek_one('by_name', {'name': 'John Doe'})['age'], 41)
+        self.assertEqual(table.count('by_age', {'age': 40}), 2)
+
+        db.close()
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.assertTrue(table.index('by_name').unique)
+        with self.assertRaises(xDuplicateKey):
+            table.append({'name': 'Jim Smith'})
+        with self.assertRaises(xDuplicateKey):
+            table.index('by_cat', '{cat}', unique=True)
+        self.assertFalse(table.exists('by_cat'))
+        with db.env.begin(write=True) as txn:
+            with self.assertRaises(xDuplicateKey):
+                table.index('by_cat', '{cat}', txn=txn, unique=True)
+        self.assertEqual(table.indexes(), ['by_age', 'by_name'])
+        self.assertNotIn(_index_name(table, 'by_cat'), db.tables_all)
+        db.close()
+
+    def test_37_reverse_limit_skip(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_age', '{age:03}', duplicates=True)
+        table.index('by_name', '{name}')
+        natural = list(table.find())
+        self.assertEqual(list(table.find(reverse=True)), natural[::-1])
+        self.assertEqual(list(table.find(reverse=True, limit=2)), natural[::-1][:2])
+        self.assertEqual(list(table.find(skip=2, limit=3)), natural[2:5])
+        by_age = list(table.find('by_age'))
+        self.assertEqual(list(table.find('by_age', reverse=True)), by_age[::-1])
+        self.assertEqual(list(table.find('by_age', reverse=True, skip=1, limit=2)), by_age[::-1][1:3])
+        over_21 = list(table.find('by_age', expression=lambda doc: doc['age'] > 21, skip=1))
+        self.assertEqual(over_21, [doc for doc in by_age if doc['age'] > 21][1:])
+
+        by_name = list(table.find('by_name'))
+        lower, upper = {'name': 'Fred'}, {'name': 'John Smith'}
+        forward = list(table.range('by_name', lower, upper))
+        self.assertEqual([doc['name'] for doc in forward], ['Fred Bloggs', 'Gareth Bult', 'Gareth Bult1',
+                                                            'Jim Smith', 'John Doe', 'John Smith'])
+        self.assertEqual(list(table.range('by_name', lower, upper, reverse=True)), forward[::-1])
+        self.assertEqual(list(table.range('by_name', upper={'name': 'John'}, reverse=True, limit=2)),
+                         [by_name[3], by_name[2]])
+        self.assertEqual(list(table.range('by_name', reverse=True)), by_name[::-1])
+        self.assertEqual(list(table.range('by_name', lower, upper, skip=4, limit=5)), forward[4:])
+
+        lower, upper = {'age': 21}, {'age': 40}
+        forward = list(table.range('by_age', lower, upper))
+        self.assertEqual(len(forward), 5)
+        self.assertEqual(list(table.range('by_age', lower, upper, reverse=True)), forward[::-1])
+        self.assertEqual(list(table.range('by_age', upper={'age': 39}, reverse=True)), forward[:2][::-1])
+
+        self.assertEqual(list(table.range(None, reverse=True, limit=3)), natural[::-1][:3])
+        lower, upper = {'_id': natural[1]['_id']}, {'_id': natural[4]['_id']}
+        self.assertEqual(list(table.range(None, lower, upper, reverse=True)), natural[1:5][::-1])
+
+        forty = list(table.seek('by_age', {'age': 40}))
+        self.assertEqual(len(forty), 3)
+        self.assertEqual(list(table.seek('by_age', {'age': 40}, reverse=True)), forty[::-1])
+        self.assertEqual(list(table.seek('by_age', {'age': 40}, skip=1, limit=1)), forty[1:2])
+        self.assertEqual(list(table.seek('by_name', {'name': 'John Doe'}, reverse=True))[0]['age'], 40)
+
+    def test_38_page_tokens(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_age', '{age:03}', duplicates=True)
+        table.index('by_name', '{name}')
+        for index in [None, 'by_age', 'by_name']:
+            for reverse in [False, True]:
+                expected = list(table.find(index, reverse=reverse))
+                results, token = [], None
+                while True:
+                    page, token = table.page(index, limit=2, token=token, reverse=reverse)
+                    results += page
+                    if not token:
+                        break
+                self.assertEqual(results, expected)
+
+        page, token = table.page('by_age', limit=3)
+        self.assertEqual([doc['age'] for doc in page], [21, 21, 40])
+        self.assertEqual(list(table.find('by_age', after=token)), list(table.find('by_age'))[3:])
+        page, token = table.page('by_age', {'age': 40}, {'age': 40}, limit=2, token=token)
+        self.assertEqual([doc['age'] for doc in page], [40, 40])
+        self.assertIsNone(token)
+        self.assertEqual(len(table.page('by_age', limit=7)[0]), 7)
+        self.assertIsNone(table.page('by_age', limit=7)[1])
+        self.assertIsNone(table.page(limit=7)[1])
+        with self.assertRaises(ValueError):
+            table.page('by_age', limit=0)
+        for bad in ['not a token!', 'AAAA', 'AAAAEGFi', b'\xff']:
+            with self.assertRaisesRegex(ValueError, 'invalid continuation token'):
+                table.page('by_age', token=bad)
+            with self.assertRaises(ValueError):
+                list(table.find('by_age', after=bad))
+        page, token = table.page('by_age', limit=2, expression=lambda doc: doc['cat'] == 'B')
+        self.assertEqual([doc['cat'] for doc in page], ['B', 'B'])
+        self.assertEqual(len(table.page('by_age', token=token, expression=lambda doc: doc['cat'] == 'B')[0]), 2)
+
+    def test_39_aggregate(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_cat', '{cat}|{name}')
+        table.index('by_age', '{age:03}', duplicates=True)
+        pipeline = {
+            'group': 'cat',
+            'fields': {
+                'people': 'count',
+                'admins': ('count', 'admin'),
+                'total': ('sum', 'age'),
+                'youngest': ('min', 'age'),
+                'oldest': ('max', 'age'),
+                'mean': ('avg', 'age'),
+                'ages': ('histogram', 'age', [40, 100])
+            }
+        }
+        expected = [
+            {'cat': 'A', 'people': 3, 'admins': 1, 'total': 3066, 'youngest': 21, 'oldest': 3000,
+             'mean': 1022.0, 'ages': [1, 1, 1]},
+            {'cat': 'B', 'people': 4, 'admins': 2, 'total': 141, 'youngest': 21, 'oldest': 40,
+             'mean': 35.25, 'ages': [1, 3, 0]}
+        ]
+        self.assertEqual(sorted(table.aggregate(pipeline), key=lambda r: r['cat']), expected)
+        self.assertEqual(list(table.aggregate(pipeline, 'by_cat')), expected)
+        self.assertEqual(sorted(table.aggregate(pipeline, batch=3), key=lambda r: r['cat']), expected)
+        self.assertEqual(list(table.aggregate(pipeline, 'by_cat', batch=2)), expected)
+        self.assertEqual(list(table.aggregate(pipeline, 'by_cat', batch=100)), expected)
+
+        results = table.aggregate({'fields': {'n': 'count', 'total': ('sum', 'age')}}, 'by_age',
+                                  {'age': 40}, {'age': 45})
+        self.assertEqual(list(results), [{'n': 4, 'total': 165}])
+        results = table.aggregate({'group': ['cat', 'admin'], 'fields': {'n': 'count'}},
+                                  expression=lambda doc: doc['age'] < 100)
+        self.assertEqual(sorted(list(results), key=lambda r: (r['cat'], str(r['admin']))), [
+            {'cat': 'A', 'admin': None, 'n': 1}, {'cat': 'A', 'admin': True, 'n': 1},
+            {'cat': 'B', 'admin': None, 'n': 2}, {'cat': 'B', 'admin': True, 'n': 2}])
+        self.assertTrue(table.index('by_cat').ordered_by(['cat']))
+        self.assertFalse(table.index('by_cat').ordered_by(['name']))
+        with self.assertRaises(xBadOperator):
+            list(table.aggregate({'fields': {'n': 'median'}}))
+        with self.assertRaises(xBadOperator):
+            list(table.aggregate({'fields': {'total': ('sum',)}}, batch=10))
+
+        pipeline = {'group': 'cat', 'fields': {'first': ('min', 'name'), 'total': ('sum', 'age')}}
+        expected = sorted(table.aggregate(pipeline), key=lambda r: r['cat'])
+        self.assertEqual(sorted(table.aggregate(pipeline, batch=3), key=lambda r: r['cat']), expected)
+        aggregation = Aggregation(pipeline)
+        aggregation._add_lists(list(table.find()))
+        self.assertEqual(sorted(aggregation.flush(), key=lambda r: r['cat']), expected)
+
+    def test_40_materialized_aggregate(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        pipeline = {
+            'group': 'cat',
+            'fields': {
+                'people': 'count',
+                'total': ('sum', 'age'),
+                'mean': ('avg', 'age'),
+                'ages': ('histogram', 'age', [40, 100])
+            }
+        }
+        view = table.materialize('by_cat', pipeline)
+        self.assertEqual(table.views(), ['by_cat'])
+        self.assertEqual(view.get('A'), {'cat': 'A', 'people': 3, 'total': 3066, 'mean': 1022.0, 'ages': [1, 1, 1]})
+        self.assertEqual(list(view.results()), sorted(table.aggregate(pipeline), key=lambda r: r['cat']))
+
+        table.append({'name': 'Joe Public', 'age': 50, 'cat': 'C'})
+        self.assertEqual(view.get('C'), {'cat': 'C', 'people': 1, 'total': 50, 'mean': 50.0, 'ages': [0, 1, 0]})
+        doc = next(table.find(expression=lambda doc: doc['name'] == 'Joe Public'))
+        table.update(doc['_id'], {'$inc': {'age': 10}})
+        self.assertEqual(view.get('C')['total'], 60)
+        table.update(doc['_id'], {'$set': {'name': 'Joe'}})
+        doc['cat'] = 'A'
+        table.save(doc)
+        self.assertIsNone(view.get('C'))
+        self.assertEqual(view.get(('A',))['people'], 4)
+        table.delete(doc['_id'])
+        self.assertEqual(view.get('A')['total'], 3066)
+
+        expected = list(view.results())
+        db.close()
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.assertEqual(list(table.materialize('by_cat').results()), expected)
+        self.assertEqual(table.rematerialize('by_cat'), 7)
+        self.assertEqual(list(table.materialize('by_cat').results()), expected)
+        table.empty()
+        self.assertEqual(list(table.materialize('by_cat').results()), [])
+        with self.assertRaises(xBadOperator):
+            table.materialize('oldest', {'fields': {'oldest': ('max', 'age')}})
+        table.drop_materialized('by_cat')
+        self.assertEqual(table.views(), [])
+        with self.assertRaises(xIndexMissing):
+            table.materialize('by_cat')
+
+    def test_41_parallel_scan(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        for i in range(50):
+            self.generate_data(db, self._tb_name)
+        self.assertEqual(list(table.parallel_scan(workers=2)), list(table.find()))
+        expected = [doc['name'] for doc in table.find(expression=_older_than_30)]
+        self.assertEqual(list(table.parallel_scan(_older_than_30, workers=2, function=_name_of)), expected)
+        table.empty()
+        self.assertEqual(list(table.parallel_scan(workers=2)), [])
+
+    @unittest.skipUnless(find_spec('numpy'), 'requires numpy')
+    def test_42_to_columns(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_age', '{age:04}', duplicates=True)
+        columns = table.to_columns(['name', 'age', 'admin', 'cat'], chunk=3)
+        self.assertEqual(list(columns['age']), [row['age'] for row in self._data])
+        self.assertEqual(columns['age'].dtype.kind, 'i')
+        self.assertEqual(columns['name'].dtype.kind, 'U')
+        self.assertEqual(list(columns['name']), [row['name'] for row in self._data])
+        self.assertEqual(list(columns['admin']), [row.get('admin') for row in self._data])
+
+        columns = table.to_columns(['_id', 'age'], 'by_age', {'age': 40}, {'age': 45})
+        self.assertEqual(list(columns['age']), [40, 40, 40, 45])
+        self.assertEqual(len(columns['_id']), 4)
+        columns = table.to_columns(['age'], expression=lambda doc: doc['cat'] == 'B')
+        self.assertEqual(list(columns['age']), [40, 40, 40, 21])
+
+        table.update(next(table.find())['_id'], {'$unset': {'age': 1}})
+        columns = table.to_columns(['age', 'missing'], 'by_age', chunk=2)
+        self.assertEqual(columns['age'].dtype.kind, 'i')
+        columns = table.to_columns(['age'], chunk=2)
+        self.assertEqual(columns['age'].dtype.kind, 'f')
+        self.assertNotEqual(columns['age'][0], columns['age'][0])
+        self.assertEqual(list(table.to_columns(['age'], 'by_age', {'age': 5000})['age']), [])
+
+    def test_43_export_import(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.generate_data(db, self._tb_name)
+        table.index('by_name', '{name}', unique=True)
+        table.index('by_age', '{age:04}', duplicates=True)
+        table.index('by_cat', '{cat}')
+        table.materialize('cats', {'group': 'cat', 'fields': {'n': 'count'}})
+        fp = BytesIO()
+        self.assertEqual(export_table(db, self._tb_name, fp), 7)
+        fp.seek(0)
+        with self.assertRaises(xTableMissing):
+            export_table(db, 'missing', BytesIO())
+        self.assertNotIn('missing', db.tables)
+        counts = []
+        with db.env.begin(write=True):
+            thread = Thread(target=lambda: counts.append(export_table(db, self._tb_name, BytesIO())))
+            thread.start()
+            thread.join(10)
+        self.assertEqual(counts, [7])
+        self.assertEqual(import_table(db, fp, name='copy', batch=3), ('copy', 7))
+        copy = db.table('copy')
+        self.assertEqual(list(copy.find()), list(table.find()))
+        for index in ('by_name', 'by_age', 'by_cat'):
+            self.assertEqual(list(copy.find(index)), list(table.find(index)))
+        self.assertTrue(copy.index('by_name').unique)
+        self.assertTrue(copy.index('by_age').duplicates)
+        self.assertEqual(list(copy.materialize('cats').results()), list(table.materialize('cats').results()))
+
+        copy.load([{'_id': 'b', 'name': 'Bee', 'age': 1, 'cat': 'C'}, {'_id': 'a', 'name': 'Ay', 'age': 1, 'cat': 'C'}])
+        self.assertEqual([doc['name'] for doc in copy.seek('by_age', {'age': 1})], ['Ay', 'Bee'])
+        self.assertEqual(copy.seek_one('by_cat', {'cat': 'C'})['name'], 'Bee')
+        with self.assertRaises(xDuplicateKey):
+            copy.load([{'_id': 'c', 'name': 'Cee'}, {'_id': 'b', 'name': 'Replaced'}, {'name': 'Ay'}], batch=2)
+        self.assertEqual(copy.records, 9)
+        self.assertEqual(copy.get(b'b')['name'], 'Bee')
+        self.assertIsNone(copy.get(b'c'))
+        with db.env.begin() as txn:
+            self.assertEqual(txn.stat(copy.index('by_name')._db)['entries'], 9)
+        self.assertEqual(copy.seek_one('by_name', {'name': 'Ay'})['_id'], b'a')
+        db.close()
+
+        path = self._db_name + '.ndjson'
+        main(['export', self._db_name, self._tb_name, '-o', path])
+        main(['import', self._db_name, path, '-t', 'copy2', '-q'])
+        db = Database(self._db_name)
+        self.assertEqual(list(db.table('copy2').find('by_name')), list(db.table(self._tb_name).find('by_name')))
+        db.close()
+        call(['rm', '-f', path])
+
+    def test_44_backup_restore(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        table.index('by_name', '{name}')
+        with db.begin() as txn:
+            for row in self._data[:4]:
+                txn.append(table, dict(row))
+        position = db.backup(self._db_name + '.bak')
+        self.assertEqual(position, db.binlog_position())
+
+        with db.begin() as txn:
+            txn.append(table, dict(self._data[4]))
+            txn.create_index(table, 'by_unique_name', '{name}', False, unique=True)
+        doc = table.seek_one('by_name', {'name': 'Gareth Bult'})
+        with db.begin() as txn:
+            txn.update(table, doc['_id'], {'$inc': {'age': 1}})
+        middle = txn.tid
+        with db.begin() as txn:
+            txn.delete(table, doc['_id'])
+            doc = table.seek_one('by_name', {'name': 'Squizzey'})
+            doc['age'] = 1
+            txn.save(table, doc)
+
+        restored = db.restore(self._db_name + '.bak', until=middle, target=self._db_name + '.pit')
+        names = [(doc['name'], doc['age']) for doc in restored.table(self._tb_name).find('by_name')]
+        self.assertEqual(names, [('Fred Bloggs', 45), ('Gareth Bult', 22), ('John Doe', 40),
+                                 ('John Smith', 40), ('Squizzey', 3000)])
+        self.assertTrue(restored.table(self._tb_name).index('by_unique_name').unique)
+        restored.close()
+        backup = Database(self._db_name + '.bak')
+        self.assertEqual(backup.table(self._tb_name).records, 4)
+        backup.close()
+
+        restored = db.restore(self._db_name + '.bak')
+        self.assertEqual(list(restored.table(self._tb_name).find('by_name')), list(table.find('by_name')))
+        self.assertEqual(restored.binlog_position(), db.binlog_position())
+        restored.close()
+        with self.assertRaises(xNotFound):
+            db.restore(self._db_name + '.bak', until='unknown', target=self._db_name + '.pit2')
+
+        other = Database(self._db_name + '.other')
+        other.table(self._tb_name)
+        self.assertEqual(other.binlog_position()['seq'], 1)
+        other.backup(self._db_name + '.other.bak')
+        other.close()
+        with self.assertRaises(xBinlogMissing):
+            db.restore(self._db_name + '.other.bak', target=self._db_name + '.pit3')
+        call(['rm', '-rf', self._db_name + '.bak', self._db_name + '.pit', self._db_name + '.pit2',
+              self._db_name + '.other', self._db_name + '.other.bak', self._db_name + '.pit3'])
+
+    def test_45_sharded_database(self):
+
+        call(['rm', '-rf', self._db_name + '.shards'])
+        db = ShardedDatabase(self._db_name + '.shards', shards=3)
+        table = db.table(self._tb_name)
+        table.index('by_name', '{name}')
+        table.index('by_age', '{age:04}', duplicates=True)
+        for i in range(10):
+            self.generate_data(db, self._tb_name)
+        self.assertEqual(table.records, 70)
+        self.assertTrue(all(shard.records for shard in table.shards))
+        self.assertEqual(len(list(table.find())), 70)
+        ids = [doc['_id'] for doc in table.find()]
+        self.assertEqual(ids, sorted(ids))
+        ages = [doc['age'] for doc in table.find('by_age')]
+        self.assertEqual(ages, sorted(ages))
+        self.assertEqual([doc['age'] for doc in table.find('by_age', reverse=True, limit=3)], [3000] * 3)
+        self.assertEqual([doc['age'] for doc in table.range('by_age', {'age': 40}, {'age': 40}, skip=25)],
+                         [40] * 5)
+        self.assertEqual(len(list(table.seek('by_age', {'age': 21}))), 20)
+        self.assertEqual(table.count('by_age', {'age': 21}), 20)
+
+        doc = table.get(ids[0])
+        doc['age'] = 99
+        table.save(doc)
+        self.assertEqual(table.get(ids[0])['age'], 99)
+        table.update(ids[0], {'$inc': {'age': 1}})
+        self.assertEqual(table.get(ids[0])['age'], 100)
+        table.delete(ids[0])
+        self.assertIsNone(table.get(ids[0]))
+        self.assertEqual(table.records, 69)
+        db.close()
+
+        db = ShardedDatabase(self._db_name + '.shards')
+        self.assertEqual(len(db.shards), 3)
+        table = db.table('by_cat', shard_key='cat', boundaries=['B', 'C'])
+        self.assertEqual(table.load(self._data + [{'name': 'X', 'cat': 'C'}]), 8)
+        self.assertEqual([shard.records for shard in table.shards], [3, 4, 1])
+        doc = next(table.find(expression=lambda doc: doc['name'] == 'X'))
+        doc['cat'] = 'A'
+        table.save(doc)
+        self.assertEqual([shard.records for shard in table.shards], [4, 4, 0])
+        table.update(doc['_id'], {'$set': {'cat': 'B'}})
+        self.assertEqual([shard.records for shard in table.shards], [3, 5, 0])
+        table.index('by_name', '{name}', unique=True)
+        doc = dict(table.get(doc['_id']), cat='A', name='Squizzey')
+        with self.assertRaises(xDuplicateKey):
+            table.save(doc)
+        with self.assertRaises(xDuplicateKey):
+            table.update(doc['_id'], {'$set': {'cat': 'A', 'name': 'Squizzey'}})
+        self.assertEqual([shard.records for shard in table.shards], [3, 5, 0])
+        self.assertEqual(table.get(doc['_id'])['name'], 'X')
+        self.assertEqual(table.shards[1].get(doc['_id'])['cat'], 'B')
+        with self.assertRaises(xNoKey):
+            table.append({'name': 'no shard key'})
+        self.assertEqual(db.table('by_cat').shard({'cat': 'Z'}), 2)
+        db.drop('by_cat')
+        self.assertEqual(db.tables, [self._tb_name])
+        db.close()
+        call(['rm', '-rf', self._db_name + '.shards'])
+
+        call(['mkdir', '-p', self._db_name + '.shards/2', self._db_name + '.shards/10'])
+        db = ShardedDatabase(self._db_name + '.shards')
+        self.assertEqual([shard._name.split('/')[-1] for shard in db.shards], ['2', '10'])
+        db.close()
+        call(['rm', '-rf', self._db_name + '.shards'])
+
+    def test_46_partitioned_table(self):
+
+        db = Database(self._db_name)
+        events = db.partitioned('events')
+        events.index('by_kind', '{kind}', duplicates=True)
+        day = 86400
+        start = 1792108800  # 2026-10-16 00:00 UTC
+        for hour in range(0, 72, 6):
+            events.append({'when': start + hour * 3600, 'kind': 'tick' if hour % 12 else 'tock', 'hour': hour})
+        self.assertEqual(events.partitions(), ['events@2026-10-16', 'events@2026-10-17', 'events@2026-10-18'])
+        self.assertEqual(events.partitions(start + day, '2026-10-17T23:00:00'), ['events@2026-10-17'])
+        self.assertEqual(events.count(), 12)
+        self.assertEqual(db.table('events@2026-10-17').indexes(), ['by_kind'])
+
+        hours = [doc['hour'] for doc in events.find(lower=start + 18 * 3600, upper=datetime(2026, 10, 17, 12))]
+        self.assertEqual(hours, [18, 24, 30, 36])
+        hours = [doc['hour'] for doc in events.find(lower=start + day, reverse=True, limit=3)]
+        self.assertEqual(hours, [66, 60, 54])
+        self.assertEqual(list(events.find(limit=0)), [])
+        self.assertEqual([doc['hour'] for doc in events.seek('by_kind', {'kind': 'tock'}, lower=start + day)],
+                         [24, 36, 48, 60])
+
+        doc = next(events.find(lower=start + 2 * day))
+        doc['when'] = start
+        seq = db.binlog_position()['seq']
+        events.save(doc)
+        self.assertEqual(db.binlog_position()['seq'], seq + 1)
+        with db.env.begin() as txn:
+            entry = json.loads(txn.get(pack('>Q', seq + 1), db=db.binlog).decode())
+        self.assertEqual([(op['cmd'], op['tab']) for op in entry['txn']],
+                         [('del', 'events@2026-10-18'), ('add', 'events@2026-10-16')])
+        self.assertEqual(events.count(upper=start), 5)
+        self.assertEqual(events.get(doc['_id'])['hour'], 48)
+        events.delete(doc['_id'])
+        self.assertIsNone(events.get(doc['_id']))
+
+        db.close()
+        db = Database(self._db_name)
+        events = db.partitioned('events')
+        self.assertEqual(events.indexes(), ['by_kind'])
+        self.assertEqual(events.expire(start + day), ['events@2026-10-16'])
+        self.assertEqual(events.partitions(), ['events@2026-10-17', 'events@2026-10-18'])
+        events.drop_partition(start + 2 * day)
+        self.assertEqual(events.count(), 4)
+        events.drop()
+        self.assertEqual(db.tables, [])
+
+    def test_47_calculated_types(self):
+
+        dates = DateType('dob')
+        ages = AgeType('dob')
+        names = NameType(('forename', 'surname'))
+        docs = []
+        for date, name in [('01/01/1971', 'tom'), ('29/02/1972', 'dick'), ('01/01/1971', 'harry')]:
+            doc = {'forename': name, 'surname': 'smith'}
+            dates.to_internal(doc, date)
+            docs.append(doc)
+        docs.append({'forename': 'sally'})
+        self.assertEqual(dates.from_internal_many(docs[:3]), ['01/01/1971', '29/02/1972', '01/01/1971'])
+        self.assertEqual(names.from_internal_many(docs), ['tom smith', 'dick smith', 'harry smith', 'sally '])
+        with snapshot(datetime(2026, 2, 28, 12)) as now:
+            self.assertEqual(current_time(), now)
+            self.assertEqual([ages.from_internal(doc) for doc in docs], [55, 54, 55, 0])
+            self.assertEqual(ages.from_internal_many(docs), [55, 54, 55, 0])
+            with snapshot(datetime(2031, 1, 1)):
+                self.assertEqual(ages.from_internal_many(docs[:1]), [60])
+            self.assertEqual(current_time(), now)
+        self.assertNotEqual(current_time(), now)
+
+    def test_48_server(self):
+
+        db = Database(self._db_name)
+        stream = db.table('stream')
+        with db.begin() as txn:
+            for n in range(500):
+                txn.append(stream, {'n': n, 'text': 'x' * 4000})
+        server = Server(db, self._db_name + '.sock').start()
+        try:
+            with Client(server.address) as client:
+                self.assertEqual(client.ping(), 'pong')
+                table = client.table(self._tb_name)
+                table.ensure('by_age', '{age:03}', duplicates=True)
+                records = [dict(doc) for doc in self._data]
+                self.assertEqual(table.load(records, batch=3), 7)
+                self.assertTrue(all(isinstance(doc['_id'], bytes) for doc in records))
+                self.assertEqual(table.records, 7)
+                self.assertEqual(db.table(self._tb_name).get(records[2]['_id'])['name'], 'Fred Bloggs')
+
+                self.assertEqual(table.get(records[1]['_id'])['name'], 'Squizzey')
+                self.assertIsNone(table.get(b'missing'))
+                docs = table.get_many([records[3]['_id'], b'missing', records[0]['_id']])
+                self.assertEqual([doc['name'] for doc in docs], ['John Doe', 'Gareth Bult'])
+                self.assertEqual(len(list(table.find(chunk=2))), 7)
+                self.assertEqual([doc['name'] for doc in table.find(match={'cat': 'A'})],
+                                 ['Gareth Bult', 'Squizzey', 'Fred Bloggs'])
+                self.assertEqual([doc['age'] for doc in table.range('by_age', {'age': 40}, {'age': 45}, limit=3)],
+                                 [40, 40, 40])
+                self.assertEqual(table.count('by_age', {'age': 40}), 3)
+                self.assertEqual([doc['age'] for doc in table.range('by_age', match={'cat': 'B'}, skip=1)],
+                                 [40, 40, 40])
+                self.assertEqual(table.seek_one('by_age', {'age': 3000})['name'], 'Squizzey')
+                with self.assertRaises(xTableMissing):
+                    client.table('misspelt').get(b'missing')
+                with self.assertRaises(xTableMissing):
+                    list(client.table('misspelt').find())
+                self.assertNotIn('misspelt', db.tables)
+
+                doc = table.get(records[0]['_id'])
+                doc['age'] = 22
+                table.save(doc)
+                table.update(doc['_id'], {'$inc': {'age': 1}})
+                self.assertEqual(table.get(doc['_id'])['age'], 23)
+                table.delete(doc)
+                self.assertEqual(table.records, 6)
+
+                partial = table.find(chunk=1)
+                next(partial)
+                partial.close()
+                self.assertEqual(client.pipeline([('records', self._tb_name, {}), ('ping', None, {})]), [6, 'pong'])
+                with self.assertRaises(xIndexMissing):
+                    table.count('nope', {})
+                with self.assertRaises(KeyError):
+                    list(table.seek('nope', {}))
+                self.assertEqual(client.tables, [self._tb_name, 'stream'])
+
+            def worker(n):
+                with Client(server.address) as client:
+                    client.table('workers').load([{'worker': n, 'item': i} for i in range(50)], batch=10)
+            threads = [Thread(target=worker, args=(n,)) for n in range(4)]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+            self.assertEqual(db.table('workers').records, 200)
+
+            with socket(AF_UNIX) as sock:
+                sock.connect(server.address)
+                rfile = sock.makefile('rb')
+                sock.sendall(REQUEST.pack(5, 1) + b'[ping' + encode_frame(REQUEST, 2, {'op': 'ping'}))
+                sock.sendall(encode_frame(REQUEST, 3, ['ping', None, {}]))
+                self.assertEqual(read_frame(rfile, RESPONSE)[:2], (1, STATUS_ERROR))
+                self.assertEqual(read_frame(rfile, RESPONSE)[:2], (2, STATUS_ERROR))
+                self.assertEqual(read_frame(rfile, RESPONSE), (3, STATUS_OK, 'pong'))
+                rfile.close()
+
+            stalled = []
+            for n in range(5):
+                sock = socket(AF_UNIX)
+                sock.connect(server.address)
+                sock.sendall(encode_frame(REQUEST, 1, ['find', 'stream', {'chunk': 1}]))
+                stalled.append(sock)
+            results = []
+            thread = Thread(target=lambda: results.append(Client(server.address).ping()), daemon=True)
+            thread.start()
+            thread.join(10)
+            [sock.close() for sock in stalled]
+            self.assertEqual(results, ['pong'])
+        finally:
+            server.close()
+            db.close()
+
+    def test_49_client_pool_async(self):
+
+        db = Database(self._db_name)
+        server = Server(db, self._db_name + '.sock', workers=4).start()
+        try:
+            with Pool(server.address, size=3) as pool:
+                table = pool.table(self._tb_name)
+                table.ensure('by_age', '{age:03}', duplicates=True)
+                records = [{'n': n, 'age': n % 50} for n in range(300)]
+                table.load(records, batch=100)
+                keys = [doc['_id'] for doc in records]
+
+                requests = []
+                batcher = pool._batcher
+                request = batcher._request
+                batcher._request = lambda op, name, **args: requests.append(len(args['keys'])) or request(op, name, **args)
+                results = {}
+
+                def worker(start):
+                    for key in keys[start::8]:
+                        results[key] = table.get(key)['n']
+                threads = [Thread(target=worker, args=(n,)) for n in range(8)]
+                [thread.start() for thread in threads]
+                [thread.join() for thread in threads]
+                self.assertEqual(results, {doc['_id']: doc['n'] for doc in records})
+                self.assertEqual(sum(requests), 300)
+                self.assertLess(len(requests), 300)
+                self.assertIsNone(table.get(b'missing'))
+
+                client = pool.client()
+                rids = [client.send('seek', self._tb_name, index='by_age', record={'age': age}) for age in range(10)]
+                rids.append(client.send('ping'))
+                self.assertEqual(client.receive(rids[-1]), 'pong')
+                self.assertEqual([len(client.receive(rid)) for rid in reversed(rids[:-1])], [6] * 10)
+
+            async def run():
+                async with await AsyncClient.connect(server.address) as client:
+                    table = client.table(self._tb_name)
+                    docs = await asyncio.gather(*[table.get(key) for key in keys[:50]])
+                    self.assertEqual([doc['n'] for doc in docs], list(range(50)))
+                    self.assertEqual(await table.records, 300)
+                    self.assertEqual(len([doc async for doc in table.seek('by_age', {'age': 7}, chunk=2)]), 6)
+                    doc = {'n': -1, 'age': 7}
+                    await table.append(doc)
+                    self.assertEqual((await table.get(doc['_id']))['n'], -1)
+                    self.assertEqual((await table.seek_one('by_age', {'age': 7}))['age'], 7)
+                    with self.assertRaises(xIndexMissing):
+                        await table.count('nope', {})
+                    self.assertEqual(await client.ping(), 'pong')
+            asyncio.run(run())
+        finally:
+            server.close()
+            db.close()
+
+    def test_50_metrics(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        self.assertIsNone(db.metrics)
+        self.assertNotIn('append', table.__dict__)
+        db.set_metrics()
+        table.index('by_name', '{name}')
+        self.generate_data(db, self._tb_name)
+        doc = table.seek_one('by_name', {'name': 'Squizzey'})
+        self.assertEqual(table.get(doc['_id'])['age'], 3000)
+        self.assertIsNone(table.get(b'missing'))
+        doc['age'] = 3001
+        with db.begin() as txn:
+            txn.save(table, doc)
+        self.assertEqual(len(list(table.find(limit=4))), 4)
+        self.assertEqual(len(list(table.find(expression=lambda doc: doc['cat'] == 'A'))), 3)
+        self.assertEqual(len(list(db.table('other').find())), 0)
+        db.sync(True)
+
+        stats = db.stats()
+        histograms = {(name, tuple(sorted(sample['labels'].items()))): sample
+                      for name, samples in stats['metrics']['histograms'].items() for sample in samples}
+        counters = {(name, tuple(sorted(sample['labels'].items()))): sample['value']
+                    for name, samples in stats['metrics']['counters'].items() for sample in samples}
+        self.assertEqual(histograms[('operation_seconds', (('op', 'append'), ('table', 'demo1')))]['count'], 7)
+        self.assertEqual(histograms[('operation_seconds', (('op', 'get'), ('table', 'demo1')))]['count'], 2)
+        self.assertEqual(histograms[('operation_seconds', (('op', 'find'), ('table', 'other')))]['count'], 1)
+        self.assertEqual(histograms[('fsync_seconds', ())]['count'], 1)
+        self.assertGreaterEqual(histograms[('commit_seconds', ())]['count'], 8)
+        self.assertEqual(histograms[('operation_seconds', (('op', 'save'), ('table', 'demo1')))]['buckets'][-1], ['+Inf', 1])
+        self.assertEqual(counters[('records_read', (('table', 'demo1'),))], 1 + 4 + 7)
+        self.assertEqual(counters[('index_writes', (('index', 'by_name'), ('table', 'demo1')))], 7 + 1)
+        self.assertGreater(counters[('binlog_bytes', ())], 0)
+        self.assertEqual(stats['env']['tables']['demo1']['entries'], 7)
+        self.assertGreater(stats['env']['map_used'], 0)
+
+        text = db.prometheus()
+        self.assertIn('# TYPE pynndb_operation_seconds histogram', text)
+        self.assertIn('pynndb_operation_seconds_count{table="demo1",op="append"} 7', text)
+        self.assertIn('pynndb_index_writes_total{table="demo1",index="by_name"} 8', text)
+        self.assertIn('pynndb_table_entries{table="demo1"} 7', text)
+
+        db.set_metrics(False)
+        self.assertNotIn('append', table.__dict__)
+        self.assertNotIn('put', table._indexes['by_name'].__dict__)
+        self.assertIsNone(db.stats()['metrics'])
+        db.close()
+
+    def test_51_slowlog(self):
+
+        db = Database(self._db_name)
+        table = db.table(self._tb_name)
+        table.index('by_name', '{name}')
+        self.generate_data(db, self._tb_name)
+        self.assertIsNone(db.slowlog)
+        db.set_slowlog(threshold=0, size=3)
+        db.set_metrics()
+
+        results = list(table.find(expression=lambda doc: doc['age'] > 40))
+        self.assertEqual(len(results), 2)
+        entry = db.slowlog.entries()[-1]
+        self.assertEqual(entry['plan'], 'table scan with filter')
+        self.assertEqual((entry['table'], entry['op'], entry['index']), (self._tb_name, 'find', None))
+        self.assertEqual((entry['examined'], entry['returned']), (7, 2))
+        with db.env.begin() as txn:
+            self.assertEqual(entry['bytes'], sum(len(value) for key, value in txn.cursor(table._db)))
+
+        with db.env.begin() as txn:
+            self.assertEqual(len(list(table.seek('by_name', {'name': 'Squizzey'}, 1, txn))), 1)
+        self.assertEqual(table.get(results[0]['_id'])['name'], results[0]['name'])
+        self.assertEqual(len(list(table.range('by_name', {'name': 'F'}, {'name': 'H'}))), 3)
+        entries = db.slowlog.entries()
+        self.assertEqual(len(entries), 3)
+        self.assertEqual([(e['op'], e['plan'], e['index'], e['examined'], e['returned']) for e in entries], [
+            ('seek', 'index seek', 'by_name', 1, 1),
+            ('get', 'key lookup', None, 1, 1),
+            ('range', 'index range', 'by_name', 3, 3)
+        ])
+        counters = {sample['labels']['op']: sample['count']
+                    for sample in db.stats()['metrics']['histograms']['operation_seconds']}
+        self.assertEqual(counters, {'find': 1, 'seek': 1, 'get': 1, 'range': 1})
+
+        db.set_slowlog(threshold=60)
+        list(table.find())
+        self.assertEqual(len(db.slowlog.entries()), 3)
+        db.set_slowlog(False)
+        db.set_slowlog(threshold=0, persist=True)
+        self.assertIsNone(table.get(b'missing'))
+        db.set_slowlog(False)
+        self.assertIsNone(db.slowlog)
+        self.assertEqual(len(list(table.find())), 7)
+        db.set_metrics(False)
+        self.assertFalse({'append', 'find', 'get'} & set(table.__dict__))
+        db.close()
+
+        db = Database(self._db_name)
+        db.set_slowlog(persist=True)
+        stored = db.slowlog.stored()
+        self.assertEqual(len(stored), 1)
+        self.assertEqual((stored[0]['op'], stored[0]['examined'], stored[0]['returned']), ('get', 0, 0))
+        db.close()
+
+    def test_52_bench(self):
+
+        results = bench.run(records=50, sizes=[10], indexes=[0, 1], binlog=[True], repeat=1, directory='databases')
+        self.assertEqual(results['meta']['records'], 50)
+        ops = {(result['op'], result['indexes']) for result in results['results']}
+        for op in ('append_single', 'append_batch', 'get', 'find_filter', 'export_ndjson', 'import_ndjson',
+                   'save', 'delete'):
+            self.assertIn((op, 0), ops)
+            self.assertIn((op, 1), ops)
+        for op in ('seek', 'range', 'reindex'):
+            self.assertNotIn((op, 0), ops)
+            self.assertIn((op, 1), ops)
+        self.assertTrue(all(result['rate'] > 0 and result['count'] for result in results['results']))
+
+        baseline = {'results': [dict(result, rate=result['rate'] * 2) for result in results['results'][:3]]}
+        comparison = bench.compare(results, baseline, tolerance=0.4)
+        self.assertEqual(len(comparison), 3)
+        self.assertTrue(all(entry['regression'] and round(entry['change'], 6) == -0.5 for entry in comparison))
+        self.assertFalse(any(entry['regression'] for entry in bench.compare(results, results)))
+
+        try:
+            with open('databases/bench.json', 'w') as io:
+                io.write(json.dumps(baseline))
+            args = ['-n', '20', '-s', '10', '-i', '0', '--binlog', 'off', '-r', '1', '-q', '-d', 'databases']
+            args += ['-o', 'databases/bench-out.json', '-b', 'databases/bench.json', '-t', '1000']
+            self.assertEqual(bench.main(args), 0)
+            with open('databases/bench-out.json') as io:
+                self.assertIn('comparison', json.load(io))
+        finally:
+            call(['rm', '-f', 'databases/bench.json', 'databases/bench-out.json'])
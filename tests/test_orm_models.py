@@ -0,0 +1,212 @@
+import unittest
+from pynndb import Database
+from pynndb.types import DateType, AgeType, NameType, snapshot
+from pynndb.models import ManyToMany, Table, Session, BaseModel
+from subprocess import call
+from datetime import datetime
+from io import StringIO
+
+
+class UserModel(Table):
+    """
+    Model definition for objects of type 'UserModel'
+
+    _calculated holds field definitions for all customised fields we want to use.
+    _display holds field definitions for the 'list' function
+    """
+    _calculated = {
+        'dob_ddmmyyyy': DateType('dob'),
+        'age': AgeType('dob'),
+        'name': NameType(('forename', 'surname'))
+    }
+    _display = [
+        {'name': 'name', 'width': 30, 'precision': 30},
+        {'name': 'age', 'width': 3},
+        {'name': 'dob_ddmmyyyy', 'width': 10},
+        {'name': 'postcodes', 'width': 20, 'precision': 20, 'function': '_postcodes'}
+    ]
+
+    def _postcodes(self, doc):
+        doc.__setattr__('postcodes', 'Ok')
+
+
+class AddressModel(Table):
+
+    _calculated = {
+    }
+    _display = [
+        {'name': 'uuid', 'width': 24},
+        {'name': 'line1', 'width': 30, 'precision': 30},
+        {'name': 'line2', 'width': 30, 'precision': 30},
+        {'name': 'line3', 'width': 30, 'precision': 30},
+        {'name': 'line4', 'width': 30, 'precision': 30},
+        {'name': 'postcode', 'width': 9, 'precision': 9},
+    ]
+
+
+class UnitTests(unittest.TestCase):
+
+    _db_name = 'databases/test_orm_models'
+
+    def setUp(self):
+        call(['rm', '-rf', self._db_name])
+        self._database = Database(self._db_name, {'env': {'map_size': 1024 * 1024 * 10}})
+        self._user_model = UserModel(table=self._database.table('users'))
+        self._address_model = AddressModel(table=self._database.table('addresses'))
+        self._links = ManyToMany(self._database, self._user_model, self._address_model)
+
+    def tearDown(self):
+        self._database.close()
+        call(['rm', '-rf', self._db_name])
+
+    def generate_data_1(self):
+        self._user_model.add({"forename":"tom", "surname": "smith", "dob_ddmmyyyy": "01/01/1971", "uid": 1})
+        self._user_model.add({"forename":"dick", "surname": "smith", "dob_ddmmyyyy": "01/01/1972", "uid": 2})
+        self._user_model.add({"forename":"harry", "surname": "smith", "dob_ddmmyyyy": "01/01/1973", "uid": 3})
+        self._user_model.add({"forename":"sally", "surname": "jones", "dob_ddmmyyyy": "01/01/1969", "uid": 4})
+        self._user_model.add({"forename":"mary", "surname": "jones", "dob_ddmmyyyy": "01/01/1968", "uid": 5})
+        self._user_model.add({"forename":"sophie", "surname": "jones", "dob_ddmmyyyy": "01/01/1967", "uid": 6})
+        self._user_model.add({"forename":"joker", "surname": "wildcard", "dob_ddmmyyyy": "01/01/1966", "uid": 7})
+        self._address_model.add({"line1":"Address line 1 # 1", "line2": "Address line 21","postcode":"CFXX 1AA"})
+        self._address_model.add({"line1":"Address line 1 # 2", "line2": "Address line 22","postcode":"CFXX 1BB"})
+        self._address_model.add({"line1":"Address line 1 # 3", "line2": "Address line 23","postcode":"CFXX 1CC"})
+        self._address_model.add({"line1":"Address line 1 # 4", "line2": "Address line 24","postcode":"CFXX 1DD"})
+
+    def test_01_prefetch(self):
+        self.generate_data_1()
+        users = list(self._user_model.find())
+        for index, user in enumerate(users[:3]):
+            for n in range(index + 1):
+                user.addresses.append({'line1': 'user {} address {}'.format(index, n), 'postcode': str(n)})
+            user.save()
+
+        expected = [[address.line1 for address in user.addresses] for user in self._user_model.find()]
+        self.assertEqual([len(addresses) for addresses in expected], [1, 2, 3, 0, 0, 0, 0])
+        addresses = self._address_model._table
+        calls = []
+        addresses.get = lambda *args, **kwargs: calls.append('get')
+        get_many = addresses.get_many
+        addresses.get_many = lambda *args, **kwargs: calls.append('get_many') or get_many(*args, **kwargs)
+        users = list(self._user_model.find(prefetch=True, prefetch_size=2))
+        del addresses.get, addresses.get_many
+        self.assertEqual(calls, ['get_many'] * 4)
+        self.assertTrue(all('addresses' in user._map for user in users))
+        self.assertEqual([[address.line1 for address in user.addresses] for user in users], expected)
+        self.assertFalse(any(address.is_dirty() for user in users for address in user.addresses))
+
+        users[1].addresses[0].postcode = 'CHANGED'
+        users[1].save()
+        user = list(self._user_model.find(prefetch=['addresses']))[1]
+        self.assertEqual(user.addresses[0].postcode, 'CHANGED')
+        self.assertEqual(len(user.addresses), 2)
+
+    def test_02_session(self):
+        self.generate_data_1()
+        users = list(self._user_model.find())
+        with Session(self._database) as session:
+            for user in users[:2]:
+                user.surname = 'session'
+                user.addresses.append({'line1': 'shared', 'postcode': user.forename})
+                session.add(user)
+            session.add(self._user_model.find().__next__())
+            session.add(BaseModel({'forename': 'new', 'surname': 'session'}, instance=self._user_model))
+        self.assertEqual(self._user_model._table.records, 8)
+        users = list(self._user_model.find(prefetch=True))
+        self.assertEqual([user.surname for user in users[:2]], ['session', 'session'])
+        self.assertEqual([user.addresses[0].postcode for user in users[:2]], ['tom', 'dick'])
+
+        users[0].surname = 'rolled back'
+        users[0].addresses[0].postcode = 'rolled back'
+        del users[1].addresses[0]
+        users[2].bad = {1, 2}
+        with self.assertRaises(TypeError):
+            with Session(self._database) as session:
+                session.add(*users[:3])
+        users = list(self._user_model.find(prefetch=True))
+        self.assertEqual(users[0].surname, 'session')
+        self.assertEqual(users[0].addresses[0].postcode, 'tom')
+        self.assertEqual(len(users[1].addresses), 1)
+
+    def test_03_model_class(self):
+        self.generate_data_1()
+        user = self._user_model.find().__next__()
+        self.assertIs(type(user), BaseModel)
+        user.ad_hoc = True
+        self.assertTrue(user.ad_hoc)
+
+        class SlotUserModel(UserModel):
+            _slots = True
+        self._user_model = SlotUserModel(table=self._database.table('users'))
+        self._links = ManyToMany(self._database, self._user_model, self._address_model)
+        cls = self._user_model.model_class
+        self.assertIs(cls, self._user_model.model_class)
+        user = self._user_model.find().__next__()
+        self.assertIsInstance(user, cls)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertEqual((user.name, user.forename, user.missing), ('tom smith', 'tom', ''))
+        self.assertEqual(user.dob_ddmmyyyy, '01/01/1971')
+        self.assertIsNone(user._map)
+
+        user.dob_ddmmyyyy = '02/02/1972'
+        user.forename = 'thomas'
+        user.addresses.append({'line1': 'slots', 'postcode': 'SL1'})
+        self.assertTrue(user.is_dirty())
+        user.save()
+        user = self._user_model.get(user.doc()['_id'])
+        self.assertEqual((user.name, user.dob_ddmmyyyy), ('thomas smith', '02/02/1972'))
+        self.assertEqual([address.postcode for address in user.addresses], ['SL1'])
+        plain = UserModel(table=self._database.table('users'))
+        self.assertIsInstance(plain.get(user.doc()['_id']), BaseModel)
+
+    def test_04_list_output(self):
+        self.generate_data_1()
+        output = StringIO()
+        with snapshot(datetime(2018, 6, 1)):
+            self.assertEqual(self._user_model.list(output=output, batch=3), 7)
+        lines = output.getvalue().split('\n')
+        self.assertEqual(len(lines), 7 + 5)
+        self.assertEqual(lines[0], lines[2])
+        self.assertEqual(lines[3], '| tom smith                      |  47 | 01/01/1971 | Ok                   | ')
+        self.assertEqual(lines[-2], lines[0])
+
+        uuids = [user.uuid for user in self._user_model.find()]
+        output = StringIO()
+        self._user_model.list(uuids[4], 'missing', uuids[1], output=output)
+        names = [line.split('|')[1].strip() for line in output.getvalue().split('\n')[3:-2]]
+        self.assertEqual(names, ['mary jones', 'dick smith'])
+
+    def test_05_failed_flush(self):
+        self.generate_data_1()
+        user = self._user_model.find().__next__()
+        user.surname = 'x'
+        user.addresses.append({'line1': 'new', 'postcode': 'N1'})
+        new = BaseModel({'forename': 'new', 'surname': 'user'}, instance=self._user_model)
+        bad = BaseModel({'forename': 'bad', 'surname': 'user'}, instance=self._user_model)
+        bad.extra = {1, 2}
+        session = Session(self._database)
+        session.add(user, new, bad)
+        with self.assertRaises(TypeError):
+            session.flush()
+        self.assertTrue(user.is_dirty())
+        self.assertTrue(user.addresses[0].is_new())
+        self.assertTrue(new.is_new())
+        self.assertEqual(self._user_model._table.records, 7)
+        self.assertEqual(self._user_model.get(user.doc()['_id']).surname, 'smith')
+
+        bad.extra = 'fixed'
+        self.assertEqual(session.flush(), 3)
+        self.assertFalse(user.is_dirty())
+        self.assertEqual(self._user_model._table.records, 9)
+        user = self._user_model.get(user.doc()['_id'])
+        self.assertEqual(user.surname, 'x')
+        self.assertEqual([address.postcode for address in user.addresses], ['N1'])
+        self.assertEqual(session.flush(), 0)
+
+        user.surname = 'y'
+        user.bad = {1, 2}
+        with self.assertRaises(TypeError):
+            user.save()
+        self.assertTrue(user.is_dirty())
+        user.bad = None
+        user.save()
+        self.assertEqual(self._user_model.get(user.doc()['_id']).surname, 'y')